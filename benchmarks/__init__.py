@@ -0,0 +1,26 @@
+# encoding: utf-8
+'''
+benchmarks -- performance measurements for vanswap_ofx
+
+  corpus:   generates synthetic OFX files, with a controllable mix of
+            transactions, line endings and encodings
+  runner:   times the repair phases on a corpus, and saves and compares
+            baselines, to catch regressions
+  scaling:  checks that OFXRepairer.repair() runs in linear time
+  startup:  times interpreter startup, import and a one-file CLI run,
+            and fails if they exceed a budget
+  rules:    checks that repair() time stays flat as --rules grows
+  parallel: compares repair() with repair_parallel() on one big file
+  overhead: times the per-file cost of a batch of small files, with
+            and without a RepairSession
+
+Each is run as a module, from the top directory, e.g. the command:
+    python -m benchmarks.runner --transactions 1000,100000
+Importing this package first puts src/ on sys.path, for vanswap_ofx.
+'''
+
+import sys
+import os.path
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
@@ -0,0 +1,133 @@
+# encoding: utf-8
+'''
+corpus -- generate synthetic OFX files for benchmarks
+
+The files look like the ones Vancity generates: a SGML header, then one
+statement with the requested number of transactions. Some transactions
+have only a <NAME>, like interest credits and fees. The rest have a
+<NAME> and a <MEMO>, the swapped ones the repair fixes, and some of
+those memos end in a "Confirmation #" number.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.corpus -n 100000 -o big.ofx
+'''
+
+import sys
+import random
+from argparse import ArgumentParser
+
+# Header lines, by encoding. utf-8 files say so; cp1252 files say USASCII.
+HEADERS = {
+    'cp1252': ['OFXHEADER:100', 'DATA:OFXSGML', 'VERSION:102', 'SECURITY:NONE',
+               'ENCODING:USASCII', 'CHARSET:1252', 'COMPRESSION:NONE',
+               'OLDFILEUID:NONE', 'NEWFILEUID:NONE'],
+    'utf-8': ['OFXHEADER:100', 'DATA:OFXSGML', 'VERSION:102', 'SECURITY:NONE',
+              'ENCODING:UTF-8', 'CHARSET:NONE', 'COMPRESSION:NONE',
+              'OLDFILEUID:NONE', 'NEWFILEUID:NONE'],
+}
+NEWLINES = {'lf': '\n', 'crlf': '\r\n'}
+
+NAMES = [u'Bill payment online', u'Funds transfer online', u'Point of sale',
+         u'Payment', u'Pré-autorisé débit', u'Cheque deposit']
+MEMOS = [u'HYDRO 8509', u'TELUS MOBILITY', u'VISA', u'CAFÉ MONTRÉAL',
+         u'from Pay As You Go Chequing', u'FortisBC Gas']
+NAME_ONLY = [u'Interest credited to account', u'Service charge', u'Overdraft fee']
+
+def generate_ofx(transactions=1000, memo_ratio=0.8, conf_ratio=0.5, indent=1,
+                 newline='lf', encoding='cp1252', seed=0):
+    '''generate_ofx(transactions, ...): return the bytes of a synthetic OFX file
+
+    transactions: number of <STMTTRN> elements
+    memo_ratio:   fraction of transactions with both <NAME> and <MEMO>
+    conf_ratio:   fraction of <MEMO>s ending in a "Confirmation #" number
+    indent:       spaces of indentation per element level
+    newline:      'lf' or 'crlf'
+    encoding:     'cp1252' or 'utf-8'
+    seed:         seed for the random choices, so a corpus can be repeated
+    '''
+    return u''.join(iter_ofx(transactions, memo_ratio, conf_ratio, indent, newline,
+                             encoding, seed)).encode(encoding)
+
+def iter_ofx(transactions=1000, memo_ratio=0.8, conf_ratio=0.5, indent=1,
+             newline='lf', encoding='cp1252', seed=0):
+    '''iter_ofx(transactions, ...): yield the text of a synthetic OFX file
+
+    Takes the same arguments as generate_ofx(). Yields one transaction at
+    a time, so large corpora can be written without holding them in memory.
+    '''
+    rnd = random.Random(seed)
+    nl = NEWLINES[newline]
+    def lines(level, *elements):
+        return u''.join(u' ' * (indent * level) + e + nl for e in elements)
+
+    yield nl.join(HEADERS[encoding]) + nl + nl
+    yield lines(0, u'<OFX>')
+    yield lines(1, u'<SIGNONMSGSRSV1>')
+    yield lines(2, u'<SONRS>')
+    yield lines(3, u'<STATUS>')
+    yield lines(4, u'<CODE>0', u'<SEVERITY>INFO')
+    yield lines(3, u'</STATUS>', u'<DTSERVER>20170325120000[-8:PST]', u'<LANGUAGE>ENG')
+    yield lines(2, u'</SONRS>')
+    yield lines(1, u'</SIGNONMSGSRSV1>', u'<BANKMSGSRSV1>')
+    yield lines(2, u'<STMTTRNRS>')
+    yield lines(3, u'<TRNUID>1', u'<STMTRS>')
+    yield lines(4, u'<CURDEF>CAD', u'<BANKTRANLIST>')
+    yield lines(5, u'<DTSTART>20161101000000[-8:PST]', u'<DTEND>20170325000000[-8:PST]')
+    for i in range(transactions):
+        amount = rnd.randint(1, 500000)
+        fields = [u'<TRNTYPE>DEBIT',
+                  u'<DTPOSTED>2017%02d%02d000000[-8:PST]' % (1 + i // 28 % 12, 1 + i % 28),
+                  u'<TRNAMT>-%d.%02d' % (amount // 100, amount % 100),
+                  u'<FITID>25.030001    %013d' % (1790116941000 + i)]
+        if rnd.random() < memo_ratio:
+            memo = rnd.choice(MEMOS)
+            if rnd.random() < conf_ratio:
+                memo += u' Confirmation #%d' % rnd.randint(100000, 999999)
+            fields += [u'<NAME>' + rnd.choice(NAMES), u'<MEMO>' + memo]
+        else:
+            fields += [u'<NAME>' + rnd.choice(NAME_ONLY)]
+        yield lines(5, u'<STMTTRN>') + lines(6, *fields) + lines(5, u'</STMTTRN>')
+    yield lines(4, u'</BANKTRANLIST>', u'<LEDGERBAL>')
+    yield lines(5, u'<BALAMT>1234.56', u'<DTASOF>20170325000000[-8:PST]')
+    yield lines(4, u'</LEDGERBAL>')
+    yield lines(3, u'</STMTRS>')
+    yield lines(2, u'</STMTTRNRS>')
+    yield lines(1, u'</BANKMSGSRSV1>')
+    yield lines(0, u'</OFX>')
+
+def add_corpus_arguments(parser):
+    '''add_corpus_arguments(parser): add generate_ofx()'s options to parser'''
+    parser.add_argument("--memo-ratio", dest="memo_ratio", type=float, default=0.8,
+                        help="fraction of transactions with a <MEMO> [default: %(default)s]")
+    parser.add_argument("--conf-ratio", dest="conf_ratio", type=float, default=0.5,
+                        help="fraction of <MEMO>s with a Confirmation # [default: %(default)s]")
+    parser.add_argument("--indent", dest="indent", type=int, default=1,
+                        help="spaces of indentation per level [default: %(default)s]")
+    parser.add_argument("--newline", dest="newline", choices=sorted(NEWLINES), default='lf',
+                        help="line ending [default: %(default)s]")
+    parser.add_argument("--encoding", dest="encoding", choices=sorted(HEADERS), default='cp1252',
+                        help="file encoding [default: %(default)s]")
+    parser.add_argument("--seed", dest="seed", type=int, default=0,
+                        help="random seed [default: %(default)s]")
+
+def corpus_options(args):
+    '''corpus_options(args): generate_ofx() keyword arguments from parsed args'''
+    return dict(memo_ratio=args.memo_ratio, conf_ratio=args.conf_ratio, indent=args.indent,
+                newline=args.newline, encoding=args.encoding, seed=args.seed)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("-n", "--transactions", dest="transactions", type=int, default=1000,
+                        help="number of transactions [default: %(default)s]")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="path of the OFX file to write")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.output, 'wb') as f:
+        for text in iter_ofx(args.transactions, **corpus_options(args)):
+            f.write(text.encode(args.encoding))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
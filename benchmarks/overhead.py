@@ -0,0 +1,97 @@
+# encoding: utf-8
+'''
+overhead -- time the per-file cost of repairing a batch of small files
+
+Writes --files small generated OFX files, like monthly statements, and
+repairs the batch twice, replacing the outputs: once with repair_path()
+setting up each file afresh, and once through one RepairSession. For
+each way, prints the microseconds per file spent in each phase of the
+repair, as RepairMetrics times them, and in 'other': opening, closing
+and the bookkeeping around them. 'repair only' is the least either way
+could take, OFXRepairer.repair() alone on each file's body.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.overhead --files 2000 --transactions 10
+'''
+
+import sys
+import os.path
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from vanswap_ofx import OFXRepairer, RepairMetrics, RepairSession, repair_path
+
+from benchmarks.corpus import iter_ofx, add_corpus_arguments, corpus_options
+
+def write_files(workdir, files, transactions, options):
+    '''write_files(workdir, files, transactions, options): write the batch; return its paths'''
+    paths = []
+    for i in range(files):
+        options = dict(options, seed=i)
+        path = os.path.join(workdir, 'statement{0:05}.ofx'.format(i))
+        with open(path, 'wb') as f:
+            f.write(u''.join(iter_ofx(transactions, **options)).encode(options['encoding']))
+        paths.append(path)
+    return paths
+
+def time_batch(paths, repair):
+    '''time_batch(paths, repair): (seconds, phase seconds) of repair(path, metrics) on each path'''
+    phases = dict((p, 0.0) for p in RepairMetrics.PHASES)
+    start = time.time()
+    for path in paths:
+        metrics = RepairMetrics()
+        ok = repair(path, metrics)[0]
+        if not ok:
+            raise RuntimeError('Repair failed: {0}'.format(path))
+        for p, seconds in metrics.seconds.items():
+            phases[p] += seconds
+    return time.time() - start, phases
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--files", dest="files", type=int, default=2000,
+                        help="files in the batch [default: %(default)s]")
+    parser.add_argument("--transactions", dest="transactions", type=int, default=10,
+                        help="transactions per file [default: %(default)s]")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    options = corpus_options(args)
+    workdir = tempfile.mkdtemp(prefix='vanswap_bench')
+    try:
+        paths = write_files(workdir, args.files, args.transactions, options)
+        session = RepairSession()
+        ways = [('repair_path', lambda path, metrics: repair_path(path, replace=True, metrics=metrics)),
+                ('session', lambda path, metrics: session.repair_path(path, replace=True, metrics=metrics))]
+        results = []
+        for name, repair in ways:
+            time_batch(paths[:10], repair)  # warm up
+            results.append((name,) + time_batch(paths, repair))
+
+        r = OFXRepairer(None)
+        bodies = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                bodies.append(r.split_input(f.read().decode(options['encoding']))[1])
+        start = time.time()
+        for body in bodies:
+            r.repair(body)
+        repair_only = time.time() - start
+    finally:
+        shutil.rmtree(workdir)
+
+    per_file = 1e6 / args.files
+    columns = RepairMetrics.PHASES + ['other', 'total']
+    print('{0:<12}'.format('us/file') + ''.join('{0:>12}'.format(c) for c in columns))
+    for name, seconds, phases in results:
+        values = [phases[p] for p in RepairMetrics.PHASES]
+        values += [seconds - sum(values), seconds]
+        print('{0:<12}'.format(name) + ''.join('{0:>12.1f}'.format(v * per_file) for v in values))
+    print('{0:<12}{1:>12.1f}'.format('repair only', repair_only * per_file))
+    print('Session speedup: {0:.2f}x'.format(results[0][1] / results[1][1]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
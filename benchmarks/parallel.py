@@ -0,0 +1,70 @@
+# encoding: utf-8
+'''
+parallel -- compare OFXRepairer.repair() with repair_parallel() on one big file
+
+Times OFXRepairer.repair() on the body of one large generated file, then
+repair_parallel() with pools of each requested number of processes.
+Checks that each parallel result is the same as the serial one, and
+prints the speedup over serial repair. The pool is started before the
+timing, as the command line starts it once for a whole batch. Exits with
+status 1 if a result differs.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.parallel --transactions 1000000 --processes 2,4
+'''
+
+import sys
+import time
+import multiprocessing
+from argparse import ArgumentParser
+
+from vanswap_ofx import OFXRepairer
+
+from benchmarks.corpus import iter_ofx, add_corpus_arguments, corpus_options
+
+def best_time(run, repeat):
+    '''best_time(run, repeat): best time of repeat calls of run(), and its last result'''
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = run()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--transactions", dest="transactions", type=int, default=1000000,
+                        help="corpus size, in transactions [default: %(default)s]")
+    parser.add_argument("--processes", dest="processes", default='2,4',
+                        help="comma-separated pool sizes [default: %(default)s]")
+    parser.add_argument("--piece-size", dest="piece_size", type=int, default=OFXRepairer.PIECE_SIZE,
+                        help="characters per piece [default: %(default)s]")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3,
+                        help="runs per measurement; the best is reported [default: %(default)s]")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    text = u''.join(iter_ofx(args.transactions, **corpus_options(args)))
+    r = OFXRepairer(None)
+    to_repair = r.split_input(text)[1]
+
+    print("{0:>9} {1:>10} {2:>8}".format("processes", "seconds", "speedup"))
+    serial, expected = best_time(lambda: r.repair(to_repair), args.repeat)
+    print("{0:>9} {1:>10.4f} {2:>8.2f}".format("serial", serial, 1.0))
+    for n in [int(n) for n in args.processes.split(',')]:
+        pool = multiprocessing.Pool(n)
+        try:
+            seconds, repaired = best_time(lambda: r.repair_parallel(to_repair, pool, args.piece_size),
+                                          args.repeat)
+        finally:
+            pool.close()
+            pool.join()
+        if repaired != expected:
+            print("repair_parallel() changed the output with {0} processes".format(n))
+            return 1
+        print("{0:>9} {1:>10.4f} {2:>8.2f}".format(n, seconds, serial / seconds))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# encoding: utf-8
+'''
+rules -- check that repair time stays flat as rules are added
+
+Times OFXRepairer.repair() on a generated corpus, with VANCITY_RULES
+and then with more and more extra rules added to them. The extra rules
+are like those of other banks: rewrites of the <NAME> and <MEMO> fields
+present in every transaction, whose conditions never match, so the
+output is unchanged but every rule must be tried. Prints the time at
+each rule count, and exits with status 1 if the time grows by more
+than the allowed factor.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.rules --rules 1,10,100
+'''
+
+import sys
+import time
+from argparse import ArgumentParser
+
+from vanswap_ofx import OFXRepairer, RuleSet, VANCITY_RULES
+
+from benchmarks.corpus import iter_ofx, add_corpus_arguments, corpus_options
+
+def extra_rules(n):
+    '''extra_rules(n): n rules which match no transaction in the corpus'''
+    return [{'name': 'bank-{0}'.format(i), 'action': 'rewrite',
+             'fields': ['NAME' if i % 2 else 'MEMO'],
+             'match': {'NAME' if i % 2 else 'MEMO': r'BANK{0} .*'.format(i)},
+             'pattern': r'^BANK{0} '.format(i), 'replace': ''}
+            for i in range(n)]
+
+def time_repair(to_repair, rules, repeat):
+    '''time_repair(to_repair, rules, repeat): best time of repeat runs of repair()'''
+    r = OFXRepairer(None, rules=rules)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        repaired = r.repair(to_repair)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, repaired
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--transactions", dest="transactions", type=int, default=100000,
+                        help="corpus size, in transactions [default: %(default)s]")
+    parser.add_argument("--rules", dest="rules", default='1,10,50,100',
+                        help="comma-separated rule counts [default: %(default)s]")
+    parser.add_argument("--factor", dest="factor", type=float, default=2.0,
+                        help="allowed growth in time from the fewest rules to the most [default: %(default)s]")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3,
+                        help="runs per rule count; the best is reported [default: %(default)s]")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    text = u''.join(iter_ofx(args.transactions, **corpus_options(args)))
+    to_repair = OFXRepairer(None).split_input(text)[1]
+
+    print("{0:>6} {1:>10} {2:>12}".format("rules", "seconds", "us/trn"))
+    times = []
+    expected = None
+    for n in [int(n) for n in args.rules.split(',')]:
+        rules = RuleSet(VANCITY_RULES + extra_rules(n - 1))
+        seconds, repaired = time_repair(to_repair, rules, args.repeat)
+        if expected is None:
+            expected = repaired
+        elif repaired != expected:
+            print("Rules changed the output at {0} rules".format(n))
+            return 1
+        times.append(seconds)
+        print("{0:>6} {1:>10.4f} {2:>12.3f}".format(n, seconds, 1e6 * seconds / args.transactions))
+
+    growth = times[-1] / times[0]
+    print("Growth in time: {0:.2f}x (allowed {1:.2f}x)".format(growth, args.factor))
+    return 0 if growth <= args.factor else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
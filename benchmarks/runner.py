@@ -0,0 +1,241 @@
+# encoding: utf-8
+'''
+runner -- time the phases of an OFX repair on a synthetic corpus
+
+Generates a corpus with benchmarks.corpus at each requested size, then
+times each phase of the repair separately:
+
+  split_input:  OFXRepairer.split_input() on the decoded file
+  repair:       OFXRepairer.repair() on the part between <OFX> and </OFX>
+  write:        OFXRepairer.write(), in memory: decode, repair and encode
+  write_stream: OFXRepairer.write_stream(), in memory
+  write_splice: SpliceRepairer.write_splice(), between files on disk
+  main:         the command line, end to end, on a file on disk
+
+Reports the best time of --repeat runs, as MB/s of input and
+transactions/s, and the peak memory of the phase. Each phase runs in a
+fresh process, so one phase's garbage does not count against the next.
+Peak memory comes from tracemalloc where Python has it, or else from the
+growth of the process's maximum resident set size.
+
+--save NAME keeps the results as a baseline in benchmarks/baselines/.
+--compare NAME compares against a saved baseline, and exits with status
+1 if any phase got slower by more than --threshold.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.runner --transactions 1000,100000 --save before
+'''
+
+import sys
+import os
+import io
+import json
+import platform
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import vanswap_ofx
+from vanswap_ofx import OFXRepairer, SpliceRepairer
+
+from benchmarks.corpus import iter_ofx, add_corpus_arguments, corpus_options
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PHASES = ['split_input', 'repair', 'write', 'write_stream', 'write_splice', 'main']
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+class NullWriter(io.RawIOBase):
+    '''A binary file which discards writes, and survives being closed'''
+    def writable(self):
+        return True
+    def write(self, b):
+        return len(b)
+    def close(self):
+        pass
+
+def corpus_bytes(transactions, options):
+    '''corpus_bytes(transactions, options): the generated OFX file, as bytes'''
+    buf = io.BytesIO()
+    for text in iter_ofx(transactions, **options):
+        buf.write(text.encode(options['encoding']))
+    return buf.getvalue()
+
+def prepare(phase, data, workdir):
+    '''prepare(phase, data, workdir): return a function which runs phase once'''
+    if phase in ('split_input', 'repair'):
+        r = OFXRepairer(io.BytesIO(data))
+        text = r.in_file.read()
+        if phase == 'split_input':
+            return lambda: r.split_input(text)
+        to_repair = r.split_input(text)[1]
+        return lambda: r.repair(to_repair)
+    if phase in ('write', 'write_stream'):
+        def run():
+            r = OFXRepairer(io.BytesIO(data), NullWriter())
+            getattr(r, phase)()
+        return run
+    in_path = os.path.join(workdir, 'corpus.ofx')
+    with open(in_path, 'wb') as f:
+        f.write(data)
+    out_path = os.path.join(workdir, 'corpus' + vanswap_ofx.REPAIRED_EXT + '.ofx')
+    if phase == 'write_splice':
+        def run():
+            with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
+                SpliceRepairer(in_file, out_file).write_splice()
+        return run
+    if phase == 'main':
+        def run():
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                vanswap_ofx.main([in_path])
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        return run
+    raise ValueError('Unknown phase: {0}'.format(phase))
+
+def max_rss():
+    '''max_rss(): the process's maximum resident set size in bytes, or None'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def measure(phase, transactions, options, repeat):
+    '''measure(phase, ...): time phase on a generated corpus; return a result dict'''
+    data = corpus_bytes(transactions, options)
+    workdir = tempfile.mkdtemp(prefix='vanswap_bench')
+    try:
+        run = prepare(phase, data, workdir)
+        rss_before = max_rss()
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            run()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if tracemalloc is not None:
+            # tracing slows Python down several times, so trace a run of its own
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif rss_before is not None:
+            peak = max_rss() - rss_before
+        else:
+            peak = None
+    finally:
+        shutil.rmtree(workdir)
+    return {'phase': phase, 'transactions': transactions, 'bytes': len(data),
+            'seconds': best,
+            'mb_per_s': len(data) / best / 1e6 if best else None,
+            'trn_per_s': transactions / best if best else None,
+            'peak_mb': peak / 1e6 if peak is not None else None}
+
+def measure_task(args):
+    '''measure_task(args): measure(*args), for a process pool'''
+    return measure(*args)
+
+def run_benchmarks(sizes, phases, options, repeat):
+    '''run_benchmarks(sizes, phases, options, repeat): yield a result per size and phase'''
+    import multiprocessing
+    for transactions in sizes:
+        for phase in phases:
+            pool = multiprocessing.Pool(1)
+            try:
+                yield pool.apply(measure_task, [(phase, transactions, options, repeat)])
+            finally:
+                pool.close()
+                pool.join()
+
+def result_key(result):
+    return '{0}@{1}'.format(result['phase'], result['transactions'])
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, name + '.json')
+
+def save_baseline(name, options, results):
+    '''save_baseline(name, options, results): write results to baseline file name'''
+    if not os.path.isdir(BASELINE_DIR):
+        os.makedirs(BASELINE_DIR)
+    baseline = {'python': platform.python_version(), 'version': vanswap_ofx.__version__,
+                'options': options, 'results': dict((result_key(r), r) for r in results)}
+    with open(baseline_path(name), 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+def load_baseline(name):
+    with open(baseline_path(name)) as f:
+        return json.load(f)
+
+def format_result(r):
+    peak = '{0:9.1f}'.format(r['peak_mb']) if r['peak_mb'] is not None else '      n/a'
+    return '{0:<13}{1:>9}{2:>10.4f}{3:>10.2f}{4:>12.0f}{5}'.format(
+        r['phase'], r['transactions'], r['seconds'], r['mb_per_s'], r['trn_per_s'], peak)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--transactions", dest="transactions", default='1000,100000',
+                        help="comma-separated corpus sizes, in transactions [default: %(default)s]")
+    parser.add_argument("--phases", dest="phases", default=','.join(PHASES),
+                        help="comma-separated phases to time [default: %(default)s]")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3,
+                        help="runs per measurement, best is kept [default: %(default)s]")
+    parser.add_argument("--save", dest="save", metavar="NAME",
+                        help="save the results as baseline NAME")
+    parser.add_argument("--compare", dest="compare", metavar="NAME",
+                        help="compare the results with baseline NAME")
+    parser.add_argument("--threshold", dest="threshold", type=float, default=0.10,
+                        help="slowdown against the baseline which counts as a regression "
+                             "[default: %(default)s]")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.transactions.split(',')]
+    phases = args.phases.split(',')
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error('unknown phase {0!r}, choose from {1}'.format(phase, ', '.join(PHASES)))
+    options = corpus_options(args)
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    print('{0:<13}{1:>9}{2:>10}{3:>10}{4:>12}{5:>9}{6}'.format(
+        'phase', 'trns', 'seconds', 'MB/s', 'trns/s', 'peak MB',
+        '  vs ' + args.compare if baseline else ''))
+    results = []
+    regressions = 0
+    for r in run_benchmarks(sizes, phases, options, args.repeat):
+        results.append(r)
+        line = format_result(r)
+        old = baseline and baseline['results'].get(result_key(r))
+        if old:
+            ratio = r['seconds'] / old['seconds']
+            line += '{0:>9.2f}x'.format(ratio)
+            if ratio > 1 + args.threshold:
+                regressions += 1
+                line += ' REGRESSION'
+        print(line)
+
+    if args.save:
+        save_baseline(args.save, options, results)
+        print('Saved baseline {0}.'.format(baseline_path(args.save)))
+    if baseline:
+        if baseline['options'] != options:
+            print('Warning: baseline {0} used other corpus options: {1}'.format(
+                args.compare, baseline['options']))
+        print('{0} regressions beyond {1:.0%} against baseline {2}.'.format(
+            regressions, args.threshold, args.compare))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
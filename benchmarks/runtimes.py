@@ -0,0 +1,58 @@
+# encoding: utf-8
+'''
+runtimes -- compare the repair phases under different Python interpreters
+
+Runs benchmarks.runner once under each interpreter, saving its results
+as baseline runtime-NAME, then prints the MB/s of each phase side by
+side, with each interpreter's speed relative to the first. Other
+options are passed on to the runner.
+
+Run it as a module, from the top directory, e.g. the command:
+    python3 -m benchmarks.runtimes --pythons python2.7,python3 --transactions 100000
+'''
+
+import sys
+import os
+import subprocess
+from argparse import ArgumentParser
+
+from benchmarks.runner import PHASES, load_baseline
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def baseline_name(python):
+    return 'runtime-' + os.path.basename(python)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--pythons", dest="pythons", default='python2.7,python3',
+                        help="comma-separated interpreters to compare [default: %(default)s]")
+    args, runner_args = parser.parse_known_args()
+
+    pythons = args.pythons.split(',')
+    results = []
+    for python in pythons:
+        print('Running the benchmarks under {0}...'.format(python))
+        argv = [python, '-m', 'benchmarks.runner', '--save', baseline_name(python)] + runner_args
+        with open(os.devnull, 'wb') as devnull:
+            if subprocess.call(argv, cwd=ROOT, stdout=devnull) != 0:
+                print('{0} failed: {1}'.format(python, ' '.join(argv)))
+                return 1
+        results.append(load_baseline(baseline_name(python)))
+
+    print('{0:<13}{1:>9}'.format('phase', 'trns') + ''.join(
+        '{0:>14}'.format(r['python'] + ' MB/s') for r in results) + ''.join(
+        '{0:>9}'.format('x' + '.'.join(r['python'].split('.')[:2])) for r in results[1:]))
+    keys = sorted(results[0]['results'], key=lambda k: (int(k.split('@')[1]), PHASES.index(k.split('@')[0])))
+    for key in keys:
+        rows = [r['results'].get(key) for r in results]
+        if None in rows:
+            continue
+        line = '{0:<13}{1:>9}'.format(rows[0]['phase'], rows[0]['transactions'])
+        line += ''.join('{0:>14.2f}'.format(row['mb_per_s']) for row in rows)
+        line += ''.join('{0:>9.2f}'.format(row['mb_per_s'] / rows[0]['mb_per_s']) for row in rows[1:])
+        print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
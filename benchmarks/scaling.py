@@ -0,0 +1,86 @@
+# encoding: utf-8
+'''
+scaling -- check that OFXRepairer.repair() runs in linear time
+
+Times OFXRepairer.repair() on transaction lists from 1k to 1M
+transactions. Most transactions have only a <NAME> (like interest
+credits and fees), the case which made the old RE_STMTTRN regular
+expression backtrack across transaction boundaries. Prints the time
+per transaction at each size, and exits with status 1 if the time per
+transaction grows by more than the allowed factor.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.scaling --max 100000
+'''
+
+import sys
+import time
+from argparse import ArgumentParser
+
+from vanswap_ofx import OFXRepairer
+
+NAME_ONLY = '''     <STMTTRN>
+      <TRNTYPE>CREDIT
+      <DTPOSTED>20161230100000[-8:PST]
+      <TRNAMT>1.02
+      <FITID>25.030001    1790116941%03d
+      <NAME>Interest credited to account
+     </STMTTRN>
+'''
+NAME_MEMO = '''     <STMTTRN>
+      <TRNTYPE>DEBIT
+      <DTPOSTED>20170101000000[-8:PST]
+      <TRNAMT>-12.34
+      <FITID>25.030001    1790116941%03d
+      <NAME>payment
+      <MEMO>VISA Confirmation #881665
+     </STMTTRN>
+'''
+
+def transactions(n, memo_every):
+    '''transactions(n, memo_every): text of n transactions
+
+    Every memo_every'th transaction has a <NAME> and a <MEMO>, the rest
+    only a <NAME>. With memo_every 0, none has a <MEMO>.
+    '''
+    return ''.join((NAME_MEMO if memo_every and i % memo_every == 0 else NAME_ONLY) % (i % 1000)
+                   for i in range(n))
+
+def time_repair(s, repeat):
+    '''time_repair(s, repeat): best time of repeat runs of repair(s)'''
+    r = OFXRepairer(None)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        r.repair(s)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--max", dest="max", type=int, default=1000000,
+                        help="largest number of transactions [default: %(default)s]")
+    parser.add_argument("--memo-every", dest="memo_every", type=int, default=0,
+                        help="every Nth transaction has a <MEMO>, 0 for none [default: %(default)s]")
+    parser.add_argument("--factor", dest="factor", type=float, default=3.0,
+                        help="allowed growth in time per transaction [default: %(default)s]")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3,
+                        help="runs per size; the best is reported [default: %(default)s]")
+    args = parser.parse_args()
+
+    print("{0:>10} {1:>10} {2:>12}".format("trns", "seconds", "us/trn"))
+    per_trn = []
+    n = 1000
+    while n <= args.max:
+        seconds = time_repair(transactions(n, args.memo_every), args.repeat)
+        per_trn.append(seconds / n)
+        print("{0:>10} {1:>10.4f} {2:>12.3f}".format(n, seconds, 1e6 * seconds / n))
+        n *= 10
+
+    growth = per_trn[-1] / per_trn[0]
+    print("Growth in time per transaction: {0:.2f}x (allowed {1:.2f}x)".format(growth, args.factor))
+    return 0 if growth <= args.factor else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
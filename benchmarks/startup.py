@@ -0,0 +1,142 @@
+# encoding: utf-8
+'''
+startup -- time interpreter startup, module import and a one-file CLI run
+
+Each measurement runs a fresh interpreter, as the command line does, and
+reports the best of several runs:
+  python:  the interpreter alone, the floor for everything else
+  import:  importing vanswap_ofx
+  cli:     vanswap_ofx.py repairing one small OFX file
+  ofxparse: importing ofxparse.ofxparse, if installed, for comparison;
+           vanswap_ofx used to import it on every run
+
+Exits with status 1 if import or cli takes more than --budget
+milliseconds beyond the interpreter alone, or if importing vanswap_ofx
+loads any of DEFERRED, the modules which only some options need, and
+which the functions using them import.
+
+Run it as a module, from the top directory, e.g. the command:
+    python -m benchmarks.startup --repeat 20
+'''
+
+import sys
+import os
+import os.path
+import shutil
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks import SRC
+
+BUDGET = 75  # milliseconds which import and cli may each take beyond the interpreter alone
+# Modules which a plain repair doesn't use, as Python 3 and 2 name them
+DEFERRED = ['json', 'hashlib', 'mmap', 'threading', 'queue', 'Queue', 'tempfile', 'shutil',
+            'http.server', 'BaseHTTPServer', 'socketserver', 'SocketServer',
+            'zipfile', 'tarfile', 'multiprocessing']
+
+SAMPLE = b'''OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:TYPE1
+ENCODING:USASCII
+CHARSET:1252
+
+<OFX>
+ <BANKMSGSRSV1>
+  <STMTTRNRS>
+   <STMTRS>
+     <STMTTRN>
+      <TRNTYPE>DEBIT
+      <DTPOSTED>20170101000000[-8:PST]
+      <TRNAMT>-12.34
+      <FITID>25.030001    1790116941000
+      <NAME>payment
+      <MEMO>VISA Confirmation #881665
+     </STMTTRN>
+   </STMTRS>
+  </STMTTRNRS>
+ </BANKMSGSRSV1>
+</OFX>
+'''
+
+def best_time(argv, repeat, before=None):
+    '''best_time(argv, repeat): best wall time of repeat runs of argv
+
+    before, if given, is called ahead of each run, outside the timing.
+    Returns None if the command fails.
+    '''
+    best = None
+    with open(os.devnull, 'wb') as devnull:
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            start = time.time()
+            if subprocess.call(argv, stdout=devnull, stderr=devnull) != 0:
+                return None
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def deferred_imports(py, path):
+    '''deferred_imports(py, path): the DEFERRED modules which importing vanswap_ofx loads'''
+    code = path + ("import vanswap_ofx; "
+                   "print(' '.join(m for m in {0!r} if sys.modules.get(m) is not None))".format(DEFERRED))
+    return subprocess.check_output([py, '-c', code]).decode('ascii').split()
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--python", dest="python", default=sys.executable,
+                        help="interpreter to measure [default: %(default)s]")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=10,
+                        help="runs per measurement; the best is reported [default: %(default)s]")
+    parser.add_argument("--budget", dest="budget", type=float, default=BUDGET,
+                        help="milliseconds which import and cli may each take beyond python "
+                             "[default: %(default)s]")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    in_path = os.path.join(tmp, 'sample.ofx')
+    out_path = os.path.join(tmp, 'sample.repaired.ofx')
+    with open(in_path, 'wb') as f:
+        f.write(SAMPLE)
+    def remove_output():
+        if os.path.exists(out_path):
+            os.remove(out_path)
+
+    py = args.python
+    path = "import sys; sys.path.insert(0, {0!r}); ".format(SRC)
+    timings = [
+        ('python', best_time([py, '-c', 'pass'], args.repeat)),
+        ('import', best_time([py, '-c', path + 'import vanswap_ofx'], args.repeat)),
+        ('cli', best_time([py, os.path.join(SRC, 'vanswap_ofx.py'), in_path],
+                          args.repeat, remove_output)),
+        ('ofxparse', best_time([py, '-c', 'import ofxparse.ofxparse'], args.repeat)),
+    ]
+    shutil.rmtree(tmp)
+    loaded = deferred_imports(py, path)
+
+    print("{0:<10} {1:>10}".format("measure", "ms"))
+    for label, seconds in timings:
+        if seconds is None:
+            print("{0:<10} {1:>10}".format(label, "n/a"))
+        else:
+            print("{0:<10} {1:>10.1f}".format(label, 1e3 * seconds))
+
+    failed = False
+    python = dict(timings)['python']
+    for label in ('import', 'cli'):
+        seconds = dict(timings)[label]
+        if seconds is not None and python is not None and 1e3 * (seconds - python) > args.budget:
+            print("{0} takes {1:.1f} ms beyond python, over the budget of {2:.0f} ms.".format(
+                    label, 1e3 * (seconds - python), args.budget))
+            failed = True
+    if loaded:
+        print("Importing vanswap_ofx loads {0}, which should be imported where used.".format(
+                ', '.join(loaded)))
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python3
 # encoding: utf-8
 '''
 vanswap_ofx -- swap NAME and MEMO fields in OFX files 
@@ -17,31 +17,55 @@ modified filename.
 @deffield    updated: Updated
 '''
 
+from __future__ import print_function
+
 import sys
 import os.path
 import io
 import codecs
+import collections
+import contextlib
+import copy
+import itertools
 import re
-# Danger, ofxparse.ofxparse and OfxFile are not official exports of ofxparse.
-from ofxparse.ofxparse import OfxFile
+import signal
+import time
+import functools
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # backport of os.scandir for Python 2
+    except ImportError:
+        scandir = None
 
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 
 
-__all__ = []
+__all__ = ['OFXRepairer', 'RuleSet', 'TransactionExporter', 'RepairSession', 'CLIError', 'repair_bytes', 'repair_many', 'repair_stream', 'repair_path', 'scan_path', 'verify_path', 'main']
 __version__ = 0.5
 __date__ = '2017-03-25'
 __updated__ = __date__
 
 DEBUG = 0
 TESTRUN = 0
-PROFILE = 0
+
+OFX_EXTENSIONS = ['.ofx', '.qfx']  # only files with these extensions are repaired
+REPAIRED_EXT = '.repaired'  # subextension of repaired files, e.g. foo.repaired.ofx
+SPLIT_SIZE = 32 * 1024 * 1024  # files of this many bytes or more are repaired in pieces, given a pool
+# archives whose OFX members are repaired, and their formats, as tarfile names them
+ARCHIVE_EXTENSIONS = collections.OrderedDict([
+    ('.zip', 'zip'), ('.tar', 'tar'), ('.tar.gz', 'gz'), ('.tgz', 'gz'),
+    ('.tar.bz2', 'bz2'), ('.tbz2', 'bz2'), ('.tar.xz', 'xz'), ('.txz', 'xz')])
+# Flag for the text regular expressions, so that on Python 3, as on Python 2
+# and for bytes, \s and (?i) only treat ASCII characters specially
+RE_ASCII = getattr(re, 'ASCII', 0)
 
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
     def __init__(self, msg):
-        super(CLIError).__init__(type(self))
+        super(CLIError, self).__init__(msg)
         self.msg = "E: %s" % msg
     def __str__(self):
         return self.msg
@@ -56,7 +80,7 @@ class PathFile(object):
     (We will use a temp file pathname for examples.)
     >>> import tempfile
     >>> f = tempfile.NamedTemporaryFile(delete=False)
-    >>> f.write(''); f.close()
+    >>> n = f.write(b''); f.close()
     
     Pass in a string or bytes array for the filename, and PathFile opens it.
     The attribute '_fh' contains the fileobject for the opened file.
@@ -75,31 +99,44 @@ class PathFile(object):
     
     PathFile will raise the same exceptions as open(). For example, if 
     PathFile tries to open a file for reading, and there is no file at the 
-    path, PathFile raises an IOError.
+    path, PathFile raises an IOError (on Python 3, FileNotFoundError).
+    >>> import errno
     >>> p = f.name; os.remove(p)  # p is path where no file exists
     >>> pf = PathFile(p); pf is None  # Lazy opening: pf is not yet open.
     False
-    >>> pf.open()     # doctest: +IGNORE_EXCEPTION_DETAIL
-    Traceback (most recent call last):
-      ...
-    IOError: [Errno 2] No such file or directory: ...
+    >>> try:
+    ...     pf.open()
+    ... except IOError as e:
+    ...     print(e.errno == errno.ENOENT)
+    True
     
     PathFile also accepts an open file-like object. It will use that object
     instead of treating the parameter as a pathname to open.
     >>> import io
     >>> s = io.BytesIO(b'DUMMY Test file contents')
-    >>> pf = PathFile(s); pf.read()
-    'DUMMY Test file contents'
+    >>> pf = PathFile(s); pf.read() == b'DUMMY Test file contents'
+    True
     
     Supplying file-like objects is helpful in writing test cases. 
     Test cases can pass a BytesIO object with test data to the PathFile object.
     Production clients, on the other hand, can pass a path.
+
+    peek() returns bytes from the front of a binary file without consuming
+    them, even from a pipe, which can't seek back. nread counts the bytes
+    read so far.
+    >>> pf = PathFile(io.BytesIO(b'DUMMY Test file contents'))
+    >>> pf.peek(5) == b'DUMMY', pf.read(11) == b'DUMMY Test ', pf.read() == b'file contents'
+    (True, True, True)
+    >>> pf.nread
+    24
     '''
 
     def __init__(self, p, mode='r'):
         self._fh = None
         self.name = None
         self._mode = mode
+        self._peeked = b''  # bytes read by peek(), not yet by read()
+        self.nread = 0
         if self._is_file(p):
             self._fh = p
             try:
@@ -116,6 +153,36 @@ class PathFile(object):
         if self._fh:
             self._fh.close()
 
+    def _file(self):
+        '''returns the underlying file object, opening it if need be'''
+        if self._fh is None:
+            self._fh = io.open(self.name, self._mode)
+        return self._fh
+
+    def read(self, size=-1):
+        '''read(size): read from the file, starting with any bytes peek() saw'''
+        peeked = self._peeked
+        if not peeked:
+            data = self._file().read(size)
+        elif size is None or size < 0:
+            self._peeked = b''
+            data = peeked + self._file().read()
+        else:
+            data, self._peeked = peeked[:size], peeked[size:]
+            if len(data) < size:
+                data += self._file().read(size - len(data))
+        self.nread += len(data)
+        return data
+
+    def peek(self, size):
+        '''peek(size): return up to size bytes from the front of the file, leaving them to read()'''
+        while len(self._peeked) < size:
+            data = self._file().read(size - len(self._peeked))
+            if not data:
+                break
+            self._peeked += data
+        return self._peeked[:size]
+
     def _is_file(self, p):
         '''returns True if p is a file-like object, False otherwise
         
@@ -130,10 +197,9 @@ class PathFile(object):
         # Attribute lookups are delegated to the underlying file
         # and cached for non-numeric results
         # (i.e. methods are cached, closed and friends are not)
-        _fh = self.__dict__['_fh'] # Can't say self._fh, that would be recursive 
-        if _fh is None:
-            _fh = self._fh = io.open(self.__dict__['name'], self.__dict__['_mode'])
-        a = getattr(_fh, name)
+        if '_fh' not in self.__dict__:  # Can't say self._fh, that would be recursive
+            raise AttributeError(name)
+        a = getattr(self._file(), name)
         if not issubclass(type(a), type(0)):
             setattr(self, name, a)
         return a
@@ -159,7 +225,7 @@ class FilterInOutFiles(object):
     >>> import os, os.path, tempfile
     >>> p = tempfile.mkdtemp()
     >>> f = open( os.path.join(p, 'test.txt'), 'w' )
-    >>> f.write(''); f.close()
+    >>> n = f.write(''); f.close()
     >>> C = FilterInOutFiles('.out')
     >>> fh_i, fh_o = C.open_in_out_files(f.name)
     >>> os.path.basename(fh_o.name)
@@ -168,10 +234,12 @@ class FilterInOutFiles(object):
     
     If there is already a file at the output path, raise an OSError 
     exception, with errno.EEXIST .
-    >>> fh_i, fh_o = C.open_in_out_files(f.name)     # doctest: +IGNORE_EXCEPTION_DETAIL
-    Traceback (most recent call last):
-      ...
-    OSError: [Errno 17] File exists: ...
+    >>> import errno
+    >>> try:
+    ...     fh_i, fh_o = C.open_in_out_files(f.name)
+    ... except OSError as e:
+    ...     print(e.errno == errno.EEXIST)
+    True
     >>> os.remove(f.name); os.remove( fh_o.name );
     >>> os.rmdir(p)
     '''
@@ -200,23 +268,46 @@ class FilterInOutFiles(object):
         return root+self.output_ext+ext
 
     IN_FLAGS = 'rb'  # flags to use with open() when opening in_path
-    OUT_O_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL # flags to use with os.open() when opening out_path
+    OUT_O_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0) # flags to use with os.open() when opening out_path
     OUT_FLAGS = 'wb' # flags to use with open() when opening out_path
-    def open_in_out_files(self, in_path):
+    STDIO_PATH = '-' # in_path which reads standard input, and writes standard output
+    def open_in_out_files(self, in_path, replace=False):
         '''open_in_out_files(in_path): return open inFile, outFile objects.
+
+        With replace, an existing file at the output path is replaced.
+        Given STDIO_PATH, return PathFiles for standard input and output,
+        with out_path None.
         '''
         self.in_path = in_path
+        if in_path == self.STDIO_PATH:
+            # Duplicate the descriptors, so that closing these files
+            # leaves sys.stdin and sys.stdout open
+            self.out_path = None
+            self.in_file = PathFile(io.open(os.dup(sys.stdin.fileno()), self.IN_FLAGS))
+            self.in_file.name = '<stdin>'
+            sys.stdout.flush()
+            self.out_file = PathFile(io.open(os.dup(sys.stdout.fileno()), self.OUT_FLAGS))
+            self.out_file.name = '<stdout>'
+            return (self.in_file, self.out_file)
         self.out_path = self.generate_out_path(in_path)
         self.in_file = open(self.in_path, self.IN_FLAGS)
-        # Crude check to prevent overwriting. os.open(path, os.O_CREAT | os.O_EXCL)
-        # is a more reliable way, but leaves out_file.name not set to the path.
-        if os.path.exists(self.out_path):
-            import errno
-            raise OSError(errno.EEXIST, 'File exists', self.out_path)
-        self.out_file = open(self.out_path, self.OUT_FLAGS)
+        self.out_file = self.open_out_file(self.out_path, replace)
         
         return (self.in_file, self.out_file)
 
+    @classmethod
+    def open_out_file(cls, out_path, replace=False):
+        '''open_out_file(out_path): create and open a binary file at out_path
+
+        Unless replace, raises OSError, with errno.EEXIST, if there is
+        already a file at out_path. The one os.open() call both checks
+        and creates, so no other process can slip a file in between.
+        '''
+        flags = cls.OUT_O_FLAGS if not replace else (cls.OUT_O_FLAGS & ~os.O_EXCL) | os.O_TRUNC
+        out_file = io.open(os.open(out_path, flags, 0o666), cls.OUT_FLAGS)
+        out_file.raw.name = out_path  # rather than the descriptor's number
+        return out_file
+
     def close(self):
         '''close(): close the input and output files, erase the paths
         '''
@@ -227,16 +318,433 @@ class FilterInOutFiles(object):
             self.out_file.close()
         self.out_file = self.out_path = None
 
-    
+
+def archive_ext(path):
+    r'''archive_ext(path): the ARCHIVE_EXTENSIONS key which path ends with, or None
+
+    >>> archive_ext('bank/2017.TAR.gz'), archive_ext('2017.zip'), archive_ext('2017.gz')
+    ('.tar.gz', '.zip', None)
+    '''
+    lower = path.lower()
+    for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if lower.endswith(ext):
+            return ext
+    return None
+
+class ArchiveInOutFiles(FilterInOutFiles):
+    '''ArchiveInOutFiles: FilterInOutFiles for archives, whose extensions may be double
+
+    >>> ArchiveInOutFiles('.out').generate_out_path('bank/2017.tar.gz')
+    'bank/2017.out.tar.gz'
+    '''
+    def generate_out_path(self, path):
+        ext = archive_ext(path)
+        if ext is None:
+            return FilterInOutFiles.generate_out_path(self, path)
+        return path[:-len(ext)] + self.output_ext + path[-len(ext):]
+
+
+class RepairMetrics(object):
+    r'''RepairMetrics(timing): phase times and transaction counts of one repair
+
+    An OFXRepairer counts every transaction it examines here. With timing,
+    it also adds up the wall time of each phase of the repair, in PHASES.
+    A phase entered inside another pauses the outer one, so each second
+    counts against exactly one phase.
+    >>> m = RepairMetrics()
+    >>> with m.phase('repair'):
+    ...     with m.phase('decode'):
+    ...         time.sleep(0.05)
+    >>> m.seconds['decode'] >= 0.05, m.seconds['repair'] < 0.05
+    (True, True)
+
+    record() gives one plain dict per file, ready for JSON, and describe()
+    prints it for people.
+    >>> m.count([], OFXRepairer.RULES); m.count(OFXRepairer.RULES.matches(u"<NAME>a\n<MEMO>b #1\n"), OFXRepairer.RULES)
+    >>> rec = m.record('a.ofx', ok=True, nbytes=20, seconds=0.1)
+    >>> [rec[k] for k in ('transactions', 'swapped', 'confirmations')]
+    [2, 1, 0]
+    >>> print(RepairMetrics.describe(rec))   # doctest: +ELLIPSIS
+    Profile of 'a.ofx': header 0.000s, decode ...s, ... total 0.100s; 2 transactions, 1 swapped, 0 with confirmation; peak memory n/a.
+    '''
+
+    PHASES = ['header', 'decode', 'split_input', 'repair', 'encode', 'write']
+
+    class NullPhase(object):
+        '''a phase which is not timed'''
+        def __enter__(self):
+            pass
+        def __exit__(self, *exc_info):
+            pass
+
+    NULL_PHASE = NullPhase()
+
+    def __init__(self, timing=True):
+        self.timing = timing
+        self.seconds = collections.OrderedDict((p, 0.0) for p in self.PHASES)
+        self.transactions = self.swapped = self.confirmations = 0
+        self.codec_name = self.peak_memory = None
+        self.running = []  # names of the phases entered, innermost last
+        self.since = None  # when the innermost phase last started or resumed
+
+    def phase(self, name):
+        '''phase(name): a context manager which times a phase, if timing'''
+        if not self.timing:
+            return self.NULL_PHASE
+        return self.timed(name)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        now = time.time()
+        if self.running:
+            self.seconds[self.running[-1]] += now - self.since
+        self.running.append(name)
+        self.since = now
+        try:
+            yield
+        finally:
+            now = time.time()
+            self.seconds[self.running.pop()] += now - self.since
+            self.since = now
+
+    def iterate(self, name, iterable):
+        '''iterate(name, iterable): iterate, timing each step as phase name'''
+        if not self.timing:
+            return iterable
+        def steps(it):
+            while True:
+                with self.timed(name):
+                    item = next(it, self)  # self is never an item
+                if item is self:
+                    return
+                yield item
+        return steps(iter(iterable))
+
+    def count(self, matches, rules):
+        '''count(matches, rules): count a transaction, given its list of RuleSet rules' matches'''
+        self.transactions += 1
+        if matches:
+            self.swapped += 1
+            for m in matches:
+                if rules.kept(m):
+                    self.confirmations += 1
+                    break
+
+    def record(self, path, ok, nbytes, seconds):
+        '''record(path, ok, nbytes, seconds): the metrics of one file, as a dict'''
+        return collections.OrderedDict([
+            ('path', path), ('ok', ok), ('bytes', nbytes), ('codec', self.codec_name),
+            ('seconds', self.seconds), ('total_seconds', seconds),
+            ('transactions', self.transactions), ('swapped', self.swapped),
+            ('confirmations', self.confirmations), ('peak_memory', self.peak_memory)])
+
+    @staticmethod
+    def describe(record):
+        '''describe(record): a line of text describing a record()'''
+        peak = record['peak_memory']
+        return "Profile of '{0}': {1}, total {2:.3f}s; {3} transactions, {4} swapped, " \
+               "{5} with confirmation; peak memory {6}.".format(
+                    record['path'],
+                    ', '.join('{0} {1:.3f}s'.format(p, s) for p, s in record['seconds'].items()),
+                    record['total_seconds'], record['transactions'], record['swapped'],
+                    record['confirmations'], 'n/a' if peak is None else '{0:.1f} MB'.format(peak / 1e6))
+
+
+# The rules of the repair this program was written for: Vancity's system
+# change of November 2016 put the NAME of each transaction in its MEMO,
+# and the MEMO in its NAME, but left any confirmation number in the MEMO.
+VANCITY_RULES = [
+    {'name': 'vancity-2016', 'action': 'swap', 'fields': ['NAME', 'MEMO'],
+     'keep': r'\s*Confirmation\s#\d+\s*'},
+]
+
+class RuleSet(object):
+    r'''RuleSet(rules): field rules for transactions, compiled into one pattern
+
+    rules is a list of dicts, as read from JSON. Each rule acts on the
+    field lines of a <STMTTRN> element, such as "<NAME>payment":
+      action: 'swap' exchanges the values of its two fields. 'move'
+              moves the value of its first field into its second,
+              leaving the first empty. 'rewrite' replaces matches of
+              'pattern' in the value of its one field with 'replace',
+              as re.sub() does.
+      fields: the field tags, whose lines must follow one another
+              (blank lines aside).
+      match:  optional; a dict of field tag to a regular expression
+              which that field's whole value must match.
+      keep:   optional, for 'swap' and 'move'; a regular expression for
+              a trailing part of the last field's value which stays in
+              that field.
+      name:   optional, for messages.
+    Tags and patterns match without regard to case. All the rules are
+    compiled into one regular expression, so a transaction is searched
+    once however many rules there are. Each rule acts at most once per
+    transaction, on lines no other rule has matched.
+    >>> rules = RuleSet([{'action': 'move', 'fields': ['MEMO', 'NAME'], 'match': {'NAME': ''}},
+    ...                  {'action': 'rewrite', 'fields': ['PAYEE'], 'pattern': r'^POS ', 'replace': ''}])
+    >>> trn = u"<STMTTRN>\n<MEMO>Hydro\n<NAME>\n<PAYEE>POS Cafe\n</STMTTRN>"
+    >>> print(u''.join(rules.apply(m) for m in rules.matches(trn)))
+    <MEMO>
+    <NAME>Hydro
+    <PAYEE>Cafe
+    <BLANKLINE>
+    >>> rules.same_length
+    False
+
+    The default is VANCITY_RULES.
+    >>> m = OFXRepairer.RULES.matches(b"<NAME>payment\n<MEMO>VISA Confirmation #1\n")
+    >>> OFXRepairer.RULES.apply(m[0]) == b"<NAME>VISA\n<MEMO>payment Confirmation #1\n"
+    True
+
+    A rule which makes no sense raises CLIError.
+    >>> RuleSet([{'action': 'swap', 'fields': ['NAME']}])  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+      ...
+    CLIError: E: Rule 1: 'swap' needs 2 fields, not 1.
+    '''
+
+    ACTIONS = {'swap': 2, 'move': 2, 'rewrite': 1}  # action: number of fields
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.same_length = all(rule.get('action') == 'swap' for rule in rules)
+        # The rules are grouped by the tag of their first field, so that
+        # a line is only tried against the rules which start with its tag
+        by_tag = collections.OrderedDict()
+        subs = []
+        for i, rule in enumerate(rules):
+            by_tag.setdefault(rule['fields'][0].upper() if rule.get('fields') else u'', []).append(
+                    self.rule_pattern(i, rule))
+            subs.append((rule.get('pattern'), rule.get('replace')))
+        pattern = u'(?im)^(?P<lead>\\s*<)(?:' + u'|'.join(
+                u'{0}>(?:{1})'.format(re.escape(tag), u'|'.join(parts)) for tag, parts in by_tag.items()) + u')'
+        # Quick test for the tag of each rule's last field, without which it can't match.
+        # Spelled out rather than (?i), which is several times slower on Python 2.
+        tags = collections.OrderedDict((u'<' + u''.join(u'[{0}{1}]'.format(c.upper(), c.lower()) if c.isalpha()
+                                                       else re.escape(c) for c in rule['fields'][-1]) + u'>', None)
+                                       for rule in rules)
+        self.sources = (pattern, u'|'.join(tags), subs)
+        self.text = self.compile(lambda s: s)
+        self.bytes = None  # compiled at first use, as not all patterns need be ASCII
+        # The action and group names of each rule, by the number of its outer group
+        self.groups, self.index = {}, {}
+        groupindex = self.text[0].groupindex
+        for i, rule in enumerate(rules):
+            names = ['r{0}_{1}'.format(i, name) for name in ('v0', 't1', 'v1', 'k')]
+            self.groups[groupindex['r{0}'.format(i)]] = [rule['action']] + [
+                    name if name in groupindex else None for name in names]
+            self.index[groupindex['r{0}'.format(i)]] = i
+
+    def __getstate__(self):
+        return self.rules  # for a process pool: compiled patterns don't pickle on Python 2
+
+    def __setstate__(self, rules):
+        self.__init__(rules)
+
+    def rule_pattern(self, i, rule):
+        '''rule_pattern(i, rule): the regular expression source for rule number i, after its first tag'''
+        action = rule.get('action')
+        fields = rule.get('fields') or []
+        if action not in self.ACTIONS:
+            raise CLIError("Rule {0}: unknown action {1!r}, choose from {2}.".format(
+                    i + 1, action, ', '.join(sorted(self.ACTIONS))))
+        if len(fields) != self.ACTIONS[action]:
+            raise CLIError("Rule {0}: '{1}' needs {2} fields, not {3}.".format(
+                    i + 1, action, self.ACTIONS[action], len(fields)))
+        if action == 'rewrite' and rule.get('pattern') is None:
+            raise CLIError("Rule {0}: 'rewrite' needs a pattern.".format(i + 1))
+        match = rule.get('match') or {}
+        keep = rule.get('keep') if action != 'rewrite' else None
+        source = u''
+        for j, field in enumerate(fields):
+            value = match.get(field)
+            if value is None:
+                value = u'.*?' if keep and j == len(fields) - 1 else u'.*'
+            if j > 0:
+                source += u'(?P<r{0}_t{1}>\\s*<{2}>)'.format(i, j, re.escape(field))
+            source += u'(?P<r{0}_v{1}>{2})'.format(i, j, value)
+            if keep and j == len(fields) - 1:
+                source += u'(?P<r{0}_k>{1})?'.format(i, keep)
+            source += u'\\n'
+        source = u'(?P<r{0}>{1})'.format(i, source)
+        try:
+            re.compile(source)
+            if action == 'rewrite':
+                re.compile(rule['pattern'])
+        except re.error as e:
+            raise CLIError("Rule {0}: bad regular expression: {1}".format(i + 1, e))
+        return source
+
+    def compile(self, convert):
+        '''compile(convert): the (pattern, prefilter, subs) of the rules, with sources passed through convert'''
+        pattern, prefilter, subs = self.sources
+        return (re.compile(convert(pattern), RE_ASCII), re.compile(convert(prefilter), RE_ASCII),
+                [functools.partial(re.compile(convert(p), RE_ASCII).sub, convert(r or u''))
+                 if p is not None else None for p, r in subs])
+
+    def compiled(self, trn):
+        '''compiled(trn): the compiled rules for trn, text or bytes'''
+        if not isinstance(trn, bytes):
+            return self.text
+        if self.bytes is None:
+            try:
+                self.bytes = self.compile(lambda s: s.encode('ascii'))
+            except UnicodeError:
+                raise CLIError("Rules with non-ASCII patterns only work on decoded text.")
+        return self.bytes
+
+    def matches(self, trn):
+        '''matches(trn): a list of the rule matches in transaction trn, text or bytes'''
+        pattern, prefilter, _ = self.compiled(trn)
+        if not prefilter.search(trn):
+            return []
+        if len(self.rules) == 1:
+            m = pattern.search(trn)
+            return [m] if m else []
+        found, fired = [], set()
+        for m in pattern.finditer(trn):
+            if m.lastindex not in fired:
+                fired.add(m.lastindex)
+                found.append(m)
+        return found
+
+    def apply(self, m):
+        '''apply(m): the replacement text for match m of one rule'''
+        i = m.lastindex
+        action, value0, tag1, value1, kept = self.groups[i]
+        tag0 = m.string[m.start():m.start(i)]  # the lead and the first tag, as they were
+        nl = m.group()[-1:]
+        if action == 'rewrite':
+            return tag0 + self.compiled(nl)[2][self.index[i]](m.group(value0)) + nl
+        tail = (m.group(kept) or nl[:0]) if kept else nl[:0]
+        if action == 'swap':
+            return tag0 + m.group(value1) + nl + m.group(tag1) + m.group(value0) + tail + nl
+        return tag0 + nl + m.group(tag1) + m.group(value0) + tail + nl
+
+    def kept(self, m):
+        '''kept(m): True if match m has a part of its field which was kept in place'''
+        kept = self.groups[m.lastindex][4]
+        return bool(kept and m.group(kept))
+
+    def kept_part(self, m):
+        '''kept_part(m): the part of a field which match m kept in place, or None'''
+        kept = self.groups[m.lastindex][4]
+        return m.group(kept) if kept else None
+
+    @classmethod
+    def load(cls, path):
+        '''load(path): a RuleSet from the JSON list of rules in file path'''
+        import json
+        with open(path) as f:
+            return cls(json.load(f))
+
+class TransactionExporter(object):
+    r'''TransactionExporter(out_file, fmt): write a record per repaired transaction
+
+    out_file is a text file, which gets one record per transaction given
+    to add(), as it is given: a JSON object per line with fmt 'jsonl',
+    or a row with fmt 'csv', after a header row. The record has the
+    FIELDS of the repaired transaction, the first of each tag, and the
+    number from the part of a field which a rule kept in place, such as
+    the 881665 of "Confirmation #881665". Missing fields are null in
+    JSON, and empty in CSV. Values are text, as they are in the file.
+    >>> out_file = io.StringIO()
+    >>> export = TransactionExporter(out_file, 'csv')
+    >>> r = OFXRepairer(None, export=export)
+    >>> print(r.repair(u"""<STMTTRN>
+    ... <TRNTYPE>DEBIT
+    ... <TRNAMT>-12.34
+    ... <NAME>payment, online
+    ... <MEMO>VISA Confirmation #881665
+    ... </STMTTRN>"""))
+    <STMTTRN>
+    <TRNTYPE>DEBIT
+    <TRNAMT>-12.34
+    <NAME>VISA
+    <MEMO>payment, online Confirmation #881665
+    </STMTTRN>
+    >>> for line in out_file.getvalue().splitlines():
+    ...     print(line)
+    TRNTYPE,DTPOSTED,TRNAMT,FITID,NAME,MEMO,CONFIRMATION
+    DEBIT,,-12.34,,VISA,"payment, online Confirmation #881665",881665
+    >>> out_file = io.StringIO()
+    >>> r.export = TransactionExporter(out_file)
+    >>> print(r.repair(u"<STMTTRN>\n  <FITID>7\n  <NAME>Interest\n</STMTTRN>"))
+    <STMTTRN>
+      <FITID>7
+      <NAME>Interest
+    </STMTTRN>
+    >>> print(out_file.getvalue())
+    {"TRNTYPE": null, "DTPOSTED": null, "TRNAMT": null, "FITID": "7", "NAME": "Interest", "MEMO": null, "CONFIRMATION": null}
+    <BLANKLINE>
+    '''
+
+    FIELDS = ['TRNTYPE', 'DTPOSTED', 'TRNAMT', 'FITID', 'NAME', 'MEMO', 'CONFIRMATION']
+    TAGS = frozenset(FIELDS[:-1])  # the FIELDS taken from the transaction's tags
+    FORMATS = collections.OrderedDict([('jsonl', '.jsonl'), ('csv', '.csv')])  # format: file extension
+    # Any field line: (?i) and an alternation of FIELDS would be several times slower
+    RE_FIELD = re.compile(r'(?m)^[ \t]*<([A-Za-z]+)>([^\r\n]*)', RE_ASCII)
+    JSON_LINE = u'{' + u', '.join(u'"{0}": %s'.format(field) for field in FIELDS) + u'}\n'
+    RE_NUMBER = re.compile(r'\d+', RE_ASCII)
+    RE_CSV_QUOTE = re.compile(r'[,"\r\n]')
+
+    def __init__(self, out_file, fmt='jsonl'):
+        if fmt not in self.FORMATS:
+            raise CLIError("Unknown export format {0!r}, choose from {1}.".format(fmt, ', '.join(self.FORMATS)))
+        from json.encoder import encode_basestring
+        self.out_file = out_file
+        self.fmt = fmt
+        self.count = 0
+        self.encode_string = encode_basestring
+        if fmt == 'csv':
+            self.write_csv(self.FIELDS)
+
+    def add(self, trn, matches, rules):
+        '''add(trn, matches, rules): write the record of repaired transaction trn
+
+        matches are the matches of RuleSet rules which repaired it.
+        '''
+        values = dict.fromkeys(self.FIELDS)
+        for tag, value in self.RE_FIELD.findall(trn):
+            tag = tag.upper()
+            if tag in self.TAGS and values[tag] is None:
+                values[tag] = value.rstrip()
+        for m in matches:
+            kept = rules.kept_part(m)
+            number = kept and self.RE_NUMBER.search(kept)
+            if number:
+                values['CONFIRMATION'] = number.group()
+                break
+        if self.fmt == 'csv':
+            self.write_csv([values[field] for field in self.FIELDS])
+        else:
+            self.out_file.write(self.JSON_LINE % tuple(u'null' if values[field] is None
+                                                        else self.encode_string(values[field]) for field in self.FIELDS))
+        self.count += 1
+
+    def write_csv(self, values):
+        '''write_csv(values): write a CSV row, quoted as the csv module's default dialect would'''
+        self.out_file.write(u','.join(u'' if v is None else u'"{0}"'.format(v.replace(u'"', u'""'))
+                                      if self.RE_CSV_QUOTE.search(v) else v for v in values) + u'\r\n')
+
 class OFXRepairer(object):
-    def __init__(self, in_file=None, out_file=None):
-        r'''OFXRepairer(in_file, out_file): prepare to repair OFX
+    def __init__(self, in_file=None, out_file=None, metrics=None, rules=None, export=None, pool=None):
+        r'''OFXRepairer(in_file, out_file, metrics, rules): prepare to repair OFX
         
         Instantiate with file objects for input and output to perform
-        a repair. Caller must open and close file objects.
+        a repair. Caller must open and close file objects. Pass a
+        RepairMetrics as metrics to time the repair's phases, a RuleSet
+        as rules to repair other than by VANCITY_RULES, and a
+        TransactionExporter as export to write a record of each repaired
+        transaction in the same pass. Given a multiprocessing.Pool as
+        pool, write() repairs with repair_parallel().
         
         You can instantiate without file parameters in test fixtures,
         in order to exercise the methods. 
+
+        in_file need not be seekable. The headers of a pipe, or of any
+        PathFile, are read with PathFile.peek(), and so are read again
+        with the rest of the file.
         
         # Test a complete file example
         >>> import io, tempfile, os
@@ -265,36 +773,99 @@ class OFXRepairer(object):
         ... </OFX>
         ... """.encode('cp1252'))
         >>> try:
-        ...     (out_fd, out_path) = tempfile.mkstemp(); out_file = os.fdopen(out_fd, 'w')
+        ...     (out_fd, out_path) = tempfile.mkstemp(); out_file = os.fdopen(out_fd, 'wb')
         ...     r = OFXRepairer(in_file, out_file); r.write()
         ...     out_file = io.open(out_path, 'rb'); bb = out_file.readlines();
         ... finally:
         ...     os.remove(out_path)
-        >>> bb[16].strip()
-        '<NAME>VISA'
-        >>> bb[17].strip()
-        '<MEMO>payment Confirmation #881665'
+        >>> bb[16].strip() == b'<NAME>VISA'
+        True
+        >>> bb[17].strip() == b'<MEMO>payment Confirmation #881665'
+        True
+
+        >>> class Pipe(io.BytesIO):
+        ...     def seekable(self):
+        ...         return False
+        >>> out_file = io.BytesIO(); out_file.close = lambda: None
+        >>> r = OFXRepairer(Pipe(in_file.getvalue()), out_file); r.write_stream()
+        >>> r.codec_name == 'cp1252', out_file.getvalue().splitlines()[16].strip() == b'<NAME>VISA'
+        (True, True)
         '''
         
         self.out_file = out_file
         self.in_file = self.codec_name = None
+        self.metrics = metrics or RepairMetrics(timing=False)
+        self.rules = rules or self.RULES
+        self.export = export
+        self.pool = pool
         if in_file is not None:
-            # OfxFile reads the headers, and it handles encoding. 
-            # Its ._fh is a file object which decodes properly.
-            f = OfxFile(in_file)
-            self.in_file = f.fh
-            self.in_file.seek(0)  # Later, we reread from beginning
-            self.codec_name = self.codec_name_from_ofx_headers(f.headers)
+            # The headers give the encoding. Reread from the beginning
+            # through a reader which decodes properly.
+            with self.metrics.phase('header'):
+                seekable = getattr(in_file, 'seekable', None)
+                if not isinstance(in_file, PathFile) and seekable is not None and seekable():
+                    headers = self.read_ofx_headers(in_file)
+                    in_file.seek(0)
+                else:
+                    if not isinstance(in_file, PathFile):
+                        in_file = PathFile(in_file)
+                    headers = self.read_ofx_headers(io.BytesIO(in_file.peek(self.HEADER_SIZE)))
+                self.codec_name = self.codec_name_from_ofx_headers(headers)
+            self.metrics.codec_name = self.codec_name
+            self.in_file = codecs.lookup(self.codec_name).streamreader(in_file)
 
     def __del__(self):
         '''OFXRepairer destructor: close file handles'''
         if self.in_file is not None:
             self.in_file.close()
 
+    HEADER_SIZE = 10 * 1024  # bytes read by read_ofx_headers()
+
+    def read_ofx_headers(self, in_file):
+        r'''read_ofx_headers(in_file): read OFX headers from a binary file
+
+        The SGML headers, OFXHEADER through CHARSET and so on, are
+        "NAME:VALUE" lines before the first '<', ending at a blank line.
+        Only the start of in_file is read, and only the header block is
+        parsed. Returns an ordered dict of text names and values.
+        Names are in upper case. A file with no header block, such as
+        an XML OFX file, gives an empty dict.
+        >>> import io
+        >>> r = OFXRepairer(None)
+        >>> h = r.read_ofx_headers(io.BytesIO(
+        ...     b'OFXHEADER:100\r\nENCODING:USASCII\r\ncharset: 1252 \r\n\r\n<OFX>'))
+        >>> [(str(k), str(v)) for k, v in h.items()]
+        [('OFXHEADER', '100'), ('ENCODING', 'USASCII'), ('CHARSET', '1252')]
+        >>> len(r.read_ofx_headers(io.BytesIO(b'<?xml version="1.0"?><OFX>')))
+        0
+        '''
+        # based on ofxparse.ofxparse.OfxFile.read_headers()
+        head = in_file.read(self.HEADER_SIZE)
+        i = head.find(b'<')
+        if i >= 0:
+            head = head[:i]
+
+        headers = collections.OrderedDict()
+        for line in head.splitlines():
+            if not line.strip():
+                break
+            name, sep, value = line.partition(b':')
+            if sep:
+                headers[name.strip().upper().decode('ascii', 'replace')] = \
+                        value.strip().decode('ascii', 'replace')
+        return headers
+
     def codec_name_from_ofx_headers(self, headers):
         '''From OFX headers dict, derive Python codec name
         
         headers: (ordered) dict, with ENCODING and CHARSET entries.
+        >>> r = OFXRepairer(None)
+        >>> r.codec_name_from_ofx_headers({'ENCODING': 'USASCII', 'CHARSET': '1252'})
+        'cp1252'
+        >>> r.codec_name_from_ofx_headers({'ENCODING': 'USASCII', 'CHARSET': '8859-1'})
+        'iso-8859-1'
+        >>> r.codec_name_from_ofx_headers({})
+        'ascii'
         '''
         # based on ofxparse.ofxparse.handle_encoding()
         enc = headers.get('ENCODING')
@@ -305,6 +876,8 @@ class OFXRepairer(object):
 
         if enc == "USASCII":
             cp = headers.get("CHARSET", "1252")
+            if cp == "8859-1":
+                return "iso-8859-1"
             return "cp%s" % (cp, )
 
         elif enc in ("UNICODE", "UTF-8"):
@@ -314,21 +887,20 @@ class OFXRepairer(object):
         return None
         
         
-    # Regular expression extracting content between OFX start and end elements
-    RE_OFX = re.compile(r'(?is)([^<]*<OFX>)(.*?)(</OFX>.*)')
-    
     def split_input(self, s):
         r'''Split_input(s): split string s into pre, to_repair, and post strings
 
-        RE_OFX is a regular expression which recognises three groups:
-        pre-target, target, and post-target.  
-        An <OFX> element ends the pre-target. An </OFX> starts the post-target.
-        Given a string that matches this RE, return the three parts.
+        There are three parts: pre-target, target, and post-target.
+        An <OFX> element, which must be the first tag, ends the pre-target.
+        The first </OFX> after it starts the post-target. The tags are
+        found with RE_OFX_START and RE_OFX_END, rather than one regular
+        expression whose lazy .*? would step through the target a
+        character at a time.
         >>> r = OFXRepairer(None)
         >>> r.split_input("foo foo <OFX>stuff stuff stuff</OFX>bar bar")
         ('foo foo <OFX>', 'stuff stuff stuff', '</OFX>bar bar')
         
-        Given a string that does not match this RE, return three Nones.
+        Given a string without those tags, return three Nones.
         >>> r.split_input("Has <OFX> element, but does not fully match.")
         (None, None, None)
         >>> r.split_input("Does not match at all.")
@@ -391,23 +963,166 @@ class OFXRepairer(object):
 
         '''
 
-        m_ofx = self.RE_OFX.match(s)
-        if m_ofx and m_ofx.lastindex == 3:
+        # OFXRepairer's own, text, patterns, which BytesRepairer replaces with bytes ones
+        i = s.find('<')
+        start = OFXRepairer.RE_OFX_START.match(s, i) if i >= 0 else None
+        end = start and OFXRepairer.RE_OFX_END.search(s, start.end())
+        if end:
             # valid contents: return them
-            return m_ofx.group(1), m_ofx.group(2), m_ofx.group(3)
+            return s[:start.end()], s[start.end():end.start()], s[end.start():]
         # Failed, return Nones
         return None, None, None
 
 
-    # Regular expression extracting STMTTRN element
-    RE_STMTTRN = re.compile(r'''(?ix)
-                (?P<pre><STMTTRN>\s*\n(.*\n)*?)
-                # Require both <NAME> and <MEMO> if we are to repair
-                (?P<name_tag>\s*<NAME>)(?P<name_line>.*?)\n
-                (?P<memo_tag>\s*<MEMO>)(?P<memo_line>.*?)
-                      (?P<conf_field>(\s*Confirmation\s\#\d+\s*)?)\n
-                (?P<post>(.*?\n)*?\s*</STMTTRN>)''')
-    
+    # Regular expression finding STMTTRN start and end tags
+    RE_STMTTRN_TAG = re.compile(r'(?i)<(/?)STMTTRN>', RE_ASCII)
+    TAG_KEEP = len('</STMTTRN>') - 1  # longest partial tag at a chunk's end
+    # Regular expressions checking the start tag ends its line, and the
+    # end tag begins its line
+    RE_STMTTRN_START = re.compile(r'(?i)<STMTTRN>\s*\n', RE_ASCII)
+    RE_STMTTRN_END = re.compile(r'(?i)\s*</STMTTRN>', RE_ASCII)
+    # The rules of the repair, unless others are given
+    RULES = RuleSet(VANCITY_RULES)
+
+    def repair_transaction(self, trn):
+        r'''repair_transaction(trn): repair one STMTTRN element, return it
+
+        trn is the text of one transaction, from its <STMTTRN> start tag
+        to its </STMTTRN> end tag. The start tag must end its line, and
+        the end tag must begin its line (after whitespace). The first
+        <NAME> line which is directly followed by a <MEMO> line has its
+        contents swapped with that <MEMO> line's contents, or whatever
+        else self.rules say.
+        >>> r = OFXRepairer(None)
+        >>> print(r.repair_transaction("""<STMTTRN>
+        ... <NAME>payment
+        ... <MEMO>VISA Confirmation #881665
+        ... </STMTTRN>"""))
+        <STMTTRN>
+        <NAME>VISA
+        <MEMO>payment Confirmation #881665
+        </STMTTRN>
+
+        A transaction with text before the end tag on its line is unchanged.
+        >>> print(r.repair_transaction("""<STMTTRN>
+        ... <NAME>payment
+        ... <MEMO>VISA
+        ... <TRNAMT>1.00</STMTTRN>"""))
+        <STMTTRN>
+        <NAME>payment
+        <MEMO>VISA
+        <TRNAMT>1.00</STMTTRN>
+        '''
+        matches = self.match_transaction(trn)
+        self.metrics.count(matches, self.rules)
+        for m in reversed(matches):
+            trn = trn[:m.start()] + self.rules.apply(m) + trn[m.end():]
+        if self.export is not None:
+            self.export.add(trn, matches, self.rules)
+        return trn
+
+    def match_transaction(self, trn):
+        '''match_transaction(trn): find the field lines to change in one STMTTRN
+
+        trn is as for repair_transaction(). Returns the list of the
+        matches of self.rules, in order, which may be empty. Works on
+        bytes as well as text.
+        '''
+        matches = self.rules.matches(trn)
+        if not matches or not self.RE_STMTTRN_START.match(trn):
+            return []
+        m = matches[-1]
+        nl = trn[m.end() - 1:m.end()]  # the last matched line's '\n', of trn's type
+        end = len(trn) - len('</STMTTRN>')
+        if not self.RE_STMTTRN_END.match(trn, trn.rfind(nl, 0, end) + 1):
+            return []
+        return matches
+
+    def iter_matches(self, data, pos=0, endpos=None):
+        r'''iter_matches(data, pos, endpos): yield (offset, matches) for each transaction
+
+        Finds the transactions of data[pos:endpos] as repair_chunks() does,
+        and yields the offset of each, with its match_transaction(), having
+        counted it in self.metrics. Builds no repaired text. data is text,
+        or for BytesRepairer, bytes or an mmap.
+        >>> r = OFXRepairer(None)
+        >>> s = "<STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n<STMTTRN>\n</STMTTRN>\n"
+        >>> [(offset, len(matches)) for offset, matches in r.iter_matches(s)]
+        [(0, 1), (37, 0)]
+        >>> r.metrics.transactions, r.metrics.swapped
+        (2, 1)
+        '''
+        trn = None
+        for m in self.RE_STMTTRN_TAG.finditer(data, pos, len(data) if endpos is None else endpos):
+            if not m.group(1):
+                trn = m.start()
+            elif trn is not None:
+                matches = self.match_transaction(data[trn:m.end()])
+                self.metrics.count(matches, self.rules)
+                yield trn, matches
+                trn = None
+
+    def repair_chunks(self, chunks):
+        r'''repair_chunks(chunks): yield repaired text, a block at a time
+
+        chunks is an iterable of strings, which together make up the text
+        to repair. This is a single forward pass over the STMTTRN start
+        and end tags, so it takes time proportional to the text length.
+        Each transaction is held only until its end tag arrives, then
+        repaired by repair_transaction() and yielded. Text between
+        transactions is yielded as it is scanned. A transaction which lacks
+        an end tag is passed through unrepaired, so a repair never reaches
+        beyond its own transaction.
+        >>> r = OFXRepairer(None)
+        >>> s = """<STMTTRN>
+        ... <NAME>payment
+        ... <STMTTRN>
+        ... </STMTTRN>
+        ... <STMTTRN>
+        ... <NAME>payment
+        ... <MEMO>VISA
+        ... </STMTTRN>
+        ... """
+        >>> print(''.join(r.repair_chunks([s])))
+        <STMTTRN>
+        <NAME>payment
+        <STMTTRN>
+        </STMTTRN>
+        <STMTTRN>
+        <NAME>VISA
+        <MEMO>payment
+        </STMTTRN>
+        <BLANKLINE>
+
+        Tags may straddle chunks. The result does not depend on chunking.
+        >>> chunks = [s[i:i+4] for i in range(0, len(s), 4)]
+        >>> ''.join(r.repair_chunks(chunks)) == ''.join(r.repair_chunks([s]))
+        True
+        '''
+        buf = ''
+        done = 0     # buf[:done] has been yielded
+        scan = 0     # search for tags from buf[scan:]
+        trn = None   # buf[trn:] is an unfinished transaction
+        for chunk in chunks:
+            buf = buf[done:] + chunk
+            scan -= done
+            if trn is not None:
+                trn -= done
+            done = 0
+            for m in self.RE_STMTTRN_TAG.finditer(buf, scan):
+                scan = m.end()
+                if not m.group(1):
+                    trn = m.start()
+                elif trn is not None:
+                    yield buf[done:trn]
+                    yield self.repair_transaction(buf[trn:scan])
+                    done, trn = scan, None
+            scan = max(scan, len(buf) - self.TAG_KEEP)
+            if trn is None and scan > done:
+                yield buf[done:scan]
+                done = scan
+        yield buf[done:]
+
     def repair(self, to_repair):
         r'''repair(to_repair): perform the repair on string s, returning repaired s
         
@@ -552,22 +1267,57 @@ class OFXRepairer(object):
         End of tests.
         '''
 
-        def repl(m):
-            """Safely generate a replace string from a match object
-            
-            We can't use re.sub() with named groups, because Python before 3.4
-            throws "unmatched group" errors instead of substituting ''.
-            """
-            g = m.groupdict(default='')
-            new_name = g['name_tag']+g['memo_line']+'\n' \
-                            if g['name_tag'] else ''
-            new_memo = g['memo_tag']+g['name_line']+g['conf_field']+'\n' \
-                            if g['memo_tag'] else ''
-            return g['pre'] + new_name + new_memo + g['post']
+        return ''.join(self.repair_chunks([to_repair]))
+
+    PIECE_SIZE = 4 * 1024 * 1024  # characters per piece in repair_parallel()
+    RE_STMTTRN_CLOSE = re.compile(r'(?i)</STMTTRN>', RE_ASCII)
+
+    def split_pieces(self, to_repair, size=None):
+        r'''split_pieces(to_repair, size): yield to_repair in pieces, each cut after a </STMTTRN>
+
+        Each piece but the last is at least size characters, and ends
+        with a </STMTTRN> end tag. After any end tag, repair_chunks() has
+        no transaction open, so repairing the pieces one by one gives the
+        same text as repairing the whole.
+        >>> r = OFXRepairer(None)
+        >>> pieces = r.split_pieces(u"<STMTTRN>\n</STMTTRN>\n<stmttrn>\n</stmttrn>\n", 3)
+        >>> list(pieces) == [u'<STMTTRN>\n</STMTTRN>', u'\n<stmttrn>\n</stmttrn>', u'\n']
+        True
+        '''
+        size = size or self.PIECE_SIZE
+        start = 0
+        while start < len(to_repair):
+            m = self.RE_STMTTRN_CLOSE.search(to_repair, start + size)
+            end = m.end() if m else len(to_repair)
+            yield to_repair[start:end]
+            start = end
+
+    def repair_parallel(self, to_repair, pool, size=None):
+        r'''repair_parallel(to_repair, pool, size): repair(), with the work shared by a process pool
 
-        return self.RE_STMTTRN.sub(repl, to_repair)
-        # note: since re.sub() has no count, it substitutes all occurrences.
-       
+        to_repair is split by split_pieces(), the pool's processes repair
+        the pieces with repair_piece(), and the results are joined in
+        order. The result is the same as from repair(), and the pieces'
+        transaction counts are added to self.metrics. Worth it for texts
+        of many pieces; the pieces are copied to and from the processes.
+        >>> import multiprocessing
+        >>> r = OFXRepairer(None)
+        >>> text = u"<STMTTRN>\n<NAME>a\n<MEMO>b #1\n</STMTTRN>\n  <STMTTRN>\n<NAME>c\n</STMTTRN>\n" * 5
+        >>> pool = multiprocessing.Pool(2)
+        >>> r.repair_parallel(text, pool, 7) == r.repair(text)
+        True
+        >>> r.metrics.transactions, r.metrics.swapped
+        (20, 10)
+        >>> pool.close(); pool.join()
+        '''
+        tasks = ((piece, self.rules) for piece in self.split_pieces(to_repair, size))
+        repaired = []
+        for text, transactions, swapped, confirmations in pool.imap(repair_piece, tasks):
+            repaired.append(text)
+            self.metrics.transactions += transactions
+            self.metrics.swapped += swapped
+            self.metrics.confirmations += confirmations
+        return ''.join(repaired)
 
     def write(self):
         '''repair and write out the repaired file contents
@@ -577,176 +1327,3276 @@ class OFXRepairer(object):
             return
         
         with codecs.lookup(self.codec_name).streamwriter(self.out_file) as fh_out:
-            s = self.in_file.read()
-            pre, to_repair, post = self.split_input(s)
+            with self.metrics.phase('decode'):
+                s = self.in_file.read()
+            with self.metrics.phase('split_input'):
+                pre, to_repair, post = self.split_input(s)
             if pre is None:
                 raise CLIError('Appears to not be OFX: {0}'.format(self.in_file.name))
             else:                
-                fh_out.write(pre)
-                fh_out.write(self.repair(to_repair))
-                fh_out.write(post)
-        
+                with self.metrics.phase('repair'):
+                    if self.pool is not None:
+                        repaired = self.repair_parallel(to_repair, self.pool)
+                    else:
+                        repaired = self.repair(to_repair)
+                for text in (pre, repaired, post):
+                    self.encode_write(fh_out, text)
 
-def main(argv=None): # IGNORE:C0111
-    '''Command line options.
+    def encode_write(self, fh_out, text):
+        '''encode_write(fh_out, text): write text through streamwriter fh_out
 
-    Only works on files with specific extensions.
-    However, the exit code is 0, not an error exit code.
-    >>> sys.argv[1:] = ['foo.dat']
-    >>> main()
-    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
-    <BLANKLINE>
-    I don't work on files ending in '.dat': foo.dat.
-    0
-    
-    If the input file doesn't exist, it prints an error message and continues.
-    >>> import os, os.path, tempfile
-    >>> p = tempfile.mkdtemp()
-    >>> sys.argv[1:] = [ os.path.join(p, 'nonexistent.ofx') ]
-    >>> main()        # doctest: +ELLIPSIS
-    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
-    <BLANKLINE>
-    SORRY: File '...nonexistent.ofx' doesn't appear to exist.
-    0
+        Does what fh_out.write(text) does, but times the encoding and the
+        writing as separate phases.
+        '''
+        if not self.metrics.timing:
+            fh_out.write(text)
+            return
+        with self.metrics.phase('encode'):
+            data = fh_out.encode(text, fh_out.errors)[0]
+        with self.metrics.phase('write'):
+            fh_out.stream.write(data)
 
-    If the output file exists, it prints an error message and continues.
-    >>> f1 = open( os.path.join(p, 'existing.ofx'), 'w' ); f1.write(''); f1.close()
-    >>> f2 = open( os.path.join(p, 'existing.repaired.ofx'), 'w' ); f2.write(''); f2.close()
-    >>> sys.argv[1:] = [ f1.name ]
-    >>> main()        # doctest: +ELLIPSIS
-    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
-    <BLANKLINE>
-    SORRY: Output file '...existing.repaired.ofx' already exists, so unable to repair '...existing.ofx'.
-    0
+    READ_SIZE = 64 * 1024  # characters per read() in the streaming methods
 
-    >>> os.remove(f1.name); os.remove( f2.name );
-    >>> os.rmdir(p)
-    '''
+    def iter_chunks(self, fh, size=None):
+        '''iter_chunks(fh): yield the contents of file fh, a chunk at a time'''
+        size = size or self.READ_SIZE
+        while True:
+            with self.metrics.phase('decode'):
+                chunk = fh.read(size)
+            if not chunk:
+                return
+            yield chunk
 
-    if argv is None:
-        argv = sys.argv
-    else:
-        sys.argv.extend(argv)
+    # Regular expressions finding the start and end of the <OFX> element
+    RE_OFX_START = re.compile(r'(?i)<OFX>', RE_ASCII)
+    RE_OFX_END = re.compile(r'(?i)</OFX>', RE_ASCII)
 
-    program_name = os.path.basename(sys.argv[0])
-    program_version = "v%s" % __version__
-    program_build_date = str(__updated__)
-    program_version_message = '%%(prog)s %s (%s)' % (program_version, program_build_date)
-    program_shortdesc = __import__('__main__').__doc__.split("\n")[1]
-    program_license = '''%s
+    def iter_repaired(self, fh, size=None):
+        r'''iter_repaired(fh): yield repaired text of fh, a block at a time
 
-vanswap_ofx is a utility to repair OFX files by swapping the NAME 
-and MEMO fields. It works around a problem with OFX files created 
-by my credit union after a system upgrade in 2016. They generated OFX
-files with the NAME string in the MEMO field, and vice versa. This 
-utility repairs the OFX file by reading it in, and switching the values
-of NAME and MEMO in each transaction. If there is a confirmation number 
-in the MEMO field, it stays in the MEMO field. Then it writes the 
-repaired content out to a sister file, with a ".repaired" subextension, 
-in the same directory. 
+        Reads the text file fh incrementally, and yields the same text
+        as split_input() and repair() would produce from the whole file.
+        See repair_chunks(). Memory use is bounded by the largest
+        transaction, not by the file size.
+        >>> import io
+        >>> r = OFXRepairer(None)
+        >>> s = u"""HEADER:1
+        ...
+        ... <OFX>
+        ...  <STMTTRN>
+        ...   <NAME>Interest credited to account
+        ...  </STMTTRN>
+        ...  <STMTTRN>
+        ...   <NAME>payment
+        ...   <MEMO>VISA Confirmation #881665
+        ...  </STMTTRN>
+        ... </OFX>
+        ... """
+        >>> blocks = list(r.iter_repaired(io.StringIO(s), 7))
+        >>> print(u''.join(blocks))
+        HEADER:1
+        <BLANKLINE>
+        <OFX>
+         <STMTTRN>
+          <NAME>Interest credited to account
+         </STMTTRN>
+         <STMTTRN>
+          <NAME>VISA
+          <MEMO>payment Confirmation #881665
+         </STMTTRN>
+        </OFX>
+        <BLANKLINE>
+        >>> pre, to_repair, post = r.split_input(s)
+        >>> u''.join(blocks) == pre + r.repair(to_repair) + post
+        True
 
-e.g. the command: vanswap.py statements/transactions_201610.ofx
-writes repaired content to   statements/transactions_201610.repaired.ofx
+        Input which split_input() rejects raises a CLIError. Nothing is
+        yielded for input lacking <OFX>. Input lacking </OFX> is only
+        detected at its end.
+        >>> list(r.iter_repaired(io.StringIO(u"No OFX <element> here.")))  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+          ...
+        CLIError: E: Appears to not be OFX: <_io.StringIO object at ...>
+        >>> print(u''.join(r.iter_repaired(io.StringIO(u"<OFX> no end"), 3)))  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+          ...
+        CLIError: E: Appears to not be OFX: <_io.StringIO object at ...>
+        '''
+        return self.repair_text_chunks(self.iter_chunks(fh, size), getattr(fh, 'name', repr(fh)))
 
-Updated by Jim DeLaHunt on %s.
-Main program is granted to the public domain. Some modules are copyright 
-by their authors, and released under the MIT licence.
-Distributed on an "AS IS" basis without warranties
-or conditions of any kind, either express or implied.
+    def repair_text_chunks(self, chunks, name):
+        '''repair_text_chunks(chunks, name): yield repaired text of a whole file's chunks
 
-USAGE
-''' % (program_shortdesc, str(__date__))
+        The work of iter_repaired(), on any iterable of text chunks, such
+        as a decoder's output. name identifies the input in a CLIError.
+        '''
+        chunks = iter(chunks)
+        keep = len('</OFX>') - 1
+
+        # Before <OFX>: the header, which must contain no '<'.
+        s = u''
+        for chunk in chunks:
+            s += chunk
+            i = s.find(u'<')
+            if i >= 0 and len(s) - i > keep:
+                break
+        m = self.RE_OFX_START.match(s, max(s.find(u'<'), 0))
+        if not m:
+            raise CLIError('Appears to not be OFX: {0}'.format(name))
+        yield s[:m.end()]
+
+        # Between <OFX> and </OFX>: repair transactions.
+        post = []
+        def body_chunks(s):
+            while True:
+                m = self.RE_OFX_END.search(s)
+                if m:
+                    post.append(s[m.start():])
+                    yield s[:m.start()]
+                    return
+                i = max(len(s) - keep, 0)
+                yield s[:i]
+                chunk = next(chunks, None)
+                if chunk is None:
+                    yield s[i:]
+                    return
+                s = s[i:] + chunk
+        for block in self.repair_chunks(body_chunks(s[m.end():])):
+            yield block
+        if not post:
+            raise CLIError('Appears to not be OFX: {0}'.format(name))
+
+        # After </OFX>: pass through unchanged.
+        yield post[0]
+        for chunk in chunks:
+            yield chunk
+
+    def write_stream(self):
+        '''repair and write out the file contents, a transaction at a time
+
+        Produces the same output as write(), but never holds the whole
+        file in memory. See iter_repaired().
+        '''
+        if self.out_file is None:
+            return
+
+        with codecs.lookup(self.codec_name).streamwriter(self.out_file) as fh_out:
+            for block in self.metrics.iterate('repair', self.iter_repaired(self.in_file)):
+                self.encode_write(fh_out, block)
 
+
+def bytes_pattern(pattern):
+    '''bytes_pattern(pattern): compile a version of text regex pattern for bytes'''
+    return re.compile(pattern.pattern.encode('ascii'), pattern.flags & ~re.UNICODE)
+
+def fsync_dir(path):
+    '''fsync_dir(path): sync the directory at path
+
+    This makes the creation or removal of a file in the directory last
+    through a crash. Does nothing where directories can't be opened,
+    as on Windows.
+    '''
     try:
-        # Setup argument parser
-        parser = ArgumentParser(description=program_license, formatter_class=RawDescriptionHelpFormatter)
-        # parser.add_argument("-r", "--recursive", dest="recurse", action="store_true", help="recurse into subfolders [default: %(default)s]")
-        parser.add_argument("-v", "--verbose", dest="verbose", action="count", 
-                            default=0, help="set verbosity level [default: %(default)s]")
-        # parser.add_argument("-i", "--include", dest="include", help="only include paths matching this regex pattern. Note: exclude is given preference over include. [default: %(default)s]", metavar="RE" )
-        # parser.add_argument("-e", "--exclude", dest="exclude", help="exclude paths matching this regex pattern. [default: %(default)s]", metavar="RE" )
-        parser.add_argument('-V', '--version', action='version', version=program_version_message)
-        parser.add_argument(dest="paths", help="paths to files(s) to repair [default: %(default)s]", 
-                            metavar="path", nargs='+')
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
-        # Process arguments
-        args = parser.parse_args()
+class BytesRepairer(OFXRepairer):
+    '''BytesRepairer: find the repair of an OFX file in its raw bytes
 
-        paths = args.paths
-        verbose = args.verbose
-        # recurse = args.recurse
-        # inpat = args.include
-        # expat = args.exclude
-        
-        print("{0}: {1}\n".format(program_name, program_shortdesc))
+    In an encoding where the tags, the line ends and whitespace are the
+    same bytes as in ASCII, the <NAME> and <MEMO> lines can be found and
+    swapped without decoding the file. Subclasses decide where the
+    changed bytes go, and set path, for messages.
+    '''
 
-        if verbose > 0:
-            print("Verbose mode on")
-#             if recurse:
-#                 print("Recursive mode on")
-#             else:
-#                 print("Recursive mode off")
-            print("Repairing {0} files: {1}".format(len(paths), paths))
-
-        file_manager = FilterInOutFiles('.repaired')
-        # repaired files have this extra extension before their extension
-        # e.g. foo.ofx after repair is written to foo.repaired.ofx
-
-        for inpath in paths:
-            (_,ext) = os.path.splitext(inpath)
-            if ext.lower() in ['.ofx', '.qfx']:
-                if verbose > 0:
-                    print("Repairing {0}...".format(inpath))
-                try:
-                    in_file, out_file = file_manager.open_in_out_files(inpath)
-                except (IOError, OSError), e:
-                    import errno
-                    if e.errno == errno.ENOENT:
-                        print("SORRY: File '{0}' doesn't appear to exist.".format(e.filename))                        
-                    elif e.errno == errno.EEXIST:
-                        print("SORRY: Output file '{1}' already exists, so unable to repair '{0}'.".format(inpath, e.filename))
-                    else:
-                        print("SORRY: Unable to repair '{0}', because exception '{1}' occurred.".format(inpath, e))
-                    break # give up in inpath, go on to next
-                
-                r = OFXRepairer(in_file, out_file)
-                r.write()
-                print("Copy of '{0}' repaired, in '{1}'.".format(inpath, out_file.name))
-            else:
-                print("I don't work on files ending in '{0}': {1}.".format(ext, inpath))
-            file_manager.close()
+    # OFXRepairer's regular expressions, for bytes
+    RE_STMTTRN_TAG = bytes_pattern(OFXRepairer.RE_STMTTRN_TAG)
+    RE_STMTTRN_START = bytes_pattern(OFXRepairer.RE_STMTTRN_START)
+    RE_STMTTRN_END = bytes_pattern(OFXRepairer.RE_STMTTRN_END)
+    RE_OFX_START = bytes_pattern(OFXRepairer.RE_OFX_START)
+    RE_OFX_END = bytes_pattern(OFXRepairer.RE_OFX_END)
 
-        return 0
-    
-    except KeyboardInterrupt:
-        ### handle keyboard interrupt ###
-        return 0
-    except Exception, e:
-        if DEBUG or TESTRUN:
-            raise(e)
-        indent = len(program_name) * " "
-        sys.stderr.write(program_name + ": " + repr(e) + "\n")
-        sys.stderr.write(indent + "  for help use --help\n")
-        return 2
+    def body(self, data):
+        '''body(data): the (start, end) of the OFX body in data, as split_input() finds it'''
+        i = data.find(b'<')
+        m = self.RE_OFX_START.match(data, i) if i >= 0 else None
+        end = m and self.RE_OFX_END.search(data, m.end())
+        if not end:
+            raise CLIError('Appears to not be OFX: {0}'.format(self.path))
+        return m.end(), end.start()
 
-if __name__ == "__main__":
-    if DEBUG:
-#        sys.argv.append("-h")
-        sys.argv.append("-v")
-#        sys.argv.append("-r")
-    if TESTRUN:
-        import doctest
-        doctest.testmod()
-        sys.exit(0)
-    if PROFILE:
-        import cProfile
-        import pstats
-        profile_filename = 'vanswap_ofx_profile.txt'
-        cProfile.run('main()', profile_filename)
-        statsfile = open("profile_stats.txt", "wb")
-        p = pstats.Stats(profile_filename, stream=statsfile)
-        stats = p.strip_dirs().sort_stats('cumulative')
-        stats.print_stats()
-        statsfile.close()
+    def changes(self, data):
+        '''changes(data): yield (offset, old, new) for each range to rewrite
+
+        data is the file contents, as bytes or an mmap. The body and the
+        transactions are found as split_input() and repair_chunks() find
+        them, without copying more than one transaction at a time.
+        '''
+        for trn, matches in self.iter_matches(data, *self.body(data)):
+            for m_fields in matches:
+                old, new = m_fields.group(), self.rules.apply(m_fields)
+                if new != old:
+                    yield (trn + m_fields.start(), old, new)
+
+class InPlaceRepairer(BytesRepairer):
+    r'''InPlaceRepairer(path): repair an OFX file where it lies, through mmap
+
+    The repair moves text between the <NAME> and <MEMO> lines, but leaves
+    each transaction's length unchanged. So for a file in a single-byte
+    encoding, the bytes which change can be rewritten in the file itself,
+    with no decoding, no encoding, and no copy of the file.
+
+    Before changing any bytes, a run appends their original values to a
+    journal file beside the input, and syncs it. Once the changed file is
+    synced, the journal is removed. If a run is interrupted, the journal
+    remains, and rollback() restores the original bytes from it.
+
+    Note that repairing the same file in place twice swaps the fields back.
+    So main() takes --in-place only with --manifest, which skips a file
+    already repaired.
+
+    >>> import os, shutil, tempfile
+    >>> p = tempfile.mkdtemp(); path = os.path.join(p, 'test.ofx')
+    >>> original = b"""ENCODING:USASCII
+    ... CHARSET:1252
+    ...
+    ... <OFX>
+    ...  <STMTTRN>
+    ...   <NAME>Interest credited to account
+    ...  </STMTTRN>
+    ...  <STMTTRN>
+    ...   <NAME>payment
+    ...   <MEMO>VISA Confirmation #881665
+    ...  </STMTTRN>
+    ... </OFX>
+    ... """
+    >>> with open(path, 'wb') as f: n = f.write(original)
+    >>> r = InPlaceRepairer(path); r.repair()
+    1
+    >>> repaired = open(path, 'rb').read()
+    >>> print(repaired.decode('cp1252'))   # doctest: +NORMALIZE_WHITESPACE
+    ENCODING:USASCII
+    CHARSET:1252
+    <BLANKLINE>
+    <OFX>
+     <STMTTRN>
+      <NAME>Interest credited to account
+     </STMTTRN>
+     <STMTTRN>
+      <NAME>VISA
+      <MEMO>payment Confirmation #881665
+     </STMTTRN>
+    </OFX>
+    >>> os.path.exists(r.journal_path)
+    False
+
+    The result is the same as OFXRepairer's.
+    >>> pre, to_repair, post = r.split_input(original.decode('cp1252'))
+    >>> repaired.decode('cp1252') == pre + OFXRepairer(None).repair(to_repair) + post
+    True
+
+    Simulate a run interrupted after changing bytes, but before removing
+    its journal. rollback() restores the file.
+    >>> changes = list(r.changes(repaired))
+    >>> r.write_journal(changes)
+    >>> with open(path, 'r+b') as f:
+    ...     for offset, old, new in changes:
+    ...         n = f.seek(offset); n = f.write(new)
+    >>> open(path, 'rb').read() == original
+    True
+    >>> r.rollback()
+    True
+    >>> open(path, 'rb').read() == repaired, os.path.exists(r.journal_path)
+    (True, False)
+    >>> shutil.rmtree(p)
+    '''
+
+    # codecs, of those codec_name_from_ofx_headers() gives, with one byte per character
+    SINGLE_BYTE_CODECS = ['ascii', 'iso-8859-1'] + ['cp%d' % cp for cp in range(1250, 1259)]
+    JOURNAL_EXT = '.journal'  # journal path is the input path plus this
+    JOURNAL_MAGIC = b'vanswap_ofx journal 1\n'  # first line of a journal
+    JOURNAL_RECORD = '>QI'  # struct format of the offset and length of original bytes
+    JOURNAL_BATCH = 1024  # changes journalled and synced at a time
+
+    def __init__(self, path, metrics=None, rules=None):
+        OFXRepairer.__init__(self, metrics=metrics, rules=rules)
+        self.path = path
+        self.journal_path = path + self.JOURNAL_EXT
+        with self.metrics.phase('header'):
+            with open(path, 'rb') as f:
+                self.codec_name = self.codec_name_from_ofx_headers(self.read_ofx_headers(f))
+        self.metrics.codec_name = self.codec_name
+
+    def write_journal(self, changes):
+        '''write_journal(changes): append original bytes to the journal, and sync it'''
+        import struct
+        created = not os.path.exists(self.journal_path)
+        with open(self.journal_path, 'ab') as j:
+            if created:
+                j.write(self.JOURNAL_MAGIC)
+            for offset, old, _ in changes:
+                j.write(struct.pack(self.JOURNAL_RECORD, offset, len(old)))
+                j.write(old)
+            j.flush()
+            os.fsync(j.fileno())
+        if created:
+            fsync_dir(os.path.dirname(self.journal_path))
+
+    def remove_journal(self):
+        '''remove_journal(): remove the journal, once the file is synced'''
+        os.remove(self.journal_path)
+        fsync_dir(os.path.dirname(self.journal_path))
+
+    def rollback(self):
+        '''rollback(): undo an interrupted repair, using its journal
+
+        Returns True if there was a journal to roll back, False otherwise.
+        '''
+        if not os.path.exists(self.journal_path):
+            return False
+        import struct
+        size = struct.calcsize(self.JOURNAL_RECORD)
+        with open(self.journal_path, 'rb') as j:
+            if j.read(len(self.JOURNAL_MAGIC)) != self.JOURNAL_MAGIC:
+                raise CLIError("Not a vanswap_ofx journal: {0}".format(self.journal_path))
+            with open(self.path, 'r+b') as f:
+                while True:
+                    record = j.read(size)
+                    if len(record) < size:
+                        break
+                    offset, length = struct.unpack(self.JOURNAL_RECORD, record)
+                    old = j.read(length)
+                    if len(old) < length:
+                        break  # cut short by the interruption, so never applied
+                    f.seek(offset)
+                    f.write(old)
+                f.flush()
+                os.fsync(f.fileno())
+        self.remove_journal()
+        return True
+
+    def repair(self):
+        '''repair(): repair the file in place, return the number of changes
+
+        Rolls back any interrupted earlier repair first.
+        '''
+        if self.codec_name not in self.SINGLE_BYTE_CODECS:
+            raise CLIError("Can't repair in place, because encoding '{0}' is not single-byte: {1}".format(
+                    self.codec_name, self.path))
+        if not self.rules.same_length:
+            raise CLIError("Can't repair in place, because the rules change the lengths of fields: {0}".format(
+                    self.path))
+        self.rollback()
+
+        import mmap
+        count = 0
+        with open(self.path, 'r+b') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise CLIError('Appears to not be OFX: {0}'.format(self.path))
+            mm = mmap.mmap(f.fileno(), 0)
+            try:
+                batch = []
+                for change in self.metrics.iterate('repair', self.changes(mm)):
+                    batch.append(change)
+                    if len(batch) == self.JOURNAL_BATCH:
+                        self.apply(mm, batch)
+                        count += len(batch)
+                        batch = []
+                self.apply(mm, batch)
+                count += len(batch)
+                with self.metrics.phase('write'):
+                    mm.flush()
+            finally:
+                mm.close()
+            with self.metrics.phase('write'):
+                os.fsync(f.fileno())
+        if count:
+            self.remove_journal()
+        return count
+
+    def apply(self, mm, changes):
+        '''apply(mm, changes): journal changes, then make them in mmap mm'''
+        if not changes:
+            return
+        with self.metrics.phase('write'):
+            self.write_journal(changes)
+            for offset, _, new in changes:
+                mm[offset:offset + len(new)] = new
+
+class SpliceRepairer(BytesRepairer):
+    r'''SpliceRepairer(in_file, out_file): repair a copy, copying unchanged bytes
+
+    write() decodes the whole input and encodes it all again, though only
+    the <NAME> and <MEMO> lines change. For a file in an ASCII-compatible
+    encoding, write_splice() instead finds the changed lines in the raw
+    input, writes their swapped bytes, and copies everything between
+    them straight from input to output. in_file must be a real file,
+    since it is mapped with mmap.
+
+    >>> import os, shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> original = u"""ENCODING:UTF-8
+    ...
+    ... <OFX>
+    ...  <STMTTRN>
+    ...   <NAME>Interest credited to account
+    ...  </STMTTRN>
+    ...  <STMTTRN>
+    ...   <NAME>Paiement pr\xe9autoris\xe9
+    ...   <MEMO>CAF\xc9 Confirmation #881665
+    ...  </STMTTRN>
+    ... </OFX>
+    ... """.encode('utf-8')
+    >>> with open(os.path.join(p, 'in.ofx'), 'wb') as f: n = f.write(original)
+    >>> in_file = open(os.path.join(p, 'in.ofx'), 'rb')
+    >>> out_file = open(os.path.join(p, 'out.ofx'), 'wb')
+    >>> r = SpliceRepairer(in_file, out_file); r.SPLICE_MIN = 16; r.write_splice()
+    1
+    >>> in_file.close(); out_file.close()
+    >>> spliced = open(os.path.join(p, 'out.ofx'), 'rb').read()
+    >>> spliced.decode('utf-8').splitlines()[7] == u'  <NAME>CAF\xc9'
+    True
+
+    The result is the same as OFXRepairer's.
+    >>> pre, to_repair, post = r.split_input(original.decode('utf-8'))
+    >>> spliced.decode('utf-8') == pre + OFXRepairer(None).repair(to_repair) + post
+    True
+    >>> shutil.rmtree(p)
+    '''
+
+    # codecs in which the tags, line ends and whitespace are ASCII bytes
+    SPLICE_CODECS = InPlaceRepairer.SINGLE_BYTE_CODECS + ['utf-8']
+    SPLICE_MIN = 64 * 1024  # unchanged ranges at least this long are copied by the kernel
+
+    def __init__(self, in_file, out_file, metrics=None, rules=None):
+        OFXRepairer.__init__(self, out_file=out_file, metrics=metrics, rules=rules)
+        self.raw_file = in_file
+        self.path = getattr(in_file, 'name', repr(in_file))
+        with self.metrics.phase('header'):
+            self.codec_name = self.codec_name_from_ofx_headers(self.read_ofx_headers(in_file))
+            in_file.seek(0)
+        self.metrics.codec_name = self.codec_name
+        # ways to copy a range between descriptors in the kernel, best first
+        self.copiers = [getattr(self, name) for name in ('copy_file_range', 'sendfile')
+                        if hasattr(os, name)]
+
+    @staticmethod
+    def copy_file_range(in_fd, out_fd, offset, count):
+        return os.copy_file_range(in_fd, out_fd, count, offset)
+
+    @staticmethod
+    def sendfile(in_fd, out_fd, offset, count):
+        return os.sendfile(out_fd, in_fd, offset, count)
+
+    def write_splice(self):
+        '''repair and write out the file, copying the unchanged bytes
+
+        Returns the number of transactions changed. The codec must be one
+        of SPLICE_CODECS. Unlike write(), leaves out_file open.
+        '''
+        if self.out_file is None:
+            return
+        if self.codec_name not in self.SPLICE_CODECS:
+            raise CLIError("Can't splice, because encoding '{0}' is not ASCII-compatible: {1}".format(
+                    self.codec_name, self.path))
+        in_fd = self.raw_file.fileno()
+        size = os.fstat(in_fd).st_size
+        if size == 0:
+            raise CLIError('Appears to not be OFX: {0}'.format(self.path))
+
+        import mmap
+        count = pos = 0
+        mm = mmap.mmap(in_fd, 0, access=mmap.ACCESS_READ)
+        try:
+            for offset, old, new in self.metrics.iterate('repair', self.changes(mm)):
+                with self.metrics.phase('write'):
+                    self.copy_range(mm, pos, offset)
+                    self.out_file.write(new)
+                pos = offset + len(old)
+                count += 1
+            with self.metrics.phase('write'):
+                self.copy_range(mm, pos, size)
+                self.out_file.flush()
+        finally:
+            mm.close()
+        return count
+
+    def copy_range(self, mm, start, end):
+        '''copy_range(mm, start, end): copy input bytes start to end to the output
+
+        A long range is copied by the kernel, with os.copy_file_range() or
+        os.sendfile(), where Python and the file systems allow. The rest
+        is written from slices of mm, the mapped input.
+        '''
+        if end - start >= self.SPLICE_MIN and self.copiers:
+            self.out_file.flush()
+            in_fd, out_fd = self.raw_file.fileno(), self.out_file.fileno()
+            while self.copiers and start < end:
+                try:
+                    n = self.copiers[0](in_fd, out_fd, start, end - start)
+                except OSError:
+                    self.copiers.pop(0)  # not supported here, so try the next way
+                    continue
+                if not n:
+                    break
+                start += n
+        for i in range(start, end, self.SPLICE_MIN):
+            self.out_file.write(mm[i:min(i + self.SPLICE_MIN, end)])
+
+class ScanRepairer(BytesRepairer):
+    r'''ScanRepairer(in_file): count what a repair would change, writing nothing
+
+    scan() finds each transaction, and the fields the rules would swap,
+    as a repair does, but builds no repaired text and writes no output.
+    A file in one of SpliceRepairer.SPLICE_CODECS is scanned in its raw
+    bytes, through mmap, without decoding; any other is decoded first.
+    The counts are in metrics. With stop, the scan ends at the first
+    transaction which needs repair.
+    >>> import os, shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> with open(os.path.join(p, 'in.ofx'), 'wb') as f:
+    ...     n = f.write(b'<OFX>\n<STMTTRN>\n<NAME>a\n<MEMO>b Confirmation #1\n</STMTTRN>\n'
+    ...                 b'<STMTTRN>\n<NAME>c\n</STMTTRN>\n<STMTTRN>\n<NAME>d\n<MEMO>e\n</STMTTRN>\n</OFX>\n')
+    >>> with open(os.path.join(p, 'in.ofx'), 'rb') as f:
+    ...     r = ScanRepairer(f); r.scan()
+    2
+    >>> r.metrics.transactions, r.metrics.swapped, r.metrics.confirmations
+    (3, 2, 1)
+    >>> with open(os.path.join(p, 'in.ofx'), 'rb') as f:
+    ...     r = ScanRepairer(f); r.scan(stop=True)
+    1
+    >>> r.metrics.transactions
+    1
+    >>> os.listdir(p)
+    ['in.ofx']
+    >>> shutil.rmtree(p)
+    '''
+
+    def __init__(self, in_file, metrics=None, rules=None):
+        OFXRepairer.__init__(self, metrics=metrics, rules=rules)
+        self.raw_file = in_file
+        self.path = getattr(in_file, 'name', repr(in_file))
+        with self.metrics.phase('header'):
+            self.codec_name = self.codec_name_from_ofx_headers(self.read_ofx_headers(in_file))
+            in_file.seek(0)
+        self.metrics.codec_name = self.codec_name
+
+    def scan(self, stop=False):
+        '''scan(stop): count the transactions of the file; return the number to repair'''
+        if self.codec_name not in SpliceRepairer.SPLICE_CODECS:
+            with self.metrics.phase('decode'):
+                s = codecs.lookup(self.codec_name).decode(self.raw_file.read())[0]
+            with self.metrics.phase('split_input'):
+                _, to_repair, _ = self.split_input(s)
+            if to_repair is None:
+                raise CLIError('Appears to not be OFX: {0}'.format(self.path))
+            # OFXRepairer's text patterns, on the same metrics and rules
+            return self.count(OFXRepairer(None, metrics=self.metrics, rules=self.rules).iter_matches(to_repair),
+                              stop)
+        import mmap
+        in_fd = self.raw_file.fileno()
+        if os.fstat(in_fd).st_size == 0:
+            raise CLIError('Appears to not be OFX: {0}'.format(self.path))
+        mm = mmap.mmap(in_fd, 0, access=mmap.ACCESS_READ)
+        try:
+            with self.metrics.phase('split_input'):
+                start, end = self.body(mm)
+            return self.count(self.iter_matches(mm, start, end), stop)
+        finally:
+            mm.close()
+
+    def count(self, found, stop):
+        '''count(found, stop): run iter_matches() result found; return the transactions to repair'''
+        with self.metrics.phase('repair'):
+            for _, matches in found:
+                if matches and stop:
+                    break
+        return self.metrics.swapped
+
+class RepairVerifier(OFXRepairer):
+    r'''RepairVerifier(in_file, out_file): check that out_file holds the repair of in_file
+
+    verify() streams the input through iter_repaired(), and checks the
+    output, read side by side in the input's encoding, a transaction at
+    a time, in two ways. First, without the repair: each line of each
+    output transaction must be the input's line, except the lines of the
+    fields the rules name. A field which a 'swap' or 'move' rule names
+    must be unchanged, or have its value exchanged or moved with that
+    of the rule's other field, the part the rule's 'keep' matches
+    staying in place: with the default rules, NAME and MEMO swapped,
+    and any confirmation number kept in the MEMO. A field which a
+    'rewrite' rule names may be anything. PROTECTED_FIELDS must be
+    unchanged, whatever the rules say. Then, the output must be exactly
+    what the repair gives. Memory use is bounded by the largest
+    transaction, as for write_stream(). Returns None if the output
+    passes, or else a description of where it first fails.
+    >>> import io
+    >>> original = b'<OFX>\n<STMTTRN>\n<TRNAMT>-1.00\n<FITID>7\n<NAME>a\n<MEMO>b Confirmation #1\n</STMTTRN>\n</OFX>\n'
+    >>> repaired = b'<OFX>\n<STMTTRN>\n<TRNAMT>-1.00\n<FITID>7\n<NAME>b\n<MEMO>a Confirmation #1\n</STMTTRN>\n</OFX>\n'
+    >>> r = RepairVerifier(io.BytesIO(original), io.BytesIO(repaired)); print(r.verify())
+    None
+    >>> r.metrics.transactions, r.metrics.swapped
+    (1, 1)
+    >>> print(RepairVerifier(io.BytesIO(original), io.BytesIO(repaired.replace(b'1.00', b'10.0'))).verify())
+    line 3, in <TRNAMT> of transaction 1, FITID 7: the input has '<TRNAMT>-1.00', the output '<TRNAMT>-10.0'
+    >>> print(RepairVerifier(io.BytesIO(original), io.BytesIO(repaired.replace(b'<MEMO>a Conf', b'<MEMO>a  Conf'))).verify())
+    line 5, in <NAME> of transaction 1, FITID 7: the input has '<NAME>a', the output '<NAME>b'
+
+    Rules which change an amount fail the first check, though the output
+    is what they give.
+    >>> rules = RuleSet(VANCITY_RULES + [{'action': 'rewrite', 'fields': ['TRNAMT'], 'pattern': '-', 'replace': ''}])
+    >>> print(RepairVerifier(io.BytesIO(original), io.BytesIO(repair_bytes(original, OFXRepairer(None, rules=rules))),
+    ...                      rules=rules).verify())
+    line 3, in <TRNAMT> of transaction 1, FITID 7: the input has '<TRNAMT>-1.00', the output '<TRNAMT>1.00'
+
+    An output left unrepaired passes the first, but fails the second.
+    >>> print(RepairVerifier(io.BytesIO(original), io.BytesIO(original)).verify())
+    line 5, in <NAME> of transaction 1, FITID 7: the repair has '<NAME>b', the output '<NAME>a'
+    >>> print(RepairVerifier(io.BytesIO(original), io.BytesIO(repaired[:-7])).verify())
+    the output ends at line 8, where the repair has '</OFX>'
+    >>> print(RepairVerifier(io.BytesIO(original), io.BytesIO(repaired + b'\n')).verify())
+    the output continues past the end of the repair, at line 9
+    '''
+
+    # Regular expression finding the tag which starts a line
+    RE_LINE_TAG = re.compile(r'\s*<(/?[A-Za-z0-9.]+)>', RE_ASCII)
+    PROTECTED_FIELDS = ['TRNAMT', 'DTPOSTED', 'FITID']  # which no repair may change
+
+    def __init__(self, in_file, out_file, metrics=None, rules=None):
+        OFXRepairer.__init__(self, in_file, metrics=metrics, rules=rules)
+        self.out_file = out_file
+        # The output has the input's headers, so its encoding
+        self.out_text = codecs.lookup(self.codec_name).streamreader(out_file)
+        self.before = None  # the input of the transaction repair_transaction() last repaired
+        # (action, first field, second field, keep pattern) of each rule
+        # which exchanges or moves values, and the fields rewritten
+        self.pairs, self.rewritten = [], set()
+        for rule in self.rules.rules:
+            fields = [field.upper() for field in rule['fields']]
+            if set(fields) & set(self.PROTECTED_FIELDS):
+                continue
+            if rule['action'] == 'rewrite':
+                self.rewritten.update(fields)
+            else:
+                keep = rule.get('keep')
+                self.pairs.append((rule['action'], fields[0], fields[1],
+                                   re.compile(u'(?i)(?:{0})\\Z'.format(keep)) if keep else None))
+
+    def repair_transaction(self, trn):
+        self.before = trn
+        return OFXRepairer.repair_transaction(self, trn)
+
+    def verify(self):
+        '''verify(): None if out_file holds the repair of in_file, or else where it first fails'''
+        actual = self.iter_chunks(self.out_text)
+        buf = u''
+        pos = 0   # buf[:pos] has been matched
+        line = 1  # the line number at buf[pos]
+        for expected in self.iter_repaired(self.in_file):
+            before, self.before = self.before, None
+            # Read the output as far as the repair, and for a transaction
+            # which differs from it, to its end tag, though not much
+            # further if that is missing
+            while len(buf) - pos < len(expected) or (
+                    before is not None and not buf.startswith(expected, pos)
+                    and len(buf) - pos < 2 * len(expected) and not self.RE_STMTTRN_CLOSE.search(buf, pos)):
+                chunk = next(actual, None)
+                if chunk is None:
+                    break
+                # Keep the start of the line at pos, for difference()
+                keep = buf.rfind(u'\n', 0, pos) + 1
+                buf, pos = buf[keep:] + chunk, pos - keep
+            if before is not None:
+                if buf.startswith(expected, pos):
+                    after = expected
+                else:
+                    end = self.RE_STMTTRN_CLOSE.search(buf, pos)
+                    after = buf[pos:end.end()] if end else buf[pos:]
+                problem = self.check_transaction(before, after, line)
+                if problem:
+                    return problem
+            if not buf.startswith(expected, pos):
+                return self.difference(expected, buf, pos, line)
+            line += expected.count(u'\n')
+            pos += len(expected)
+        if len(buf) > pos or next(actual, None) is not None:
+            return 'the output continues past the end of the repair, at line {0}'.format(line)
+        return None
+
+    def difference(self, expected, buf, pos, line):
+        '''difference(expected, buf, pos, line): describe where buf[pos:] first differs from expected'''
+        found = buf[pos:pos + len(expected)]
+        k = len(os.path.commonprefix([expected, found]))
+        line += expected.count(u'\n', 0, k)
+        start = buf.rfind(u'\n', 0, pos + k) + 1
+        end = expected.find(u'\n', k)
+        repair_line = (buf[start:pos + k] + expected[k:end if end >= 0 else len(expected)]).rstrip(u'\r')
+        if k == len(found):
+            return "the output ends at line {0}, where the repair has '{1}'".format(
+                    line, self.escaped(repair_line.strip()))
+        end = buf.find(u'\n', pos + k)
+        output_line = buf[start:end if end >= 0 else len(buf)].rstrip(u'\r')
+        where = ''
+        tag = self.RE_LINE_TAG.match(repair_line)
+        if tag:
+            where += ', in <{0}>'.format(tag.group(1))
+        trn = self.RE_STMTTRN_TAG.match(expected)
+        if trn and not trn.group(1):
+            where += self.transaction_where(expected)
+        return "line {0}{1}: the repair has '{2}', the output '{3}'".format(
+                line, where, self.escaped(repair_line.strip()), self.escaped(output_line.strip()))
+
+    def transaction_where(self, trn):
+        '''transaction_where(trn): which transaction trn, the last repaired, is, for a report'''
+        where = ' of transaction {0}'.format(self.metrics.transactions)
+        fitid = OFXMerger.RE_FITID.search(trn)
+        if fitid:
+            where += ', FITID {0}'.format(fitid.group(1).strip())
+        return where
+
+    def line_field(self, line):
+        '''line_field(line): (the upper-case tag which starts line, or None, and the value after it)'''
+        m = self.RE_LINE_TAG.match(line)
+        return (m.group(1).upper(), line[m.end():]) if m else (None, line)
+
+    def check_transaction(self, before, after, line):
+        '''check_transaction(before, after, line): None if after is an allowed repair of before, or else why not
+
+        before is the input of a transaction, after the output in its
+        place, and line the number of their first line. See verify().
+        '''
+        if before == after:
+            return None
+        lines_in, lines_out = before.split(u'\n'), after.split(u'\n')
+        checked = -1  # a line found exchanged with an earlier one
+        for k, (line_in, line_out) in enumerate(zip(lines_in, lines_out)):
+            if line_in == line_out or k == checked:
+                continue
+            field_in, field_out = self.line_field(line_in), self.line_field(line_out)
+            tag = field_in[0]
+            if tag is not None and tag == field_out[0]:
+                if tag in self.rewritten:
+                    continue
+                checked = self.exchanged(k, field_in, field_out, lines_in, lines_out)
+                if checked is not None:
+                    continue
+            return "line {0}{1}{2}: the input has '{3}', the output '{4}'".format(
+                    line + k, ', in <{0}>'.format(tag) if tag else '', self.transaction_where(before),
+                    self.escaped(line_in.strip()), self.escaped(line_out.strip()))
+        if len(lines_in) != len(lines_out):
+            return "transaction {0} has {1} lines in the input, {2} in the output, from line {3}".format(
+                    self.metrics.transactions, len(lines_in), len(lines_out), line)
+        return None
+
+    def exchanged(self, k, field_in, field_out, lines_in, lines_out):
+        '''exchanged(k, field_in, field_out, lines_in, lines_out): the other line, if line k was swapped or moved as a rule says
+
+        field_in and field_out are the line_field() of line k in the input
+        and the output, which have the same tag. The rule's other line is
+        the next line, or for its second field the previous line, which
+        isn't blank. Its field must be the rule's other field, in the
+        input and the output. Returns its index, or None if no rule allows
+        the change.
+        '''
+        tag = field_in[0]
+        size = min(len(lines_in), len(lines_out))
+        for action, tag0, tag1, keep in self.pairs:
+            if tag == tag0:
+                step, other = 1, tag1
+            elif tag == tag1:
+                step, other = -1, tag0
+            else:
+                continue
+            n = k + step
+            while 0 <= n < size and not lines_in[n].strip():
+                n += step
+            if not 0 <= n < size:
+                continue
+            other_in, other_out = self.line_field(lines_in[n]), self.line_field(lines_out[n])
+            if other_in[0] != other or other_out[0] != other:
+                continue
+            (_, x), (_, y) = (other_in, field_in) if step < 0 else (field_in, other_in)
+            (_, x2), (_, y2) = (other_out, field_out) if step < 0 else (field_out, other_out)
+            if action == 'swap':
+                # y is x2 followed by the part kept, which follows x in y2
+                kept = y[len(x2):] if y.startswith(x2) else None
+            else:
+                # x2 is empty, and y2 is x followed by the part of y kept
+                kept = y2[len(x):] if x2 == u'' and y2.startswith(x) and y.endswith(y2[len(x):]) else None
+            if kept is not None and y2 == x + kept and (kept == u'' or (keep and keep.match(kept))):
+                return n
+        return None
+
+    @staticmethod
+    def escaped(text):
+        r'''escaped(text): text, with characters beyond ASCII as escapes, for a report
+
+        >>> print(RepairVerifier.escaped(u'Caf\xe9'))
+        Caf\xe9
+        '''
+        return text.encode('ascii', 'backslashreplace').decode('ascii')
+
+class AppendRepairer(OFXRepairer):
+    r'''AppendRepairer(in_path, out_path): repair only what was added to the end of an input
+
+    For a statement which is downloaded again with new transactions at
+    its end, like a rolling year to date. tail() records where the
+    repair of in_path into out_path can be taken up again: the byte
+    offsets just after the last </STMTTRN> of the input and of the
+    output, the SHA-256 of the input before its offset, its encoding,
+    and the FITID and DTPOSTED of that last transaction. After a
+    </STMTTRN> no transaction is open, as split_pieces() relies on, so
+    if the input still begins with the same bytes, they still repair
+    into the output's first out_offset bytes. append(tail) checks that,
+    then decodes and repairs only the input after the offset, and writes
+    it over the output after out_offset. Only for encodings in
+    SpliceRepairer.SPLICE_CODECS, where the tags can be found in bytes.
+    Each file is read once: append() leaves the SHA-256 of the whole
+    input, and of the whole output if it checked the output's, in
+    in_sha256 and out_sha256, for the Manifest.
+    >>> import shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> in_path, out_path = os.path.join(p, 'a.ofx'), os.path.join(p, 'a.repaired.ofx')
+    >>> trn = b'<STMTTRN>\n<DTPOSTED>2017010{0}\n<FITID>{0}\n<NAME>a\n<MEMO>b\n</STMTTRN>\n'
+    >>> with open(in_path, 'wb') as f:
+    ...     n = f.write(b'<OFX>\n' + trn.replace(b'{0}', b'1') + b'</OFX>\n')
+    >>> with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
+    ...     OFXRepairer(in_file, out_file).write()
+    >>> r = AppendRepairer(in_path, out_path)
+    >>> tail = r.tail()
+    >>> print(tail['offset'], tail['out_offset'], tail['fitid'], tail['dtposted'])
+    70 70 1 20170101
+
+    A download with a new transaction appended repairs as a whole would.
+    >>> with open(in_path, 'wb') as f:
+    ...     n = f.write(b'<OFX>\n' + trn.replace(b'{0}', b'1') + trn.replace(b'{0}', b'2') + b'</OFX>\n')
+    >>> tail = r.append(tail, Manifest.file_sha256(out_path))
+    >>> print(tail['fitid'], r.metrics.transactions)
+    2 1
+    >>> with open(in_path, 'rb') as in_file, open(out_path, 'rb') as out_file:
+    ...     repair_bytes(in_file.read()) == out_file.read()
+    True
+    >>> tail == r.tail()
+    True
+    >>> (r.in_sha256, r.out_sha256) == (Manifest.file_sha256(in_path), Manifest.file_sha256(out_path))
+    True
+
+    If the input changed before the offset, or the output's SHA-256 is
+    not the one given, append() returns None, and leaves the output alone.
+    >>> r.append(tail, 'the SHA-256 of some other output') is None
+    True
+    >>> with open(in_path, 'wb') as f:
+    ...     n = f.write(b'<OFX>\n' + trn.replace(b'{0}', b'3') + b'</OFX>\n')
+    >>> r.append(tail) is None
+    True
+    >>> shutil.rmtree(p)
+    '''
+
+    # OFXRepairer's regular expressions, for bytes
+    RE_BYTES_OFX_START = bytes_pattern(OFXRepairer.RE_OFX_START)
+    RE_BYTES_OFX_END = bytes_pattern(OFXRepairer.RE_OFX_END)
+    RE_BYTES_CLOSE = bytes_pattern(OFXRepairer.RE_STMTTRN_CLOSE)
+    RE_LAST_START = re.compile(r'(?is).*(<STMTTRN>)', RE_ASCII)
+    WINDOW = 64 * 1024  # bytes searched at a time, backwards, for the last </STMTTRN>
+    HASH_BLOCK = 1024 * 1024  # bytes hashed at a time
+
+    def __init__(self, in_path, out_path, metrics=None, rules=None):
+        OFXRepairer.__init__(self, None, None, metrics, rules)
+        self.path, self.out_path = in_path, out_path
+        self.in_sha256 = self.out_sha256 = None  # of the files after append()
+
+    def last_close(self, data):
+        '''last_close(data): the offset after the body's last </STMTTRN> in bytes data, or None'''
+        i = data.find(b'<')
+        m = self.RE_BYTES_OFX_START.match(data, i) if i >= 0 else None
+        end = m and self.RE_BYTES_OFX_END.search(data, m.end())
+        if not end:
+            return None
+        start, end = m.end(), end.start()
+        window = self.WINDOW
+        while True:
+            lo = max(start, end - window)
+            last = None
+            for last in self.RE_BYTES_CLOSE.finditer(data, lo, end):
+                pass
+            if last is not None:
+                return last.end()
+            if lo == start:
+                return None
+            window *= 4
+
+    def tail_fields(self, text, tail):
+        '''tail_fields(text, tail): set tail's FITID and DTPOSTED from the last transaction of text'''
+        m = self.RE_LAST_START.match(text)
+        trn = text[m.start(1):] if m else text
+        m = OFXMerger.RE_FITID.search(trn)
+        tail['fitid'] = m.group(1).strip() if m else None
+        m = OFXMerger.RE_DTPOSTED.search(trn)
+        tail['dtposted'] = m.group(1) if m else None
+
+    def tail(self):
+        '''tail(): the record of where the repair of in_path into out_path ends, or None
+
+        None if the input's encoding isn't one of SPLICE_CODECS, or if
+        either file has no transactions.
+        '''
+        import hashlib, mmap
+        with open(self.path, 'rb') as in_file:
+            if os.fstat(in_file.fileno()).st_size == 0:
+                return None
+            codec_name = self.codec_name_from_ofx_headers(self.read_ofx_headers(in_file))
+            if codec_name not in SpliceRepairer.SPLICE_CODECS:
+                return None
+            mm = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offset = self.last_close(mm)
+                if offset is None:
+                    return None
+                h = hashlib.sha256()
+                for i in range(0, offset, self.HASH_BLOCK):
+                    h.update(mm[i:min(i + self.HASH_BLOCK, offset)])
+                last = mm[max(0, offset - self.WINDOW):offset].decode(codec_name, 'replace')
+            finally:
+                mm.close()
+        with open(self.out_path, 'rb') as out_file:
+            if os.fstat(out_file.fileno()).st_size == 0:
+                return None
+            mm = mmap.mmap(out_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                out_offset = self.last_close(mm)
+            finally:
+                mm.close()
+        if out_offset is None:
+            return None
+        tail = {'offset': offset, 'out_offset': out_offset, 'prefix_sha256': h.hexdigest(),
+                'codec': codec_name}
+        self.tail_fields(last, tail)
+        return tail
+
+    def hash_prefix(self, f, h, size):
+        '''hash_prefix(f, h, size): update hash h with the next size bytes of binary file f'''
+        for i in range(0, size, self.HASH_BLOCK):
+            h.update(f.read(min(self.HASH_BLOCK, size - i)))
+
+    def append(self, tail, out_sha256=None):
+        '''append(tail, out_sha256): repair what follows tail in in_path onto out_path; return the new tail
+
+        Returns None, having written nothing, if the input no longer
+        begins with the bytes tail recorded, or if out_sha256 is given,
+        and is not the SHA-256 of the output. The number of transactions
+        repaired is in self.metrics.
+        '''
+        import hashlib
+        offset, codec_name = tail['offset'], tail['codec']
+        with open(self.path, 'rb') as in_file:
+            if os.fstat(in_file.fileno()).st_size <= offset:
+                return None
+            h = hashlib.sha256()
+            with self.metrics.phase('decode'):
+                self.hash_prefix(in_file, h, offset)
+            if h.hexdigest() != tail['prefix_sha256']:
+                return None
+            with self.metrics.phase('decode'):
+                data = in_file.read()
+                text = data.decode(codec_name)
+        in_h = h.copy()
+        in_h.update(data)
+        out_h = None
+        if out_sha256 is not None:
+            # Hash the output up to out_offset once, to check the whole
+            # output's hash, and then to extend over what is written there
+            out_h = hashlib.sha256()
+            with self.metrics.phase('decode'):
+                with open(self.out_path, 'rb') as out_file:
+                    self.hash_prefix(out_file, out_h, tail['out_offset'])
+                    old_h = out_h.copy()
+                    old_h.update(out_file.read())
+            if old_h.hexdigest() != out_sha256:
+                return None
+        end = self.RE_OFX_END.search(text)
+        if not end:
+            raise CLIError('Appears to not be OFX: {0}'.format(self.path))
+        body = text[:end.start()]
+        with self.metrics.phase('repair'):
+            repaired = self.repair(body)
+        with self.metrics.phase('encode'):
+            out_data = (repaired + text[end.start():]).encode(codec_name)
+        with self.metrics.phase('write'):
+            with open(self.out_path, 'r+b') as out_file:
+                out_file.seek(tail['out_offset'])
+                out_file.write(out_data)
+                out_file.truncate()
+        self.in_sha256 = in_h.hexdigest()
+        if out_h is not None:
+            out_h.update(out_data)
+            self.out_sha256 = out_h.hexdigest()
+
+        # The new tail is after the last </STMTTRN> among the appended transactions
+        last = None
+        for last in self.RE_STMTTRN_CLOSE.finditer(body):
+            pass
+        if last is None:
+            return tail
+        new_body = body[:last.end()].encode(codec_name)
+        h.update(new_body)
+        out_last = None
+        for out_last in self.RE_STMTTRN_CLOSE.finditer(repaired):
+            pass
+        tail = dict(tail, offset=offset + len(new_body), prefix_sha256=h.hexdigest(),
+                    out_offset=tail['out_offset'] + len(repaired[:out_last.end()].encode(codec_name)))
+        self.tail_fields(body[:last.end()], tail)
+        return tail
+
+def repair_bytes(data, repairer=None):
+    r'''repair_bytes(data): return the repaired copy of OFX file contents data
+
+    For a program which holds OFX files in memory, rather than on disk.
+    data is the bytes of a whole file, headers and all; the headers
+    give the encoding, as for a file. Returns the bytes which
+    OFXRepairer.write() would write. A repairer made with
+    OFXRepairer(None) may be given, to reuse. Raises CLIError if data
+    is not OFX.
+    >>> out = repair_bytes(b'ENCODING:USASCII\nCHARSET:1252\n\n<OFX>\n<STMTTRN>\n'
+    ...                    b'<NAME>payment\n<MEMO>VISA Confirmation #1\n</STMTTRN>\n</OFX>\n')
+    >>> out.splitlines()[5:7] == [b'<NAME>VISA', b'<MEMO>payment Confirmation #1']
+    True
+    >>> repair_bytes(b'<html></html>')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+      ...
+    CLIError: E: Appears to not be OFX: <bytes>
+    '''
+    r = repairer or OFXRepairer(None)
+    codec_name = r.codec_name_from_ofx_headers(r.read_ofx_headers(io.BytesIO(data)))
+    pre, to_repair, post = r.split_input(data.decode(codec_name))
+    if pre is None:
+        raise CLIError('Appears to not be OFX: <bytes>')
+    return (pre + r.repair(to_repair) + post).encode(codec_name)
+
+def repair_many(datas):
+    r'''repair_many(datas): yield the repaired copy of each OFX file contents in datas
+
+    A generator, for a batch of files held in memory. datas may be any
+    iterable of bytes, and is consumed as the results are taken, so a
+    long batch need not all be in memory at once. One repairer serves
+    the whole batch. Each result is as from repair_bytes(). A file
+    which is not OFX raises CLIError, which ends the batch; call
+    repair_bytes() on each file to carry on past one.
+    >>> ofx = b'<OFX>\n<STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>\n'
+    >>> [out == ofx.replace(b'>a', b'>x').replace(b'>b', b'>a').replace(b'>x', b'>b')
+    ...  for out in repair_many([ofx, ofx])]
+    [True, True]
+    '''
+    r = OFXRepairer(None)
+    for data in datas:
+        yield repair_bytes(data, r)
+
+def repair_piece(task):
+    '''repair_piece((text, rules)): repair a piece of OFXRepairer.split_pieces(), for a process pool
+
+    Returns (repaired, transactions, swapped, confirmations), the
+    repaired text and its RepairMetrics counts.
+    '''
+    text, rules = task
+    r = OFXRepairer(None, rules=rules)
+    repaired = r.repair(text)
+    return (repaired, r.metrics.transactions, r.metrics.swapped, r.metrics.confirmations)
+
+def repair_stream(src, dst, repairer=None):
+    r'''repair_stream(src, dst): repair OFX read from binary file src, writing it to dst
+
+    For a program which has OFX arriving on a socket or pipe. Reads
+    src a chunk at a time, and writes each repaired block to dst as it
+    is done, so memory use is bounded by the largest transaction, as
+    with OFXRepairer.write_stream(). src need not be seekable. Neither
+    file is closed. A repairer made with OFXRepairer(None) may be
+    given, to reuse. Raises CLIError if src is not OFX, after writing
+    what came before the problem.
+    >>> import io
+    >>> dst = io.BytesIO()
+    >>> repair_stream(io.BytesIO(b'ENCODING:UTF-8\n\n<OFX>\n<STMTTRN>\n'
+    ...               b'<NAME>caf\xc3\xa9\n<MEMO>VISA\n</STMTTRN>\n</OFX>\n'), dst)
+    >>> dst.getvalue().splitlines()[4:6] == [b'<NAME>VISA', b'<MEMO>caf\xc3\xa9']
+    True
+    >>> dst.closed
+    False
+    '''
+    r = repairer or OFXRepairer(None)
+    head = src.read(r.HEADER_SIZE)
+    codec_name = r.codec_name_from_ofx_headers(r.read_ofx_headers(io.BytesIO(head)))
+    decoder = codecs.getincrementaldecoder(codec_name)()
+    encoder = codecs.getincrementalencoder(codec_name)()
+    def chunks(data):
+        while data:
+            text = decoder.decode(data)
+            if text:
+                yield text
+            data = src.read(r.READ_SIZE)
+        text = decoder.decode(b'', True)
+        if text:
+            yield text
+    for block in r.repair_text_chunks(chunks(head), getattr(src, 'name', repr(src))):
+        if block:
+            dst.write(encoder.encode(block))
+    dst.write(encoder.encode(u'', True))
+
+class ArchiveRepairer(object):
+    r'''ArchiveRepairer(in_file, out_file, ext, rules): repair the OFX files in a zip or tar archive
+
+    Reads the archive in_file, and writes to out_file a copy in which
+    each OFX member is replaced by its repaired copy, named as
+    FilterInOutFiles names repaired files, e.g. a.ofx by a.repaired.ofx.
+    Nothing is extracted to disk. ext, an ARCHIVE_EXTENSIONS key, gives
+    the format. Each OFX member is repaired by repair_stream() into a
+    spool, which stays in memory up to SPOOL_SIZE, since both formats
+    want a member's size or whole data before it is written. Other
+    members of a zip are copied as they are, without recompressing,
+    where the zipfile module has the internals copy_zip_member() needs,
+    and are otherwise decompressed and recompressed through its public
+    interface. A tar is compressed as a whole, so its other members are streamed
+    through, and recompressed. A member which cannot be repaired is
+    copied unchanged, and reported in messages.
+    >>> import io, tarfile, zipfile
+    >>> ofx = b'<OFX>\n<STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>\n'
+    >>> in_file = io.BytesIO()
+    >>> with zipfile.ZipFile(in_file, 'w', zipfile.ZIP_DEFLATED) as z:
+    ...     z.writestr('2017/jan.ofx', ofx); z.writestr('notes.txt', b'notes')
+    ...     z.writestr('bad.qfx', b'<html>')
+    >>> out_file = io.BytesIO()
+    >>> r = ArchiveRepairer(io.BytesIO(in_file.getvalue()), out_file, '.zip'); r.write()
+    >>> r.nrepaired, r.nofx, r.messages  # doctest: +ELLIPSIS
+    (1, 2, ["SORRY: Unable to repair '<archive>:bad.qfx', because exception 'E: Appears to not be OFX: ...' occurred."])
+    >>> z = zipfile.ZipFile(out_file)
+    >>> z.namelist(), z.testzip()
+    (['2017/jan.repaired.ofx', 'notes.txt', 'bad.qfx'], None)
+    >>> z.read('2017/jan.repaired.ofx') == ofx.replace(b'a\n<MEMO>b', b'b\n<MEMO>a'), z.read('notes.txt') == b'notes'
+    (True, True)
+
+    Without RAW_ZIP_COPY, the other members are recompressed, to the same result.
+    >>> r = ArchiveRepairer(io.BytesIO(in_file.getvalue()), io.BytesIO(), '.zip'); r.RAW_ZIP_COPY = False
+    >>> r.write(); z2 = zipfile.ZipFile(r.out_file)
+    >>> z2.namelist() == z.namelist(), z2.testzip(), z2.read('notes.txt') == b'notes'
+    (True, None, True)
+
+    >>> in_file = io.BytesIO()
+    >>> with tarfile.open(fileobj=in_file, mode='w:gz') as t:
+    ...     info = tarfile.TarInfo('jan.ofx'); info.size = len(ofx); t.addfile(info, io.BytesIO(ofx))
+    >>> out_file = io.BytesIO()
+    >>> r = ArchiveRepairer(io.BytesIO(in_file.getvalue()), out_file, '.tar.gz'); r.write()
+    >>> t = tarfile.open(fileobj=io.BytesIO(out_file.getvalue()), mode='r:gz')
+    >>> t.getnames(), t.extractfile('jan.repaired.ofx').read() == ofx.replace(b'a\n<MEMO>b', b'b\n<MEMO>a')
+    (['jan.repaired.ofx'], True)
+    '''
+
+    SPOOL_SIZE = 16 * 1024 * 1024  # bytes of a repaired member held in memory
+    COPY_SIZE = 1024 * 1024  # bytes per read when copying a zip member
+    RAW_ZIP_COPY = True  # copy other zip members without recompressing, where zipfile allows
+
+    def __init__(self, in_file, out_file, ext, rules=None):
+        self.in_file = in_file
+        self.out_file = out_file
+        self.format = ARCHIVE_EXTENSIONS[ext.lower()]
+        self.name = getattr(in_file, 'name', '<archive>')
+        self.repairer = OFXRepairer(None, rules=rules)
+        self.nofx = self.nrepaired = 0
+        self.messages = []
+        self.out_names = FilterInOutFiles(REPAIRED_EXT)
+
+    def write(self):
+        '''write(): write the repaired archive to out_file'''
+        if self.format == 'zip':
+            self.write_zip()
+        else:
+            self.write_tar()
+
+    def repair_member(self, fh, name):
+        '''repair_member(fh, name): return a spool of the repaired member, or None if it fails'''
+        import tempfile
+        self.nofx += 1
+        spool = tempfile.SpooledTemporaryFile(self.SPOOL_SIZE)
+        try:
+            repair_stream(fh, spool, self.repairer)
+        except Exception as e:
+            spool.close()
+            self.messages.append(sorry_message('{0}:{1}'.format(self.name, name), e))
+            return None
+        self.nrepaired += 1
+        spool.seek(0)
+        return spool
+
+    def write_zip(self):
+        import zipfile
+        with zipfile.ZipFile(self.in_file) as zin:
+            with zipfile.ZipFile(self.out_file, 'w') as zout:
+                zout.comment = zin.comment
+                for info in zin.infolist():
+                    spool = None
+                    if is_ofx_path(info.filename):
+                        with zin.open(info) as fh:
+                            spool = self.repair_member(fh, info.filename)
+                    if spool is None:
+                        self.copy_zip_member(zin, zout, info)
+                        continue
+                    out_info = self.zip_member_info(info, self.out_names.generate_out_path(info.filename))
+                    with spool:
+                        spool.seek(0, os.SEEK_END)
+                        size = spool.tell()
+                        spool.seek(0)
+                        self.write_zip_member(zout, out_info, spool, size)
+
+    @staticmethod
+    def zip_member_info(info, filename):
+        '''zip_member_info(info, filename): a new ZipInfo for filename, with member info's date and attributes'''
+        import zipfile
+        out_info = zipfile.ZipInfo(filename, info.date_time)
+        out_info.compress_type = info.compress_type
+        out_info.external_attr = info.external_attr
+        out_info.comment = info.comment
+        return out_info
+
+    def write_zip_member(self, zout, out_info, fh, size):
+        '''write_zip_member(zout, out_info, fh, size): write size bytes from binary file fh to zout, as out_info'''
+        import shutil
+        import zipfile
+        if sys.version_info >= (3, 6):
+            with zout.open(out_info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as out:
+                shutil.copyfileobj(fh, out, self.COPY_SIZE)
+        else:
+            zout.writestr(out_info, fh.read())
+
+    def copy_zip_member(self, zin, zout, info):
+        '''copy_zip_member(zin, zout, info): copy a member from zin to zout, unchanged
+
+        Copies the compressed bytes with copy_zip_member_raw() where
+        can_copy_raw() allows, or else through zipfile's public
+        interface, decompressing and recompressing them.
+        '''
+        if self.RAW_ZIP_COPY and self.can_copy_raw(zin, zout):
+            self.copy_zip_member_raw(zin, zout, info)
+            return
+        with zin.open(info) as fh:
+            self.write_zip_member(zout, self.zip_member_info(info, info.filename), fh, info.file_size)
+
+    @staticmethod
+    def can_copy_raw(zin, zout):
+        '''can_copy_raw(zin, zout): True if the ZipFiles have the internals copy_zip_member_raw() uses
+
+        Those of CPython's zipfile from 2.7 on. Another version, without
+        them, gets the public interface instead of a corrupt archive.
+        '''
+        import zipfile
+        return (callable(getattr(zipfile.ZipInfo, 'FileHeader', None))
+                and hasattr(getattr(zin, 'fp', None), 'seek') and hasattr(getattr(zout, 'fp', None), 'tell')
+                and isinstance(getattr(zout, 'filelist', None), list)
+                and isinstance(getattr(zout, 'NameToInfo', None), dict)
+                and isinstance(getattr(zout, 'start_dir', None), int)
+                and isinstance(getattr(zout, '_didModify', None), bool)
+                and not getattr(zout, '_writing', False))
+
+    def copy_zip_member_raw(self, zin, zout, info):
+        '''copy_zip_member_raw(zin, zout, info): copy a member's compressed bytes from zin to zout
+
+        The zipfile module has no way to do this, so this writes the
+        local header itself, and tells zout about the member as
+        ZipFile.write() does. Check can_copy_raw() first.
+        '''
+        import struct
+        zin.fp.seek(info.header_offset)
+        header = zin.fp.read(30)
+        name_size, extra_size = struct.unpack('<HH', header[26:30])
+        zin.fp.seek(info.header_offset + 30 + name_size + extra_size)
+        out_info = copy.copy(info)
+        out_info.flag_bits &= ~0x08  # the sizes go in the header, not a data descriptor after
+        out_info.header_offset = zout.fp.tell()
+        zout.fp.write(out_info.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            data = zin.fp.read(min(remaining, self.COPY_SIZE))
+            if not data:
+                raise CLIError('Archive member is truncated: {0}:{1}'.format(self.name, info.filename))
+            zout.fp.write(data)
+            remaining -= len(data)
+        zout.filelist.append(out_info)
+        zout.NameToInfo[out_info.filename] = out_info
+        zout.start_dir = zout.fp.tell()
+        zout._didModify = True
+
+    def write_tar(self):
+        import tarfile
+        mode = 'w:' + self.format if self.format != 'tar' else 'w'
+        with tarfile.open(fileobj=self.in_file, mode='r:*') as tin:
+            with tarfile.open(fileobj=self.out_file, mode=mode) as tout:
+                for info in tin:
+                    if not info.isfile():
+                        tout.addfile(info)
+                        continue
+                    spool = None
+                    if is_ofx_path(info.name):
+                        spool = self.repair_member(tin.extractfile(info), info.name)
+                    if spool is None:
+                        tout.addfile(info, tin.extractfile(info))
+                        continue
+                    with spool:
+                        out_info = copy.copy(info)
+                        out_info.name = self.out_names.generate_out_path(info.name)
+                        spool.seek(0, os.SEEK_END)
+                        out_info.size = spool.tell()
+                        spool.seek(0)
+                        tout.addfile(out_info, spool)
+
+class OFXMerger(object):
+    r'''OFXMerger(in_files): merge the transactions of OFX files, dropping duplicates
+
+    For overlapping downloads of one account, e.g. the repaired files
+    of successive months. in_files are binary files, opened and closed
+    by the caller. write(out_file) writes one OFX file with the
+    <STMTTRN> blocks of all of them, in DTPOSTED order, by a k-way merge
+    (heapq.merge) of the files, read a chunk at a time. Each file's
+    transactions must already be in DTPOSTED order, oldest first, as
+    they are downloaded. A transaction whose FITID was already written
+    is dropped, so memory grows with the number of distinct FITIDs,
+    not the size of the files. Blocks keep their text and indentation.
+
+    The envelope, everything before the first and after the last
+    <STMTTRN>, comes from the file with the latest <DTEND>, which has
+    the latest balances, with its <DTSTART> set to the earliest of all.
+    The output is in the envelope's encoding, so each file must be in
+    that, in ASCII, or the envelope in UTF-8; otherwise write() raises
+    CLIError before writing anything.
+    >>> import io
+    >>> def ofx(start, end, trns):
+    ...     return io.BytesIO((u'ENCODING:USASCII\n\n<OFX><BANKTRANLIST>\n<DTSTART>{0}\n<DTEND>{1}\n'.format(start, end)
+    ...         + u''.join(u' <STMTTRN>\n  <DTPOSTED>{0}\n  <FITID>{1}\n </STMTTRN>\n'.format(*t) for t in trns)
+    ...         + u'</BANKTRANLIST><LEDGERBAL>{0}</OFX>\n'.format(end)).encode('ascii'))
+    >>> m = OFXMerger([ofx('20170101', '20170131', [('20170105', 'a'), ('20170120', 'b')]),
+    ...                ofx('20170115', '20170215', [('20170120', 'b'), ('20170121', 'c'), ('20170201', 'd')])])
+    >>> out_file = io.BytesIO(); m.write(out_file)
+    >>> print(out_file.getvalue().decode('ascii'))
+    ENCODING:USASCII
+    <BLANKLINE>
+    <OFX><BANKTRANLIST>
+    <DTSTART>20170101
+    <DTEND>20170215
+     <STMTTRN>
+      <DTPOSTED>20170105
+      <FITID>a
+     </STMTTRN>
+     <STMTTRN>
+      <DTPOSTED>20170120
+      <FITID>b
+     </STMTTRN>
+     <STMTTRN>
+      <DTPOSTED>20170121
+      <FITID>c
+     </STMTTRN>
+     <STMTTRN>
+      <DTPOSTED>20170201
+      <FITID>d
+     </STMTTRN>
+    </BANKTRANLIST><LEDGERBAL>20170215</OFX>
+    <BLANKLINE>
+    >>> m.ntransactions, m.nduplicates
+    (4, 1)
+
+    >>> OFXMerger([ofx('20170101', '20170131', [('20170120', 'b'), ('20170105', 'a')])]).write(io.BytesIO())  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+      ...
+    CLIError: E: Transactions are not in DTPOSTED order, at FITID 'a': <_io.BytesIO object at ...>
+
+    >>> utf8 = io.BytesIO(ofx('20170101', '20170131', [('20170105', 'a')]).getvalue().replace(b'USASCII', b'UTF-8'))
+    >>> out_file = io.BytesIO()
+    >>> OFXMerger([utf8, ofx('20170115', '20170215', [('20170201', 'd')])]).write(out_file)  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+      ...
+    CLIError: E: Unable to merge '<_io.BytesIO object at ...>' (utf-8) into the encoding of '<_io.BytesIO object at ...>' (cp1252). Convert them to one encoding first.
+    >>> out_file.getvalue() == b''
+    True
+    '''
+
+    # A transaction block runs from the indentation of its <STMTTRN> to
+    # the end of the line of its </STMTTRN>
+    RE_BLOCK_START = re.compile(r'(?i)[ \t]*<STMTTRN>', RE_ASCII)
+    RE_BLOCK_END = re.compile(r'(?i)</STMTTRN>[ \t]*(?:\r?\n)?', RE_ASCII)
+    RE_DTPOSTED = re.compile(r'(?i)<DTPOSTED>\s*(\d*)', RE_ASCII)
+    RE_FITID = re.compile(r'(?i)<FITID>([^<\r\n]*)', RE_ASCII)
+    RE_DTSTART = re.compile(r'(?i)(<DTSTART>\s*)([^<\s]*)', RE_ASCII)
+    RE_DTEND = re.compile(r'(?i)(<DTEND>\s*)([^<\s]*)', RE_ASCII)
+
+    def __init__(self, in_files):
+        self.repairers = [OFXRepairer(in_file) for in_file in in_files]
+        self.names = [getattr(in_file, 'name', repr(in_file)) for in_file in in_files]
+        self.pres = [None] * len(in_files)
+        self.posts = [None] * len(in_files)
+        self.ntransactions = self.nduplicates = 0
+
+    @staticmethod
+    def date_key(dt):
+        '''date_key(dt): an OFX date's digits, as a string which sorts in time order'''
+        return dt[:14].ljust(14, '0')
+
+    def iter_blocks(self, i):
+        '''iter_blocks(i): yield (date key, i, n, FITID, block) per transaction of file i
+
+        Sets self.pres[i] before the first is yielded, and self.posts[i]
+        after the last.
+        '''
+        r = self.repairers[i]
+        chunks = r.iter_chunks(r.in_file)
+        buf = u''
+        pos = 0  # where the next block starts in buf
+        eof = blocks_done = False
+        last = None
+        n = 0
+        while not eof:
+            chunk = next(chunks, None)
+            eof = chunk is None
+            buf = buf[pos:] + (chunk or u'')
+            pos = 0
+            while not blocks_done:
+                start = self.RE_BLOCK_START.search(buf, pos)
+                if self.pres[i] is None:
+                    if start is None:
+                        break
+                    self.pres[i], pos = buf[:start.start()], start.start()
+                    continue
+                if start is not None and buf[pos:start.start()].strip():
+                    blocks_done = True  # what follows the last block is the envelope
+                    break
+                end = self.RE_BLOCK_END.search(buf, pos)
+                if start is None or end is None or (end.end() == len(buf) and not eof):
+                    break
+                block, pos = buf[pos:end.end()], end.end()
+                m = self.RE_DTPOSTED.search(block)
+                key = self.date_key(m.group(1) if m else u'')
+                m = self.RE_FITID.search(block)
+                fitid = m.group(1).strip() if m else None
+                if last is not None and key < last:
+                    raise CLIError("Transactions are not in DTPOSTED order, at FITID '{0}': {1}".format(
+                            fitid, self.names[i]))
+                last = key
+                n += 1
+                yield (key, i, n, fitid, block)
+        buf = buf[pos:]
+        if self.pres[i] is None:
+            self.pres[i], buf = buf, u''  # no transactions
+        self.posts[i] = buf
+
+    def write(self, out_file):
+        '''write(out_file): write the merged file to binary file out_file'''
+        import heapq
+        gens = [self.iter_blocks(i) for i in range(len(self.repairers))]
+        # Take each file's first block, which reads its envelope
+        heads = [list(itertools.islice(gen, 1)) for gen in gens]
+        merged = heapq.merge(*[itertools.chain(head, gen) for head, gen in zip(heads, gens)])
+
+        def dates(pattern):
+            # (date key, date) of each file's envelope, or None
+            return [(self.date_key(m.group(2)), m.group(2)) if m else None
+                    for m in (pattern.search(pre) for pre in self.pres)]
+        ends = dates(self.RE_DTEND)
+        env = max(range(len(ends)), key=lambda i: (ends[i] or (u'',), i))
+        starts = [start for start in dates(self.RE_DTSTART) if start]
+        pre = self.pres[env]
+        if starts:
+            pre = self.RE_DTSTART.sub(lambda m: m.group(1) + min(starts)[1], pre, 1)
+
+        codec_name = self.repairers[env].codec_name
+        if codec_name != 'utf-8':
+            others = [u"'{0}' ({1})".format(self.names[i], r.codec_name) for i, r in enumerate(self.repairers)
+                      if r.codec_name not in (codec_name, 'ascii')]
+            if others:
+                raise CLIError("Unable to merge {0} into the encoding of '{1}' ({2}). Convert them to one "
+                               "encoding first.".format(', '.join(others), self.names[env], codec_name))
+
+        seen = set()
+        encode = codecs.lookup(codec_name).encode
+        out_file.write(encode(pre)[0])
+        for key, i, n, fitid, block in merged:
+            if fitid:
+                if fitid in seen:
+                    self.nduplicates += 1
+                    continue
+                seen.add(fitid)
+            self.ntransactions += 1
+            out_file.write(encode(block)[0])
+        out_file.write(encode(self.posts[env])[0])
+
+def walk_files(top):
+    '''walk_files(top): yield the path of each file under directory top
+
+    A generator, so files are yielded as they are found, rather than
+    after the whole tree is listed. Uses os.scandir (or the scandir
+    backport on Python 2) if available, since it gets the type of each
+    entry along with its name, without an extra stat() call per entry.
+    Directories which cannot be read are skipped, as os.walk() does.
+    '''
+    if scandir is None:
+        for dirpath, _, filenames in os.walk(top):
+            for filename in filenames:
+                yield os.path.join(dirpath, filename)
+        return
+
+    try:
+        entries = scandir(top)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            for path in walk_files(entry.path):
+                yield path
+        elif entry.is_file():
+            yield entry.path
+
+def iter_input_paths(paths, recurse=False, include=None, exclude=None):
+    r'''iter_input_paths(paths, ...): yield the paths of files to repair
+
+    Paths to files are yielded as given. With recurse, a path to a
+    directory yields the OFX files anywhere beneath it, except for the
+    '.repaired' files which earlier runs wrote. include and exclude are
+    regular expressions which each yielded path must, or must not,
+    match. exclude is given preference over include.
+    >>> import os, os.path, tempfile
+    >>> p = tempfile.mkdtemp(); os.mkdir(os.path.join(p, 'sub'))
+    >>> for name in ['a.ofx', 'notes.txt', os.path.join('sub', 'b.QFX'),
+    ...              os.path.join('sub', 'b.repaired.QFX'), os.path.join('sub', 'c.ofx')]:
+    ...     open(os.path.join(p, name), 'w').close()
+    >>> def found(*args, **kwargs):
+    ...     return sorted(os.path.relpath(f, p) for f in iter_input_paths(*args, **kwargs))
+    >>> found([p]) == ['.']
+    True
+    >>> found([p], recurse=True) == ['a.ofx', os.path.join('sub', 'b.QFX'), os.path.join('sub', 'c.ofx')]
+    True
+    >>> found([p], recurse=True, include=r'sub', exclude=r'c\.ofx$') == [os.path.join('sub', 'b.QFX')]
+    True
+    >>> import shutil; shutil.rmtree(p)
+    '''
+    include = re.compile(include) if include else None
+    exclude = re.compile(exclude) if exclude else None
+    for path in paths:
+        if recurse and os.path.isdir(path):
+            found = (f for f in walk_files(path) if is_ofx_path(f))
+        else:
+            found = [path]
+        for f in found:
+            if exclude is not None and exclude.search(f):
+                continue
+            if include is not None and not include.search(f):
+                continue
+            yield f
+
+def is_ofx_path(path):
+    '''is_ofx_path(path): True if path names an OFX file to repair
+
+    >>> is_ofx_path('foo.ofx'), is_ofx_path('foo.QFX'), is_ofx_path('foo.dat')
+    (True, True, False)
+
+    Files with the '.repaired' subextension are output of earlier runs.
+    >>> is_ofx_path('foo.repaired.ofx')
+    False
+    '''
+    (root, ext) = os.path.splitext(path)
+    return ext.lower() in OFX_EXTENSIONS and not root.endswith(REPAIRED_EXT)
+
+class Inotify(object):
+    '''Inotify(libc): watch folders with Linux inotify, called through ctypes
+
+    Use Inotify.open(), which returns None where inotify is unavailable.
+    '''
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT = 'iIII'  # struct format of the wd, mask, cookie, and length of the name which follows
+
+    @classmethod
+    def open(cls):
+        '''open(): return a new Inotify, or None if inotify is unavailable'''
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.inotify_init1
+        except (ImportError, OSError, AttributeError):
+            return None
+        return cls(libc)
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(self.errno(), 'inotify_init1 failed')
+        self.dirs = {}  # watch descriptor: folder path
+
+    def errno(self):
+        import ctypes
+        return ctypes.get_errno()
+
+    def add(self, path):
+        '''add(path): watch folder path'''
+        wd = self.libc.inotify_add_watch(self.fd, getattr(os, 'fsencode', str)(path), self.MASK)
+        if wd < 0:
+            raise OSError(self.errno(), 'inotify_add_watch failed', path)
+        self.dirs[wd] = path
+
+    def read(self, timeout):
+        '''read(timeout): return (path, is_dir) for each event, waiting up to timeout seconds'''
+        import select
+        import struct
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, _, length = struct.unpack_from(self.EVENT, data, i)
+            i += struct.calcsize(self.EVENT)
+            name = data[i:i + length].rstrip(b'\0')
+            i += length
+            if wd in self.dirs and name:
+                name = getattr(os, 'fsdecode', str)(name)
+                events.append((os.path.join(self.dirs[wd], name), bool(mask & self.IN_ISDIR)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher(object):
+    r'''Watcher(top): yield OFX files in folder top as they arrive
+
+    Iterating a Watcher never ends. It first yields the OFX files already
+    in top which have no repaired output beside them. Then it waits, and
+    yields each OFX file which is added or changed, once it has gone
+    unchanged for settle seconds, so a download is not repaired while it
+    is still being written. It waits with inotify where that is
+    available, and otherwise scans top every poll seconds. With recurse,
+    it also watches the folders under top.
+
+    queue_depth is the number of files waiting to settle, and arrived is
+    when the last file yielded was first seen.
+    >>> import os, shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> for name in ('done.ofx', 'done.repaired.ofx', 'new.ofx'):
+    ...     with open(os.path.join(p, name), 'wb') as f: n = f.write(b'<OFX>')
+    >>> w = iter(Watcher(p, settle=0.1, poll=0.05))
+    >>> os.path.basename(next(w))
+    'new.ofx'
+    >>> with open(os.path.join(p, 'later.qfx'), 'wb') as f: n = f.write(b'<OFX>')
+    >>> os.path.basename(next(w))
+    'later.qfx'
+
+    Without inotify, the folder is polled.
+    >>> w = Watcher(p, settle=0.1, poll=0.05); w.inotify = None; w = iter(w)
+    >>> with open(os.path.join(p, 'polled.ofx'), 'wb') as f: n = f.write(b'<OFX>')
+    >>> sorted(os.path.basename(next(w)) for i in range(3))
+    ['later.qfx', 'new.ofx', 'polled.ofx']
+    >>> shutil.rmtree(p)
+    '''
+
+    SETTLE = 2.0  # seconds a file must go unchanged before it is yielded
+    POLL = 1.0    # seconds between scans, without inotify
+
+    def __init__(self, top, recurse=False, settle=None, poll=None):
+        self.top = top
+        self.recurse = recurse
+        self.settle = self.SETTLE if settle is None else settle
+        self.poll = self.POLL if poll is None else poll
+        self.pending = collections.OrderedDict()  # path: [arrived, changed, signature]
+        self.known = {}  # path: signature, of the files seen and settled
+        self.arrived = None
+        self.inotify = Inotify.open()
+
+    @property
+    def queue_depth(self):
+        return len(self.pending)
+
+    @staticmethod
+    def signature(path):
+        '''signature(path): the size and mtime of path, or None if it is gone'''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime)
+
+    def folders(self):
+        '''folders(): yield top, and with recurse, the folders under it'''
+        yield self.top
+        if self.recurse:
+            for dirpath, dirnames, _ in os.walk(self.top):
+                for dirname in dirnames:
+                    yield os.path.join(dirpath, dirname)
+
+    def scan(self):
+        '''scan(): yield the path of each OFX file in the watched folders'''
+        if self.recurse:
+            found = walk_files(self.top)
+        else:
+            found = (os.path.join(self.top, name) for name in os.listdir(self.top))
+        for path in found:
+            if is_ofx_path(path) and os.path.isfile(path):
+                yield path
+
+    def touch(self, path, now):
+        '''touch(path, now): note that path was added or changed at time now'''
+        if path in self.pending:
+            self.pending[path][1:] = [now, self.signature(path)]
+        else:
+            self.pending[path] = [now, now, self.signature(path)]
+
+    def __iter__(self):
+        if self.inotify is not None:
+            for folder in self.folders():
+                self.inotify.add(folder)
+        now = time.time()
+        out = FilterInOutFiles(REPAIRED_EXT)
+        for path in self.scan():
+            if os.path.exists(out.generate_out_path(path)):
+                self.known[path] = self.signature(path)
+            else:
+                self.touch(path, now)
+        while True:
+            for path in self.settled(time.time()):
+                yield path
+            if self.pending:
+                timeout = min(changed for _, changed, _ in self.pending.values()) \
+                            + self.settle - time.time()
+            else:
+                timeout = self.poll if self.inotify is None else None
+            self.wait(max(timeout, 0) if timeout is not None else None)
+
+    def settled(self, now):
+        '''settled(now): remove and return the pending paths which have settled'''
+        ready = []
+        for path, (arrived, changed, signature) in list(self.pending.items()):
+            if now - changed < self.settle:
+                continue
+            current = self.signature(path)
+            if current is None:
+                del self.pending[path]  # removed, or renamed, before it settled
+            elif current != signature:
+                self.pending[path][1:] = [now, current]
+            else:
+                del self.pending[path]
+                self.known[path] = current
+                ready.append((arrived, path))
+        for arrived, path in ready:
+            self.arrived = arrived
+            yield path
+
+    def wait(self, timeout):
+        '''wait(timeout): wait for files to change, up to timeout seconds'''
+        if self.inotify is not None:
+            for path, is_dir in self.inotify.read(timeout):
+                now = time.time()
+                if is_dir and self.recurse:
+                    self.inotify.add(path)
+                    for sub_path in walk_files(path):
+                        if is_ofx_path(sub_path):
+                            self.touch(sub_path, now)
+                elif not is_dir and is_ofx_path(path):
+                    self.touch(path, now)
+            return
+        time.sleep(timeout)
+        now = time.time()
+        for path in self.scan():
+            if path not in self.pending and self.signature(path) != self.known.get(path):
+                self.touch(path, now)
+
+class ServiceMetrics(object):
+    r'''ServiceMetrics(): counts and latencies of a RepairServer's requests
+
+    Shared by the server's request threads, so every update takes a lock.
+    snapshot() gives an ordered dict for the /metrics endpoint: request
+    counts by status, bytes in and out, throughput since the start, and
+    latency percentiles over the last WINDOW requests.
+    >>> m = ServiceMetrics()
+    >>> for ms in range(1, 101):
+    ...     m.record(200, 1000, 1000, ms / 1000.0)
+    >>> m.record(503, 0, 0, 0.0)
+    >>> s = m.snapshot()
+    >>> s['requests'], s['statuses'], s['bytes_in']
+    (101, {'200': 100, '503': 1}, 100000)
+    >>> [s['latency_ms'][p] for p in ('p50', 'p90', 'p99', 'max')]
+    [50.0, 90.0, 99.0, 100.0]
+    '''
+
+    WINDOW = 1000  # recent requests kept for the latency percentiles
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = self.in_flight = self.bytes_in = self.bytes_out = 0
+        self.statuses = {}
+        self.latencies = collections.deque(maxlen=self.WINDOW)
+
+    def record(self, status, nin, nout, seconds):
+        '''record(status, nin, nout, seconds): count one finished request'''
+        with self.lock:
+            self.requests += 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.bytes_in += nin
+            self.bytes_out += nout
+            if status != 503:
+                # A rejection takes no time, and would flatter the latencies
+                self.latencies.append(seconds)
+
+    @staticmethod
+    def percentile(ordered, p):
+        '''percentile(ordered, p): the nearest-rank p'th percentile of a sorted list'''
+        return ordered[max(int(-(-p * len(ordered) // 100)) - 1, 0)]
+
+    def snapshot(self):
+        '''snapshot(): the metrics, as an ordered dict ready for JSON'''
+        with self.lock:
+            elapsed = max(time.time() - self.start, 1e-6)
+            ordered = sorted(self.latencies)
+            latency = collections.OrderedDict()
+            for p in self.PERCENTILES:
+                latency['p{0}'.format(p)] = round(self.percentile(ordered, p) * 1000, 3) if ordered else None
+            latency['max'] = round(ordered[-1] * 1000, 3) if ordered else None
+            return collections.OrderedDict([
+                ('uptime_seconds', round(elapsed, 3)),
+                ('requests', self.requests),
+                ('in_flight', self.in_flight),
+                ('statuses', dict(self.statuses)),
+                ('bytes_in', self.bytes_in),
+                ('bytes_out', self.bytes_out),
+                ('requests_per_second', round(self.requests / elapsed, 3)),
+                ('mb_per_second', round(self.bytes_in / 1e6 / elapsed, 3)),
+                ('latency_ms', latency)])
+
+SERVE_MAX_BYTES = 64 * 1024 * 1024  # largest request body --serve accepts
+SERVE_QUEUE = 8  # requests --serve accepts beyond those its pool is repairing
+RepairHandler = RepairServer = None  # defined by repair_server_class(), for --serve
+
+def repair_server_class():
+    r'''repair_server_class(): the class RepairServer, defining it at the first call
+
+    The HTTP server modules take longer to import than the rest of the
+    program, so they are imported, and RepairHandler and RepairServer
+    defined on them, only when a server is wanted.
+    >>> import json, threading
+    >>> try:
+    ...     from http.client import HTTPConnection
+    ... except ImportError:
+    ...     from httplib import HTTPConnection
+    >>> server = repair_server_class()(('127.0.0.1', 0), jobs=1, max_bytes=1000)
+    >>> thread = threading.Thread(target=server.serve_forever); thread.start()
+    >>> c = HTTPConnection('127.0.0.1', server.server_address[1])
+    >>> c.request('POST', '/', b'<OFX>\n<STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>\n')
+    >>> rsp = c.getresponse(); rsp.status, rsp.read() == b'<OFX>\n<STMTTRN>\n<NAME>b\n<MEMO>a\n</STMTTRN>\n</OFX>\n'
+    (200, True)
+
+    The connection is kept alive for the next request.
+    >>> c.request('POST', '/', b'no OFX here')
+    >>> rsp = c.getresponse(); rsp.status, rsp.read() == b'E: Appears to not be OFX: <bytes>\n'
+    (400, True)
+    >>> c.request('POST', '/', b'x' * 1001)
+    >>> rsp = c.getresponse(); rsp.status, rsp.getheader('Connection')
+    (413, 'close')
+    >>> c.close()
+
+    >>> server.slots = threading.BoundedSemaphore(1); server.slots.acquire()
+    True
+    >>> c = HTTPConnection('127.0.0.1', server.server_address[1])
+    >>> c.request('POST', '/', b'<OFX></OFX>')
+    >>> rsp = c.getresponse(); rsp.status, rsp.getheader('Retry-After')
+    (503, '1')
+    >>> c.close()
+
+    A request is recorded after its response is sent, so wait for the last.
+    >>> for i in range(100):
+    ...     c = HTTPConnection('127.0.0.1', server.server_address[1])
+    ...     c.request('GET', '/metrics')
+    ...     m = json.loads(c.getresponse().read().decode('utf-8')); c.close()
+    ...     if m['requests'] == 4:
+    ...         break
+    ...     time.sleep(0.05)
+    >>> m['requests'], sorted(m['statuses'].items()) == [('200', 1), ('400', 1), ('413', 1), ('503', 1)]
+    (4, True)
+    >>> server.shutdown(); server.server_close(); thread.join()
+    '''
+    global RepairHandler, RepairServer
+    if RepairServer is not None:
+        return RepairServer
+    import json
+    import threading
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+        from SocketServer import ThreadingMixIn
+
+    class RepairHandler(BaseHTTPRequestHandler):
+        '''RepairHandler: the requests of a RepairServer
+
+        POST any path with an OFX file as the body, and the response is the
+        repaired file. GET /metrics for the server's ServiceMetrics, as JSON.
+        Connections are kept alive, HTTP/1.1 style, so every request needs
+        a Content-Length. A body over the server's max_bytes gets 413, and
+        a request which finds the server's queue full gets 503; neither
+        body is read, so the connection is closed after the response.
+        '''
+        protocol_version = 'HTTP/1.1'
+        server_version = 'vanswap_ofx/{0}'.format(__version__)
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.respond(404, b'Not found. POST OFX to repair it, or GET /metrics.\n')
+                return
+            body = json.dumps(self.server.metrics.snapshot(), indent=1) + '\n'
+            self.respond(200, body.encode('utf-8'), 'application/json')
+
+        def do_POST(self):
+            start = time.time()
+            nin = nout = 0
+            length = self.headers.get('Content-Length')
+            if length is None or not length.isdigit():
+                self.close_connection = True
+                status = self.respond(411, b'A Content-Length is required.\n')
+            elif int(length) > self.server.max_bytes:
+                self.close_connection = True
+                status = self.respond(413, 'Bodies are limited to {0} bytes.\n'.format(
+                        self.server.max_bytes).encode('ascii'))
+            elif not self.server.slots.acquire(False):
+                # Backpressure: the pool and its queue are full, so the client should retry
+                self.close_connection = True
+                status = self.respond(503, b'Busy, try again.\n', headers=[('Retry-After', '1')])
+            else:
+                try:
+                    with self.server.metrics.lock:
+                        self.server.metrics.in_flight += 1
+                    data = self.rfile.read(int(length))
+                    nin = len(data)
+                    try:
+                        repaired = self.server.repair(data)
+                    except Exception as e:
+                        status = self.respond(400, '{0}\n'.format(e).encode('utf-8', 'replace'))
+                    else:
+                        nout = len(repaired)
+                        status = self.respond(200, repaired, 'application/x-ofx')
+                finally:
+                    with self.server.metrics.lock:
+                        self.server.metrics.in_flight -= 1
+                    self.server.slots.release()
+            self.server.metrics.record(status, nin, nout, time.time() - start)
+
+        def respond(self, status, body, content_type='text/plain; charset=utf-8', headers=()):
+            '''respond(status, body, ...): send a whole response; return status'''
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(body)
+            return status
+
+        def log_message(self, format, *args):
+            if self.server.verbose > 0:
+                BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    class RepairServer(ThreadingMixIn, HTTPServer):
+        r'''RepairServer(address, jobs, max_bytes, queue): repair OFX sent over HTTP
+
+        Each connection gets a thread, but the repairs are done by a pool of
+        jobs processes, with repair_bytes(). At most jobs + queue requests
+        are accepted at once; the rest are turned away with 503, rather than
+        piling up. See RepairHandler. Call server_close() to stop the pool.
+        '''
+
+        daemon_threads = True
+        MAX_BYTES = SERVE_MAX_BYTES
+        QUEUE = SERVE_QUEUE
+
+        def __init__(self, address, jobs=1, max_bytes=None, queue=None, verbose=0):
+            import multiprocessing
+            HTTPServer.__init__(self, address, RepairHandler)
+            self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+            self.verbose = verbose
+            # Ctrl-C stops the server, which then stops the pool; the workers ignore it
+            self.pool = multiprocessing.Pool(jobs or None, signal.signal, (signal.SIGINT, signal.SIG_IGN))
+            jobs = jobs or multiprocessing.cpu_count()
+            self.slots = threading.BoundedSemaphore(jobs + (self.QUEUE if queue is None else queue))
+            self.metrics = ServiceMetrics()
+
+        def repair(self, data):
+            '''repair(data): repair_bytes(data), in the pool'''
+            return self.pool.apply(repair_bytes, (data,))
+
+        def server_close(self):
+            HTTPServer.server_close(self)
+            self.pool.close()
+            self.pool.join()
+
+    return RepairServer
+
+class Manifest(object):
+    r'''Manifest(path): a record of the files repaired, kept in a JSON file
+
+    For each input file, the manifest records its size and mtime, the
+    SHA-256 hashes of its contents and of its repaired output, and the
+    tool version which repaired it, and the path of the output. A later
+    run can then tell, with a stat() of the input and of its output and
+    no reading, that a file is unchanged since its repair, and that its
+    repaired copy is still there. Entries are plain dicts, so they can
+    be sent to a process pool.
+
+    >>> import os, shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> inpath = os.path.join(p, 'test.ofx'); outpath = os.path.join(p, 'test.repaired.ofx')
+    >>> with open(inpath, 'wb') as f: n = f.write(b'original')
+    >>> with open(outpath, 'wb') as f: n = f.write(b'repaired')
+    >>> m = Manifest(os.path.join(p, 'manifest.json'))
+    >>> m.update(Manifest.entry(inpath, outpath)); m.save()
+
+    A new Manifest reads the saved entries back.
+    >>> m = Manifest(os.path.join(p, 'manifest.json'))
+    >>> entry = m.get(inpath)
+    >>> Manifest.unchanged(inpath, entry) == entry
+    True
+
+    If the stat() differs, the contents are hashed. If they are the same,
+    the file is still unchanged, and the entry gets the new mtime.
+    >>> os.utime(inpath, (0, 0))
+    >>> Manifest.unchanged(inpath, entry)['mtime']
+    0.0
+    >>> with open(inpath, 'wb') as f: n = f.write(b'new download')
+    >>> Manifest.unchanged(inpath, entry) is None
+    True
+
+    A file whose repaired copy has gone needs repair again.
+    >>> entry = Manifest.entry(inpath, outpath); os.remove(outpath)
+    >>> Manifest.unchanged(inpath, entry) is None
+    True
+    >>> shutil.rmtree(p)
+    '''
+
+    FORMAT = 1  # version of the manifest file format
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            import json
+            with open(path, 'r') as f:
+                self.entries = json.load(f)['files']
+
+    def get(self, inpath):
+        '''get(inpath): return the entry for inpath, or None'''
+        return self.entries.get(os.path.abspath(inpath))
+
+    def update(self, entry):
+        '''update(entry): record entry, for the file at its path'''
+        self.entries[entry['path']] = entry
+
+    def save(self):
+        '''save(): write the manifest file, replacing it atomically'''
+        import json
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'format': self.FORMAT, 'files': self.entries}, f,
+                      indent=1, sort_keys=True)
+        getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+    @staticmethod
+    def file_sha256(path):
+        '''file_sha256(path): return the SHA-256 hex digest of a file's contents'''
+        import hashlib
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def entry(inpath, out_path=None, in_sha256=None, out_sha256=None):
+        '''entry(inpath, out_path): return a new entry for a repaired file
+
+        out_path is the repaired output, or None if inpath was repaired in
+        place. Then in_sha256 is the hash of inpath before its repair.
+        Otherwise in_sha256 and out_sha256, if given, are the hashes of
+        inpath and out_path, which are then not read.
+        '''
+        st = os.stat(inpath)
+        entry = {'path': os.path.abspath(inpath), 'size': st.st_size, 'mtime': st.st_mtime,
+                 'version': __version__, 'in_place': out_path is None}
+        if out_path is None:
+            entry['out_sha256'] = Manifest.file_sha256(inpath)
+            entry['in_sha256'] = in_sha256
+        else:
+            entry['out_path'] = os.path.abspath(out_path)
+            entry['out_sha256'] = out_sha256 or Manifest.file_sha256(out_path)
+            entry['in_sha256'] = in_sha256 or Manifest.file_sha256(inpath)
+        return entry
+
+    @staticmethod
+    def unchanged(inpath, entry):
+        '''unchanged(inpath, entry): return entry if inpath needs no repair
+
+        inpath needs no repair if its size and mtime match entry, or else
+        if its contents do: the input's contents when it was repaired into
+        a copy by the same tool version, the repaired contents when it was
+        repaired in place. A file repaired into a copy needs repair again
+        if the copy is gone. Returns entry, updated to the current mtime,
+        if inpath needs no repair, or else None.
+        '''
+        try:
+            st = os.stat(inpath)
+        except OSError:
+            return None
+        if entry['in_place']:
+            done_sha256 = entry['out_sha256']
+        elif entry['version'] == __version__ and entry.get('out_path') and os.path.exists(entry['out_path']):
+            done_sha256 = entry['in_sha256']
+        else:
+            return None
+        if st.st_size == entry['size'] and st.st_mtime == entry['mtime']:
+            return entry
+        if st.st_size == entry['size'] and Manifest.file_sha256(inpath) == done_sha256:
+            entry = dict(entry, mtime=st.st_mtime)
+            return entry
+        return None
+
+def sorry_message(inpath, e, action='repair'):
+    '''sorry_message(inpath, e, action): report exception e from the action, e.g. repair, on inpath'''
+    import errno
+    if getattr(e, 'errno', None) == errno.ENOENT:
+        return "SORRY: File '{0}' doesn't appear to exist.".format(e.filename)
+    elif getattr(e, 'errno', None) == errno.EEXIST:
+        return "SORRY: Output file '{1}' already exists, so unable to repair '{0}'.".format(inpath, e.filename)
+    return "SORRY: Unable to {2} '{0}', because exception '{1}' occurred.".format(inpath, e, action)
+
+class RepairSession(object):
+    r'''RepairSession(rules): repair a batch of files, sharing the setup between them
+
+    For batches of many small files, where the setup of each repair
+    costs as much as the repair itself. A session keeps one OFXRepairer,
+    the codec of each distinct header block it has seen, and one input
+    buffer, grown to the largest file so far. repair_path() reads a file
+    into the buffer with one readinto(), decodes, repairs and encodes it
+    in memory with the cached codec, and writes the output, opened with
+    FilterInOutFiles.open_out_file(), in one write(). It returns what the
+    module's repair_path() does, which hands the plain whole-file
+    repairs of OFX files to a session given to it.
+    >>> import shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> for name in ('a.ofx', 'b.ofx'):
+    ...     with open(os.path.join(p, name), 'wb') as f:
+    ...         n = f.write(b'<OFX><STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>')
+    >>> session = RepairSession()
+    >>> for name in ('a.ofx', 'b.ofx', 'a.ofx'):
+    ...     print(session.repair_path(os.path.join(p, name)))   # doctest: +ELLIPSIS
+    (True, 48, ["Copy of '...a.ofx' repaired, in '...a.repaired.ofx'."])
+    (True, 48, ["Copy of '...b.ofx' repaired, in '...b.repaired.ofx'."])
+    (False, 0, ["SORRY: Output file '...a.repaired.ofx' already exists, so unable to repair '...a.ofx'."])
+    >>> with open(os.path.join(p, 'b.repaired.ofx'), 'rb') as f:
+    ...     f.read() == b'<OFX><STMTTRN>\n<NAME>b\n<MEMO>a\n</STMTTRN>\n</OFX>'
+    True
+    >>> len(session.codecs)
+    1
+    >>> shutil.rmtree(p)
+    '''
+
+    BUFFER_SIZE = 64 * 1024  # initial size of the input buffer
+    CODECS = 256  # header blocks whose codecs are kept; more, and the cache starts again
+
+    def __init__(self, rules=None):
+        self.repairer = OFXRepairer(None, rules=rules)
+        self.null_metrics = self.repairer.metrics
+        self.codecs = {}  # header block bytes: (codec name, codecs.CodecInfo)
+        self.buffer = bytearray(self.BUFFER_SIZE)
+
+    def __getstate__(self):
+        return self.repairer.rules  # for a process pool: each process builds its own caches
+
+    def __setstate__(self, rules):
+        self.__init__(rules)
+
+    def read(self, in_file):
+        '''read(in_file): read all of in_file into self.buffer; return a memoryview of it'''
+        size = os.fstat(in_file.fileno()).st_size + 1  # + 1, to see the end in one read
+        if len(self.buffer) < size:
+            self.buffer = bytearray(max(size, 2 * len(self.buffer)))
+        view = memoryview(self.buffer)
+        n = 0
+        while True:
+            count = in_file.readinto(view[n:])
+            if not count:
+                return view[:n]
+            n += count
+            if n == len(self.buffer):
+                # The file grew as it was read
+                self.buffer.extend(bytearray(len(self.buffer)))
+                view = memoryview(self.buffer)
+
+    def codec(self, data):
+        '''codec(data): the (codec name, codecs.CodecInfo) for file contents data, a memoryview'''
+        end = self.buffer.find(b'<', 0, min(len(data), OFXRepairer.HEADER_SIZE))
+        key = data[:end if end >= 0 else OFXRepairer.HEADER_SIZE].tobytes()
+        codec = self.codecs.get(key)
+        if codec is None:
+            if len(self.codecs) >= self.CODECS:
+                self.codecs.clear()
+            r = self.repairer
+            codec_name = r.codec_name_from_ofx_headers(r.read_ofx_headers(io.BytesIO(key)))
+            codec = self.codecs[key] = (codec_name, codecs.lookup(codec_name))
+        return codec
+
+    def repair_path(self, inpath, replace=False, verbose=0, metrics=None):
+        '''repair_path(inpath): repair one OFX file into its sister file, return (ok, nbytes, messages)
+
+        As the module's repair_path() does. A RepairMetrics given as
+        metrics records the repair's phases.
+        '''
+        messages = []
+        if verbose > 0:
+            messages.append("Repairing {0}...".format(inpath))
+        r = self.repairer
+        r.metrics = metrics = metrics or self.null_metrics
+        out_path = FilterInOutFiles(REPAIRED_EXT).generate_out_path(inpath)
+        out_file = None
+        try:
+            with open(inpath, 'rb') as in_file:
+                out_file = FilterInOutFiles.open_out_file(out_path, replace)
+                # The read is timed as decode, as OFXRepairer.write() times it
+                with metrics.phase('decode'):
+                    data = self.read(in_file)
+                with metrics.phase('header'):
+                    codec_name, codec = self.codec(data)
+                metrics.codec_name = codec_name
+                with metrics.phase('decode'):
+                    s = codec.decode(data)[0]
+                nbytes = len(data)
+            with metrics.phase('split_input'):
+                pre, to_repair, post = r.split_input(s)
+            if pre is None:
+                raise CLIError('Appears to not be OFX: {0}'.format(inpath))
+            with metrics.phase('repair'):
+                repaired = r.repair(to_repair)
+            with metrics.phase('encode'):
+                out_data = codec.encode(pre + repaired + post)[0]
+            with metrics.phase('write'):
+                out_file.write(out_data)
+                out_file.close()
+        except Exception as e:
+            if out_file is not None:
+                # Don't leave a partial output file, which would block a retry
+                out_file.close()
+                os.remove(out_path)
+            messages.append(sorry_message(inpath, e))
+            return (False, 0, messages)
+        finally:
+            r.metrics = self.null_metrics
+        messages.append("Copy of '{0}' repaired, in '{1}'.".format(inpath, out_path))
+        return (True, nbytes, messages)
+
+def repair_path(inpath, stream=False, verbose=0, in_place=False, replace=False, metrics=None,
+                splice=False, rules=None, export=None, pool=None, split_size=None, session=None):
+    r'''repair_path(inpath): repair one file, return (ok, nbytes, messages)
+
+    Repairs the OFX file at inpath into a '.repaired' sister file. 
+    A problem with the file is reported in messages, a list of lines
+    to print, rather than raised, so that a batch can go on to the next
+    file. ok is True if the file was repaired, and nbytes is its size.
+    Because it is a module-level function, main() can hand it to a
+    process pool. With in_place, the file is repaired where it lies,
+    by InPlaceRepairer. With replace, an existing output file is
+    replaced, rather than reported. A RepairMetrics given as metrics
+    records the repair's phases. The inpath '-' repairs standard input
+    to standard output, a transaction at a time. With splice, a file in
+    an ASCII-compatible encoding is repaired by SpliceRepairer. An
+    archive, with one of the ARCHIVE_EXTENSIONS, is copied with its OFX
+    files repaired, by ArchiveRepairer. A RuleSet given as rules replaces
+    the default repair. With export, one of TransactionExporter.FORMATS,
+    a record of each repaired transaction is written to a sister file of
+    the output with that format's extension, e.g. foo.repaired.jsonl, in
+    the same pass as the repair. Given a multiprocessing.Pool as pool, a
+    file of split_size bytes or more (default SPLIT_SIZE) is repaired in
+    pieces by the pool, with OFXRepairer.repair_parallel(). Given a
+    RepairSession as session, a file repaired whole into a copy, as
+    write() would, is repaired by the session instead, with its rules.
+    >>> repair_path('foo.dat')
+    (False, 0, ["I don't work on files ending in '.dat': foo.dat."])
+    >>> repair_path('-', export='jsonl')
+    (False, 0, ["I don't export transactions from standard input: -."])
+    >>> import shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> with open(os.path.join(p, 'a.ofx'), 'wb') as f:
+    ...     n = f.write(b'<OFX><STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>')
+    >>> repair_path(os.path.join(p, 'a.ofx'), export='jsonl')  # doctest: +ELLIPSIS
+    (True, 48, ["Copy of '...a.ofx' repaired, in '...a.repaired.ofx', 1 transactions exported to '...a.repaired.jsonl'."])
+    >>> with open(os.path.join(p, 'a.repaired.jsonl')) as f:
+    ...     print(f.read().strip())
+    {"TRNTYPE": null, "DTPOSTED": null, "TRNAMT": null, "FITID": null, "NAME": "b", "MEMO": "a", "CONFIRMATION": null}
+    >>> shutil.rmtree(p)
+    '''
+    (_, ext) = os.path.splitext(inpath)
+    stdio = inpath == FilterInOutFiles.STDIO_PATH
+    archive = archive_ext(inpath)
+    if archive and in_place:
+        return (False, 0, ["I don't repair archives in place: {0}.".format(inpath)])
+    if archive and export:
+        return (False, 0, ["I don't export transactions from archives: {0}.".format(inpath)])
+    if stdio and export:
+        return (False, 0, ["I don't export transactions from standard input: {0}.".format(inpath)])
+    if not stdio and not archive and ext.lower() not in OFX_EXTENSIONS:
+        return (False, 0, ["I don't work on files ending in '{0}': {1}.".format(ext, inpath)])
+    if session is not None and not (stdio or archive or in_place or stream or splice or export or pool):
+        return session.repair_path(inpath, replace, verbose, metrics)
+
+    messages = []
+    if verbose > 0:
+        messages.append("Repairing {0}...".format(inpath))
+    if in_place:
+        try:
+            r = InPlaceRepairer(inpath, metrics, rules)
+            if r.rollback():
+                messages.append("Rolled back an interrupted repair of '{0}'.".format(inpath))
+            count = r.repair()
+        except Exception as e:
+            messages.append(sorry_message(inpath, e))
+            return (False, 0, messages)
+        messages.append("Repaired '{0}' in place, {1} transactions changed.".format(inpath, count))
+        return (True, os.path.getsize(inpath), messages)
+
+    file_manager = ArchiveInOutFiles(REPAIRED_EXT) if archive else FilterInOutFiles(REPAIRED_EXT)
+    # repaired files have this extra extension before their extension
+    # e.g. foo.ofx after repair is written to foo.repaired.ofx
+    exporter = export_path = None
+    try:
+        try:
+            in_file, out_file = file_manager.open_in_out_files(inpath, replace)
+            if export:
+                export_path = os.path.splitext(file_manager.out_path)[0] + TransactionExporter.FORMATS[export]
+                if not replace and os.path.exists(export_path):
+                    import errno
+                    raise OSError(errno.EEXIST, 'File exists', export_path)
+                exporter = TransactionExporter(io.open(export_path, 'w', encoding='utf-8', newline=''), export)
+        except (IOError, OSError) as e:
+            if export_path is not None and file_manager.out_path is not None:
+                # The output was opened, so don't leave it behind
+                out_path = file_manager.out_path
+                file_manager.close()
+                os.remove(out_path)
+            messages.append(sorry_message(inpath, e))
+            return (False, 0, messages)
+
+        try:
+            r = SpliceRepairer(in_file, out_file, metrics, rules) \
+                    if splice and not stdio and not archive and exporter is None else None
+            if archive:
+                r = ArchiveRepairer(in_file, out_file, archive, rules)
+                r.write()
+            elif r is not None and r.codec_name in r.SPLICE_CODECS:
+                r.write_splice()
+            elif stream or stdio:
+                OFXRepairer(in_file, out_file, metrics, rules, exporter).write_stream()
+            else:
+                big = pool is not None and not archive and os.path.getsize(inpath) >= (split_size or SPLIT_SIZE)
+                OFXRepairer(in_file, out_file, metrics, rules, exporter, pool if big else None).write()
+        except Exception as e:
+            # Don't leave a partial output file, which would block a retry
+            out_path = file_manager.out_path
+            file_manager.close()
+            if out_path is not None:
+                os.remove(out_path)
+            if exporter is not None:
+                exporter.out_file.close()
+                os.remove(export_path)
+                exporter = None
+            messages.append(sorry_message(inpath, e))
+            return (False, 0, messages)
+        if stdio:
+            messages.append("Standard input repaired, to standard output.")
+            return (True, in_file.nread, messages)
+        if archive:
+            messages.extend(r.messages)
+            messages.append("Copy of '{0}' repaired, in '{1}', {2} of its {3} OFX files repaired.".format(
+                    inpath, out_file.name, r.nrepaired, r.nofx))
+        elif exporter is not None:
+            messages.append("Copy of '{0}' repaired, in '{1}', {2} transactions exported to '{3}'.".format(
+                    inpath, out_file.name, exporter.count, export_path))
+        else:
+            messages.append("Copy of '{0}' repaired, in '{1}'.".format(inpath, out_file.name))
+        return (True, os.path.getsize(inpath), messages)
+    finally:
+        file_manager.close()
+        if exporter is not None:
+            exporter.out_file.close()
+
+def scan_path(inpath, stop=False, rules=None, verbose=0):
+    r'''scan_path(inpath): count what repairing one file would change, return (ok, nbytes, messages, metrics)
+
+    Reads the OFX file at inpath with ScanRepairer, and writes nothing.
+    metrics is a RepairMetrics with the file's counts of transactions,
+    those to swap and those with a confirmation number, or None if the
+    file could not be scanned. The messages report a file which needs
+    repair, in one line, and with verbose, one which does not. With stop,
+    the scan of a file ends at its first transaction which needs repair.
+    Because it is a module-level function, main() can hand it to a
+    process pool.
+    >>> scan_path('foo.dat')
+    (False, 0, ["I don't work on files ending in '.dat': foo.dat."], None)
+    >>> import shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> with open(os.path.join(p, 'a.ofx'), 'wb') as f:
+    ...     n = f.write(b'<OFX><STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>')
+    >>> scan_path(os.path.join(p, 'a.ofx'))[:3]  # doctest: +ELLIPSIS
+    (True, 48, ["'...a.ofx' needs repair: 1 of 1 transactions to swap, 0 with confirmation."])
+    >>> scan_path(os.path.join(p, 'a.ofx'), stop=True)[:3]  # doctest: +ELLIPSIS
+    (True, 48, ["'...a.ofx' needs repair."])
+    >>> shutil.rmtree(p)
+    '''
+    (_, ext) = os.path.splitext(inpath)
+    if archive_ext(inpath):
+        return (False, 0, ["I don't scan archives: {0}.".format(inpath)], None)
+    if ext.lower() not in OFX_EXTENSIONS:
+        return (False, 0, ["I don't work on files ending in '{0}': {1}.".format(ext, inpath)], None)
+    metrics = RepairMetrics(timing=False)
+    try:
+        with open(inpath, 'rb') as in_file:
+            ScanRepairer(in_file, metrics, rules).scan(stop)
+            nbytes = os.fstat(in_file.fileno()).st_size
+    except Exception as e:
+        return (False, 0, [sorry_message(inpath, e, 'scan')], None)
+    messages = []
+    if metrics.swapped and stop:
+        messages.append("'{0}' needs repair.".format(inpath))
+    elif metrics.swapped:
+        messages.append("'{0}' needs repair: {1} of {2} transactions to swap, {3} with confirmation.".format(
+                inpath, metrics.swapped, metrics.transactions, metrics.confirmations))
+    elif verbose > 0:
+        messages.append("'{0}' needs no repair: {1} transactions.".format(inpath, metrics.transactions))
+    return (True, nbytes, messages, metrics)
+
+def verify_path(inpath, rules=None, verbose=0):
+    r'''verify_path(inpath): check the repaired copy of one file, return (ok, nbytes, messages, metrics)
+
+    Checks with RepairVerifier that the '.repaired' sister file of the
+    OFX file at inpath holds its repair. ok is True if it does. metrics
+    is a RepairMetrics with the counts of the input's transactions, or
+    None if the files could not be compared. The messages report a
+    mismatch, or with verbose, a match. Because it is a module-level
+    function, main() can hand it to a process pool.
+    >>> verify_path('foo.dat')
+    (False, 0, ["I don't work on files ending in '.dat': foo.dat."], None)
+    >>> import shutil, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> with open(os.path.join(p, 'a.ofx'), 'wb') as f:
+    ...     n = f.write(b'<OFX><STMTTRN>\n<NAME>a\n<MEMO>b\n</STMTTRN>\n</OFX>')
+    >>> print(verify_path(os.path.join(p, 'a.ofx'))[2][0])   # doctest: +ELLIPSIS
+    SORRY: File '...a.repaired.ofx' doesn't appear to exist.
+    >>> repair_path(os.path.join(p, 'a.ofx'))[0]
+    True
+    >>> verify_path(os.path.join(p, 'a.ofx'), verbose=1)[:3]   # doctest: +ELLIPSIS
+    (True, 48, ["Verified '...a.repaired.ofx', the repair of '...a.ofx': 1 of 1 transactions swapped."])
+    >>> verify_path(os.path.join(p, 'a.ofx'), rules=RuleSet([]))[:3]   # doctest: +ELLIPSIS
+    (False, 48, ["MISMATCH: '...a.repaired.ofx' is not the repair of '...a.ofx': line 2, in <NAME> of transaction 1: the input has '<NAME>a', the output '<NAME>b'."])
+    >>> shutil.rmtree(p)
+    '''
+    (_, ext) = os.path.splitext(inpath)
+    if archive_ext(inpath):
+        return (False, 0, ["I don't verify archives: {0}.".format(inpath)], None)
+    if ext.lower() not in OFX_EXTENSIONS:
+        return (False, 0, ["I don't work on files ending in '{0}': {1}.".format(ext, inpath)], None)
+    out_path = FilterInOutFiles(REPAIRED_EXT).generate_out_path(inpath)
+    metrics = RepairMetrics(timing=False)
+    try:
+        with open(inpath, 'rb') as in_file:
+            nbytes = os.fstat(in_file.fileno()).st_size
+            with open(out_path, 'rb') as out_file:
+                difference = RepairVerifier(in_file, out_file, metrics, rules).verify()
+    except Exception as e:
+        return (False, 0, [sorry_message(inpath, e, 'verify')], None)
+    if difference is not None:
+        return (False, nbytes, ["MISMATCH: '{0}' is not the repair of '{1}': {2}.".format(
+                out_path, inpath, difference)], metrics)
+    messages = []
+    if verbose > 0:
+        messages.append("Verified '{0}', the repair of '{1}': {2} of {3} transactions swapped.".format(
+                out_path, inpath, metrics.swapped, metrics.transactions))
+    return (True, nbytes, messages, metrics)
+
+PIPELINE_END = None  # put on a pipeline queue after its last item
+
+def pipeline_paths(inpaths, depth=2, verbose=0, replace=False, rules=None):
+    r'''pipeline_paths(inpaths, depth): repair files, overlapping reads, repairs and writes
+
+    A generator of (ok, nbytes, messages) per path in inpaths, in order,
+    as repair_path() returns. The work is split into three stages, joined
+    by queues of at most depth files: a thread reads upcoming files
+    whole, a thread repairs them with repair_bytes(), and the generator
+    writes the outputs as they are taken. Reading and writing release
+    the interpreter lock, so while one file is repaired the disk or
+    network is busy with its neighbours. At most about 3 * depth + 3
+    files are in memory at once. Files are opened, named and reported
+    as repair_path() does, and rules are as for it. An archive is not
+    read ahead, but repaired by repair_path() in its turn to be written.
+    >>> import os, shutil, tempfile, zipfile
+    >>> p = tempfile.mkdtemp()
+    >>> for name in ('a.ofx', 'b.ofx', 'c.qfx'):
+    ...     with open(os.path.join(p, name), 'wb') as f:
+    ...         n = f.write(b'<OFX><NAME>a\n<MEMO>b\n</OFX>' if name != 'b.ofx' else b'<html>')
+    >>> with zipfile.ZipFile(os.path.join(p, 'd.zip'), 'w') as z:
+    ...     z.write(os.path.join(p, 'a.ofx'), 'a.ofx')
+    >>> for ok, nbytes, messages in pipeline_paths([os.path.join(p, name)
+    ...         for name in ('a.ofx', 'foo.dat', 'b.ofx', 'c.qfx', 'd.zip', 'a.ofx')], 1):
+    ...     print(ok, nbytes, messages)       # doctest: +ELLIPSIS
+    True 27 ["Copy of '...a.ofx' repaired, in '...a.repaired.ofx'."]
+    False 0 ["I don't work on files ending in '.dat': ...foo.dat."]
+    False 0 ["SORRY: Unable to repair '...b.ofx', because exception 'E: Appears to not be OFX: <bytes>' occurred."]
+    True 27 ["Copy of '...c.qfx' repaired, in '...c.repaired.qfx'."]
+    True ... ["Copy of '...d.zip' repaired, in '...d.repaired.zip'..."]
+    False 0 ["SORRY: Output file '...a.repaired.ofx' already exists, so unable to repair '...a.ofx'."]
+    >>> sorted(os.listdir(p))
+    ['a.ofx', 'a.repaired.ofx', 'b.ofx', 'c.qfx', 'c.repaired.qfx', 'd.repaired.zip', 'd.zip']
+    >>> shutil.rmtree(p)
+    '''
+    import threading
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue  # Python 2
+    read_queue, repair_queue = queue.Queue(depth), queue.Queue(depth)
+    repairer = OFXRepairer(None, rules=rules)
+
+    def read_stage():
+        # Each item is [inpath, ok, data, messages, file_manager], or an exception to re-raise
+        try:
+            for inpath in inpaths:
+                item = [inpath, None, None, [], None]
+                (_, ext) = os.path.splitext(inpath)
+                if archive_ext(inpath):
+                    pass  # left to repair_path(), as ok and file_manager are None
+                elif ext.lower() not in OFX_EXTENSIONS:
+                    item[1] = False
+                    item[3].append("I don't work on files ending in '{0}': {1}.".format(ext, inpath))
+                else:
+                    if verbose > 0:
+                        item[3].append("Repairing {0}...".format(inpath))
+                    file_manager = FilterInOutFiles(REPAIRED_EXT)
+                    try:
+                        in_file, _ = file_manager.open_in_out_files(inpath, replace)
+                        item[2] = in_file.read()
+                        item[4] = file_manager
+                    except (IOError, OSError) as e:
+                        file_manager.close()
+                        item[1] = False
+                        item[3].append(sorry_message(inpath, e))
+                read_queue.put(item)
+        except Exception as e:
+            read_queue.put(e)
+        read_queue.put(PIPELINE_END)
+
+    def repair_stage():
+        for item in iter(read_queue.get, PIPELINE_END):
+            if isinstance(item, list) and item[4] is not None:
+                try:
+                    item[2] = (len(item[2]), repair_bytes(item[2], repairer))
+                except Exception as e:
+                    item[3].append(sorry_message(item[0], e))
+                    item[1], item[2] = False, None
+            repair_queue.put(item)
+        repair_queue.put(PIPELINE_END)
+
+    for stage in (read_stage, repair_stage):
+        thread = threading.Thread(target=stage)
+        thread.daemon = True  # so an abandoned pipeline does not hold up the exit
+        thread.start()
+
+    for item in iter(repair_queue.get, PIPELINE_END):
+        if isinstance(item, Exception):
+            raise item
+        inpath, ok, data, messages, file_manager = item
+        if ok is None and file_manager is None:
+            yield repair_path(inpath, verbose=verbose, replace=replace, rules=rules)
+            continue
+        if file_manager is None:
+            yield (ok, 0, messages)
+            continue
+        out_path = file_manager.out_path
+        try:
+            if data is not None:
+                nbytes, repaired = data
+                file_manager.out_file.write(repaired)
+                messages.append("Copy of '{0}' repaired, in '{1}'.".format(inpath, out_path))
+        except (IOError, OSError) as e:
+            messages.append(sorry_message(inpath, e))
+            data = None
+        finally:
+            file_manager.close()
+        if data is None:
+            # Don't leave a partial output file, which would block a retry
+            os.remove(out_path)
+            yield (False, 0, messages)
+        else:
+            yield (True, nbytes, messages)
+
+def merge_paths(inpaths, out_path, replace=False):
+    r'''merge_paths(inpaths, out_path): merge OFX files into one, return (ok, nbytes, messages)
+
+    Merges the files at inpaths into a new file at out_path, with
+    OFXMerger. As with repair_path(), problems are reported in messages,
+    and nbytes is the size of the inputs. With replace, an existing file
+    at out_path is replaced, rather than reported. The output is opened
+    with FilterInOutFiles.open_out_file(), as repair outputs are.
+    >>> merge_paths(['nonexistent.ofx'], 'merged.ofx')
+    (False, 0, ["SORRY: File 'nonexistent.ofx' doesn't appear to exist."])
+    >>> os.path.exists('merged.ofx')
+    False
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix='.ofx') as f:
+    ...     merge_paths([f.name], f.name)   # doctest: +ELLIPSIS
+    (False, 0, ["SORRY: Output file '...ofx' already exists, so unable to merge into it."])
+    '''
+    import errno
+    in_files = []
+    out_file = None
+    try:
+        try:
+            for inpath in inpaths:
+                in_files.append(open(inpath, 'rb'))
+            with FilterInOutFiles.open_out_file(out_path, replace) as out_file:
+                merger = OFXMerger(in_files)
+                merger.write(out_file)
+        except Exception as e:
+            if out_file is not None:
+                # Don't leave a partial output file
+                os.remove(out_path)
+            if getattr(e, 'errno', None) == errno.EEXIST:
+                return (False, 0, ["SORRY: Output file '{0}' already exists, so unable to merge into it.".format(
+                        out_path)])
+            if getattr(e, 'errno', None) is not None:
+                return (False, 0, [sorry_message(out_path, e)])
+            return (False, 0, ["SORRY: Unable to merge into '{0}', because exception '{1}' occurred.".format(out_path, e)])
+    finally:
+        for in_file in in_files:
+            in_file.close()
+    nbytes = sum(os.path.getsize(inpath) for inpath in inpaths)
+    return (True, nbytes, ["Merged {0} files into '{1}', {2} transactions, {3} duplicates dropped.".format(
+            len(inpaths), out_path, merger.ntransactions, merger.nduplicates)])
+
+def repair_task(task, manifest=False, force=False, incremental=False, **kwargs):
+    r'''repair_task((inpath, previous)): repair_path(), keeping a manifest
+
+    task is a pair of the path to repair, and its Manifest entry from an
+    earlier run, or None. Returns (ok, nbytes, messages, entry), as
+    repair_path() does, with entry the file's new Manifest entry, or None.
+    With manifest, a file which is unchanged since its earlier repair is
+    skipped, with ok None. Its earlier output may be replaced, if it is
+    unchanged too. With force, every file is repaired, and existing
+    outputs are replaced. With incremental, the entry of a file repaired
+    into a copy records its AppendRepairer.tail(), and when the file has
+    only grown since, and its earlier output is unchanged, only what was
+    added is repaired, onto that output. Other arguments are passed to
+    repair_path().
+    >>> repair_task(('foo.dat', None))
+    (False, 0, ["I don't work on files ending in '.dat': foo.dat."], None)
+    '''
+    inpath, previous = task
+    if not manifest:
+        return repair_path(inpath, replace=force, **kwargs) + (None,)
+
+    in_place = kwargs.get('in_place')
+    file_manager = ArchiveInOutFiles(REPAIRED_EXT) if archive_ext(inpath) else FilterInOutFiles(REPAIRED_EXT)
+    out_path = None if in_place else file_manager.generate_out_path(inpath)
+    replace = force
+    notes = []
+    if previous is not None and not force:
+        entry = Manifest.unchanged(inpath, previous)
+        if entry is not None:
+            messages = []
+            if kwargs.get('verbose', 0) > 0:
+                messages.append("Skipping {0}, unchanged since its repair.".format(inpath))
+            return (None, 0, messages, entry)
+        appendable = incremental and not in_place and previous.get('tail') \
+                    and previous['version'] == __version__ and os.path.exists(out_path)
+        if appendable:
+            # append() checks the output is unchanged as it reads it, and
+            # hashes both files as it goes, so neither is read again
+            r = AppendRepairer(inpath, out_path, kwargs.get('metrics'), kwargs.get('rules'))
+            try:
+                tail = r.append(previous['tail'], previous['out_sha256'])
+            except Exception as e:
+                return (False, 0, [sorry_message(inpath, e)], None)
+            if tail is not None:
+                entry = Manifest.entry(inpath, out_path, r.in_sha256, r.out_sha256)
+                entry['tail'] = tail
+                return (True, os.path.getsize(inpath), [
+                        "Repaired the {0} transactions added to '{1}' after FITID '{2}', onto '{3}'.".format(
+                                r.metrics.transactions, inpath, previous['tail']['fitid'], out_path)], entry)
+        # Replace the output of the earlier repair, if no one has changed it
+        replace = not in_place and os.path.exists(out_path) \
+                    and Manifest.file_sha256(out_path) == previous['out_sha256']
+        if appendable and replace and kwargs.get('verbose', 0) > 0:
+            notes.append("'{0}' changed before its last repaired transaction, so repairing it whole.".format(inpath))
+
+    in_sha256 = Manifest.file_sha256(inpath) if in_place and os.path.exists(inpath) else None
+    ok, nbytes, messages = repair_path(inpath, replace=replace, **kwargs)
+    entry = Manifest.entry(inpath, out_path, in_sha256) if ok else None
+    if entry is not None and incremental and not in_place and not archive_ext(inpath):
+        entry['tail'] = AppendRepairer(inpath, out_path).tail()
+    return (ok, nbytes, notes + messages, entry)
+
+def profile_task(task, profile=False, **kwargs):
+    r'''profile_task(task): repair_task(), with a RepairMetrics record if profile
+
+    Returns (ok, nbytes, messages, entry, record), as repair_task() does,
+    with record the file's RepairMetrics.record(), or None without
+    profile. The record includes the peak memory traced by tracemalloc,
+    where Python has it (3.4 and later). Tracing slows the repair, so
+    the phase times are best compared with each other. Other arguments
+    are passed to repair_task().
+    >>> profile_task(('foo.dat', None))
+    (False, 0, ["I don't work on files ending in '.dat': foo.dat."], None, None)
+    >>> profile_task(('foo.dat', None), profile=True)[4]['transactions']
+    0
+
+    An incremental repair is profiled too.
+    >>> import shutil, tempfile
+    >>> p = tempfile.mkdtemp(); path = os.path.join(p, 'a.ofx')
+    >>> trn = b'<STMTTRN>\n<FITID>{0}\n<NAME>a\n<MEMO>b\n</STMTTRN>\n'
+    >>> with open(path, 'wb') as f:
+    ...     n = f.write(b'<OFX>\n' + trn.replace(b'{0}', b'1') + b'</OFX>\n')
+    >>> entry = profile_task((path, None), profile=True, manifest=True, incremental=True)[3]
+    >>> with open(path, 'wb') as f:
+    ...     n = f.write(b'<OFX>\n' + trn.replace(b'{0}', b'1') + trn.replace(b'{0}', b'2') + b'</OFX>\n')
+    >>> ok, nbytes, messages, entry, record = profile_task((path, entry), profile=True, manifest=True, incremental=True)
+    >>> print(ok, record['transactions'], messages)   # doctest: +ELLIPSIS
+    True 1 ["Repaired the 1 transactions added to '...a.ofx' after FITID '1', onto '...a.repaired.ofx'."]
+    >>> shutil.rmtree(p)
+    '''
+    if not profile:
+        return repair_task(task, **kwargs) + (None,)
+    metrics = RepairMetrics()
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    try:
+        result = repair_task(task, metrics=metrics, **kwargs)
+    finally:
+        if tracemalloc is not None:
+            metrics.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result + (metrics.record(task[0], result[0], result[1], time.time() - start),)
+
+def main(argv=None): # IGNORE:C0111
+    '''Command line options.
+
+    argv is the list of arguments, without the program name; by default,
+    sys.argv[1:]. It is parsed as given, and sys.argv is left alone, so
+    another program may call main() repeatedly.
+    >>> saved = sys.argv[:]
+    >>> main(['foo.dat'])        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    I don't work on files ending in '.dat': foo.dat.
+    Repaired 0 of 1 files, 0 bytes, in ...s (... MB/s).
+    0
+    >>> sys.argv == saved
+    True
+
+    Only works on files with specific extensions.
+    However, the exit code is 0, not an error exit code.
+    >>> sys.argv[1:] = ['foo.dat']
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    I don't work on files ending in '.dat': foo.dat.
+    Repaired 0 of 1 files, 0 bytes, in ...s (... MB/s).
+    0
+    
+    If the input file doesn't exist, it prints an error message and continues.
+    >>> import os, os.path, tempfile
+    >>> p = tempfile.mkdtemp()
+    >>> sys.argv[1:] = [ os.path.join(p, 'nonexistent.ofx') ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    SORRY: File '...nonexistent.ofx' doesn't appear to exist.
+    Repaired 0 of 1 files, 0 bytes, in ...s (... MB/s).
+    0
+
+    If the output file exists, it prints an error message and continues.
+    >>> f1 = open( os.path.join(p, 'existing.ofx'), 'w' ); n = f1.write(''); f1.close()
+    >>> f2 = open( os.path.join(p, 'existing.repaired.ofx'), 'w' ); n = f2.write(''); f2.close()
+    >>> sys.argv[1:] = [ f1.name ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    SORRY: Output file '...existing.repaired.ofx' already exists, so unable to repair '...existing.ofx'.
+    Repaired 0 of 1 files, 0 bytes, in ...s (... MB/s).
+    0
+
+    With --jobs, a pool of processes repairs the files. Each file gets
+    its own report, in input order, and a failure does not stop the batch.
+    >>> f3 = open( os.path.join(p, 'good.ofx'), 'wb' )
+    >>> n = f3.write(b'ENCODING:USASCII\\n\\n<OFX>\\n<STMTTRN>\\n<NAME>a\\n<MEMO>b\\n</STMTTRN>\\n</OFX>\\n')
+    >>> f3.close()
+    >>> sys.argv[1:] = [ '--jobs', '2', f1.name, 'foo.dat', f3.name ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    SORRY: Output file '...existing.repaired.ofx' already exists, so unable to repair '...existing.ofx'.
+    I don't work on files ending in '.dat': foo.dat.
+    Copy of '...good.ofx' repaired, in '...good.repaired.ofx'.
+    Repaired 1 of 3 files, 68 bytes, in ...s (... MB/s).
+    0
+    >>> print(open( os.path.join(p, 'good.repaired.ofx') ).read())
+    ENCODING:USASCII
+    <BLANKLINE>
+    <OFX>
+    <STMTTRN>
+    <NAME>b
+    <MEMO>a
+    </STMTTRN>
+    </OFX>
+    <BLANKLINE>
+
+    With --recursive, files in folders are repaired, and repaired files
+    from the run above are skipped.
+    >>> sys.argv[1:] = [ '--recursive', '--exclude', 'existing', p ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    SORRY: Output file '...good.repaired.ofx' already exists, so unable to repair '...good.ofx'.
+    Repaired 0 of 1 files, 0 bytes, in ...s (... MB/s).
+    0
+
+    With --pipeline, files are read ahead and written behind, while the
+    one between is repaired. The reports are the same.
+    >>> sys.argv[1:] = [ '--pipeline', '2', f1.name, 'foo.dat', f3.name ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    SORRY: Output file '...existing.repaired.ofx' already exists, so unable to repair '...existing.ofx'.
+    I don't work on files ending in '.dat': foo.dat.
+    SORRY: Output file '...good.repaired.ofx' already exists, so unable to repair '...good.ofx'.
+    Repaired 0 of 3 files, 0 bytes, in ...s (... MB/s).
+    0
+
+    With --profile, each file's repair is followed by the time of each of
+    its phases, and its counts of transactions. --metrics-json writes the
+    same, as one JSON record per file.
+    >>> metrics_path = os.path.join(p, 'metrics.json')
+    >>> sys.argv[1:] = [ '--force', '--profile', '--metrics-json', metrics_path, f3.name ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    Copy of '...good.ofx' repaired, in '...good.repaired.ofx'.
+    Profile of '...good.ofx': header ...s, decode ...s, split_input ...s, repair ...s, encode ...s, write ...s, total ...s; 1 transactions, 1 swapped, 0 with confirmation; peak memory ...
+    Repaired 1 of 1 files, 68 bytes, in ...s (... MB/s).
+    0
+    >>> import json
+    >>> record = json.loads(open(metrics_path).read())
+    >>> [record[k] for k in ('ok', 'bytes', 'codec', 'transactions', 'swapped')] == [True, 68, 'cp1252', 1, 1]
+    True
+    >>> os.remove(metrics_path)
+
+    With --scan, the files are read, and those which need repair reported,
+    with what they need, but nothing is written.
+    >>> sys.argv[1:] = [ '--scan', '--jobs', '2', f3.name, 'foo.dat' ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    '...good.ofx' needs repair: 1 of 1 transactions to swap, 0 with confirmation.
+    I don't work on files ending in '.dat': foo.dat.
+    1 files need repair, with 1 of 1 transactions to swap.
+    Scanned 1 of 2 files, 68 bytes, in ...s (... MB/s).
+    0
+
+    With --verify, the repaired copy of each file is checked against its
+    repair. The exit code is 1 if any copy differs, or can't be checked.
+    >>> sys.argv[1:] = [ '--verify', f3.name ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    Verified 1 of 1 files, with 1 of 1 transactions swapped, 68 bytes, in ...s (... MB/s).
+    0
+    >>> sys.argv[1:] = [ '--verify', f1.name ]
+    >>> main()        # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    SORRY: Unable to verify '...existing.ofx', because exception 'E: Appears to not be OFX: ...existing.ofx' occurred.
+    Verified 0 of 1 files, with 0 of 0 transactions swapped, 0 bytes, in ...s (... MB/s).
+    1
+
+    With --in-place, which needs --manifest, each file is repaired where
+    it lies. A second run skips it, rather than swapping its fields back.
+    >>> manifest_path = os.path.join(p, 'manifest.json')
+    >>> for i in range(2):
+    ...     main([ '--in-place', '--manifest', manifest_path, f3.name ])      # doctest: +ELLIPSIS
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    Repaired '...good.ofx' in place, 1 transactions changed.
+    Repaired 1 of 1 files, 68 bytes, in ...s (... MB/s).
+    0
+    vanswap_ofx.py: vanswap_ofx -- swap NAME and MEMO fields in OFX files 
+    <BLANKLINE>
+    Skipped 1 files unchanged since their repair.
+    Repaired 0 of 1 files, 0 bytes, in ...s (... MB/s).
+    0
+    >>> open(f3.name).read() == open( os.path.join(p, 'good.repaired.ofx') ).read()
+    True
+    >>> os.remove(manifest_path)
+
+    >>> os.remove(f3.name); os.remove( os.path.join(p, 'good.repaired.ofx') )
+
+    >>> os.remove(f1.name); os.remove( f2.name );
+    >>> os.rmdir(p)
+    '''
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    program_name = os.path.basename(sys.argv[0])
+    program_version = "v%s" % __version__
+    program_build_date = str(__updated__)
+    program_version_message = '%%(prog)s %s (%s)' % (program_version, program_build_date)
+    program_shortdesc = __import__('__main__').__doc__.split("\n")[1]
+    program_license = '''%s
+
+vanswap_ofx is a utility to repair OFX files by swapping the NAME 
+and MEMO fields. It works around a problem with OFX files created 
+by my credit union after a system upgrade in 2016. They generated OFX
+files with the NAME string in the MEMO field, and vice versa. This 
+utility repairs the OFX file by reading it in, and switching the values
+of NAME and MEMO in each transaction. If there is a confirmation number 
+in the MEMO field, it stays in the MEMO field. Then it writes the 
+repaired content out to a sister file, with a ".repaired" subextension, 
+in the same directory. 
+
+e.g. the command: vanswap.py statements/transactions_201610.ofx
+writes repaired content to   statements/transactions_201610.repaired.ofx
+
+Updated by Jim DeLaHunt on %s.
+Main program is granted to the public domain. Some modules are copyright 
+by their authors, and released under the MIT licence.
+Distributed on an "AS IS" basis without warranties
+or conditions of any kind, either express or implied.
+
+USAGE
+''' % (program_shortdesc, str(__date__))
+
+    try:
+        # Setup argument parser
+        parser = ArgumentParser(description=program_license, formatter_class=RawDescriptionHelpFormatter)
+        parser.add_argument("-r", "--recursive", dest="recurse", action="store_true", help="recurse into subfolders [default: %(default)s]")
+        parser.add_argument("-v", "--verbose", dest="verbose", action="count", 
+                            default=0, help="set verbosity level [default: %(default)s]")
+        parser.add_argument("-s", "--stream", dest="stream", action="store_true",
+                            help="repair one transaction at a time, in memory bounded by the largest transaction [default: %(default)s]")
+        parser.add_argument("--splice", dest="splice", action="store_true",
+                            help="write repaired copies by copying the input's unchanged bytes, and writing only the swapped lines. Only for ASCII-compatible encodings; other files are repaired as usual [default: %(default)s]")
+        parser.add_argument("--in-place", dest="in_place", action="store_true",
+                            help="repair files where they lie, instead of writing repaired copies. Only for single-byte encodings. Needs --manifest, which skips files already repaired, as repairing a file twice swaps its fields back [default: %(default)s]")
+        parser.add_argument("-m", "--manifest", dest="manifest", metavar="PATH",
+                            help="keep a manifest of repaired files at PATH, and skip files unchanged since their repair [default: %(default)s]")
+        parser.add_argument("--incremental", dest="incremental", action="store_true",
+                            help="with --manifest, when a file has only had transactions added at its end since its repair, repair just those onto its earlier repaired copy. Only for ASCII-compatible encodings; other files are repaired whole. Not with --in-place or --export [default: %(default)s]")
+        parser.add_argument("-f", "--force", dest="force", action="store_true",
+                            help="repair every file, even if the manifest shows it unchanged, and replace existing output files [default: %(default)s]")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, metavar="N",
+                            help="repair N files at a time in a pool of processes, 0 for one per CPU [default: %(default)s]")
+        parser.add_argument("-p", "--pipeline", dest="pipeline", type=int, default=0, metavar="N",
+                            help="overlap the reading, repair and writing of successive files, with up to N files waiting between each stage. Files are held whole in memory. Not with --jobs, --stream, --splice, --in-place, --manifest, --watch, --profile, --metrics-json or path - [default: %(default)s]")
+        parser.add_argument("--profile", dest="profile", action="store_true",
+                            help="print the time each phase of each file's repair took, its transaction counts, and its peak memory [default: %(default)s]")
+        parser.add_argument("--metrics-json", dest="metrics_json", metavar="PATH",
+                            help="write the metrics --profile prints to PATH, as one JSON record per line per file [default: %(default)s]")
+        parser.add_argument("-w", "--watch", dest="watch", metavar="DIR",
+                            help="keep running, and repair each OFX file which arrives in folder DIR, instead of given paths [default: %(default)s]")
+        parser.add_argument("--settle", dest="settle", type=float, default=Watcher.SETTLE, metavar="SECONDS",
+                            help="with --watch, wait until a file has gone unchanged for SECONDS before repairing it [default: %(default)s]")
+        parser.add_argument("--serve", dest="serve", metavar="[HOST:]PORT",
+                            help="keep running, as an HTTP service on HOST (default 127.0.0.1) and PORT, which answers a POST of an OFX file with the repaired file, and GET /metrics with its request metrics. --jobs processes do the repairs [default: %(default)s]")
+        parser.add_argument("--max-bytes", dest="max_bytes", type=int, default=SERVE_MAX_BYTES, metavar="N",
+                            help="with --serve, refuse requests larger than N bytes [default: %(default)s]")
+        parser.add_argument("--queue", dest="queue", type=int, default=SERVE_QUEUE, metavar="N",
+                            help="with --serve, accept N requests beyond those being repaired, and turn away the rest as busy [default: %(default)s]")
+        parser.add_argument("--rules", dest="rules", metavar="PATH",
+                            help="repair by the rules in JSON file PATH, instead of swapping NAME and MEMO as Vancity's files need. See RuleSet for the format [default: %(default)s]")
+        parser.add_argument("--export", dest="export", choices=list(TransactionExporter.FORMATS),
+                            help="also write a record of each repaired transaction, its type, date, amount, FITID, NAME, MEMO and confirmation number, to a sister file of each repaired copy, e.g. foo.repaired.jsonl, in the same pass. Not with --in-place, --splice, --pipeline or path - [default: %(default)s]")
+        parser.add_argument("--split", dest="split", type=int, metavar="N",
+                            help="repair each file of --split-size bytes or more in pieces, cut between transactions, by a pool of N processes, 0 for one per CPU. The output is the same. Not with --jobs, --stream, --splice, --in-place, --pipeline, --export or path - [default: %(default)s]")
+        parser.add_argument("--split-size", dest="split_size", type=int, default=SPLIT_SIZE, metavar="BYTES",
+                            help="with --split, the size of file which is repaired in pieces [default: %(default)s]")
+        parser.add_argument("--merge", dest="merge", metavar="PATH",
+                            help="instead of repairing, merge the transactions of the given OFX files, e.g. repaired overlapping downloads of one account, into one file at PATH, in date order, dropping transactions whose FITID repeats [default: %(default)s]")
+        parser.add_argument("--scan", dest="scan", action="store_true",
+                            help="instead of repairing, read the given OFX files and report which need repair, with their counts of transactions to swap, writing nothing. --jobs processes scan the files. Not with --watch, --serve, --merge, --pipeline, --in-place, --manifest, --export, --split, --profile, --metrics-json or path - [default: %(default)s]")
+        parser.add_argument("--any", dest="any", action="store_true",
+                            help="with --scan, stop scanning each file at its first transaction which needs repair, and report it without counts [default: %(default)s]")
+        parser.add_argument("--verify", dest="verify", action="store_true",
+                            help="instead of repairing, check that the repaired copy of each given OFX file holds exactly its repair: every element unchanged, except the fields the repair swaps. Reads both files a transaction at a time. Exits with status 1 if any copy differs, or could not be checked. --jobs processes check the files. Not with the options --scan can't be used with [default: %(default)s]")
+        parser.add_argument("-i", "--include", dest="include", help="only include paths matching this regex pattern. Note: exclude is given preference over include. [default: %(default)s]", metavar="RE" )
+        parser.add_argument("-e", "--exclude", dest="exclude", help="exclude paths matching this regex pattern. [default: %(default)s]", metavar="RE" )
+        parser.add_argument('-V', '--version', action='version', version=program_version_message)
+        parser.add_argument(dest="paths", help="paths to files(s), or with -r folders, to repair, or - to repair standard input to standard output [default: %(default)s]", 
+                            metavar="path", nargs='*')
+
+        # Process arguments
+        args = parser.parse_args(argv)
+
+        paths = args.paths
+        watch = args.watch
+        if watch and (paths or args.in_place):
+            parser.error("--watch takes no paths, and can't be used with --in-place")
+        if args.serve and (paths or watch or args.in_place or args.manifest):
+            parser.error("--serve takes no paths, and can't be used with --watch, --in-place or --manifest")
+        if not watch and not paths and not args.serve:
+            parser.error("the following arguments are required: path")
+        # With '-', standard output carries the repaired file, so messages go to standard error
+        stdio = FilterInOutFiles.STDIO_PATH in paths
+        if stdio and (len(paths) > 1 or args.in_place or args.manifest):
+            parser.error("path - must be the only path, without --in-place or --manifest")
+        if args.pipeline and (stdio or watch or args.jobs != 1 or args.stream or args.splice or args.in_place
+                              or args.manifest or args.profile or args.metrics_json):
+            parser.error("--pipeline can't be used with --jobs, --stream, --splice, --in-place, --manifest, --watch, "
+                         "--profile, --metrics-json or path -")
+        if args.merge and (stdio or watch or args.serve or args.pipeline or args.in_place or args.manifest):
+            parser.error("--merge can't be used with --watch, --serve, --pipeline, --in-place, --manifest or path -")
+        if args.rules and args.serve:
+            parser.error("--rules can't be used with --serve")
+        if args.export and (stdio or args.serve or args.merge or args.pipeline or args.in_place or args.splice):
+            parser.error("--export can't be used with --serve, --merge, --pipeline, --in-place, --splice or path -")
+        if args.in_place and not args.manifest:
+            parser.error("--in-place needs --manifest, so that a file already repaired is not repaired again, "
+                         "which would swap its fields back")
+        if args.incremental and (not args.manifest or args.in_place or args.export):
+            parser.error("--incremental needs --manifest, and can't be used with --in-place or --export")
+        if args.split is not None and (stdio or args.serve or args.merge or args.pipeline or args.jobs != 1
+                                       or args.in_place or args.splice or args.stream or args.export):
+            parser.error("--split can't be used with --jobs, --stream, --splice, --in-place, --pipeline, "
+                         "--export, --serve, --merge or path -")
+        if args.scan and args.verify:
+            parser.error("--scan can't be used with --verify")
+        if (args.scan or args.verify) and (stdio or watch or args.serve or args.merge or args.pipeline or args.in_place
+                          or args.manifest or args.export or args.split is not None
+                          or args.profile or args.metrics_json):
+            parser.error("--scan and --verify can't be used with --watch, --serve, --merge, --pipeline, "
+                         "--in-place, --manifest, --export, --split, --profile, --metrics-json or path -")
+        if args.any and not args.scan:
+            parser.error("--any needs --scan")
+        report = sys.stderr if stdio else sys.stdout
+        verbose = args.verbose
+        stream = args.stream
+        splice = args.splice
+        jobs = 1 if stdio or watch else args.jobs
+        in_place = args.in_place
+        manifest = Manifest(args.manifest) if args.manifest else None
+        force = args.force
+        recurse = args.recurse
+        profile = args.profile
+        metrics_file = open(args.metrics_json, 'w') if args.metrics_json else None
+        if metrics_file is not None:
+            import json
+        rules = RuleSet.load(args.rules) if args.rules else None
+        inpat = args.include
+        expat = args.exclude
+        
+        print("{0}: {1}\n".format(program_name, program_shortdesc), file=report)
+
+        if verbose > 0:
+            print("Verbose mode on", file=report)
+            if recurse:
+                print("Recursive mode on", file=report)
+            else:
+                print("Recursive mode off", file=report)
+            if watch:
+                print("Watching {0} for OFX files".format(watch), file=report)
+            else:
+                print("{0} {1} paths: {2}".format(
+                        'Scanning' if args.scan else 'Verifying' if args.verify else 'Repairing', len(paths), paths),
+                      file=report)
+
+        if args.serve:
+            host, _, port = args.serve.rpartition(':')
+            server = repair_server_class()((host or '127.0.0.1', int(port)), args.jobs,
+                                  args.max_bytes, args.queue, verbose)
+            try:
+                print("Serving on http://{0}:{1}/, with {2} jobs.".format(
+                        host or '127.0.0.1', server.server_address[1], args.jobs or 'one per CPU'), file=report)
+                report.flush()
+                server.serve_forever()
+            finally:
+                server.server_close()
+            return 0
+
+        if args.merge:
+            ok, nbytes, messages = merge_paths(paths, args.merge, force)
+            for message in messages:
+                print(message, file=report)
+            return 0
+
+        # Files are found lazily, and repaired as they are found
+        if watch:
+            # The Watcher yields files as they arrive, and never ends
+            watcher = Watcher(watch, recurse, settle=args.settle)
+            inpaths = iter_input_paths(watcher, False, inpat, expat)
+        else:
+            inpaths = iter_input_paths(paths, recurse, inpat, expat)
+
+        if args.scan or args.verify:
+            if args.scan:
+                check = functools.partial(scan_path, stop=args.any, rules=rules, verbose=verbose)
+            else:
+                check = functools.partial(verify_path, rules=rules, verbose=verbose)
+            start = time.time()
+            if jobs == 1:
+                pool = None
+                results = (check(inpath) for inpath in inpaths)
+            else:
+                import multiprocessing
+                pool = multiprocessing.Pool(jobs or None)
+                # Files are small and many, so hand them out a few at a time
+                results = pool.imap(check, inpaths, 16)
+            nfiles = nok = nneed = nbytes = ntransactions = nswapped = 0
+            for ok, size, messages, metrics in results:
+                nfiles += 1
+                for message in messages:
+                    print(message, file=report)
+                if ok:
+                    nok += 1
+                    nneed += metrics.swapped > 0
+                    ntransactions += metrics.transactions
+                    nswapped += metrics.swapped
+                nbytes += size
+            if pool is not None:
+                pool.close()
+                pool.join()
+            elapsed = time.time() - start
+            if args.verify:
+                print("Verified {0} of {1} files, with {2} of {3} transactions swapped, {4} bytes, "
+                      "in {5:.2f}s ({6:.2f} MB/s).".format(
+                        nok, nfiles, nswapped, ntransactions, nbytes, elapsed,
+                        nbytes / 1e6 / max(elapsed, 1e-6)), file=report)
+                return 0 if nok == nfiles else 1
+            if args.any:
+                print("{0} files need repair.".format(nneed), file=report)
+            else:
+                print("{0} files need repair, with {1} of {2} transactions to swap.".format(
+                        nneed, nswapped, ntransactions), file=report)
+            print("Scanned {0} of {1} files, {2} bytes, in {3:.2f}s ({4:.2f} MB/s).".format(
+                    nok, nfiles, nbytes, elapsed, nbytes / 1e6 / max(elapsed, 1e-6)), file=report)
+            return 0
+
+        if args.split is not None:
+            import multiprocessing
+            # The pool's processes leave an interrupt to this one
+            split_pool = multiprocessing.Pool(args.split or None, signal.signal, (signal.SIGINT, signal.SIG_IGN))
+        else:
+            split_pool = None
+        repair = functools.partial(profile_task, profile=profile or metrics_file is not None,
+                                   manifest=manifest is not None, force=force, incremental=args.incremental,
+                                   stream=stream, verbose=verbose, in_place=in_place,
+                                   splice=splice, rules=rules, export=args.export,
+                                   pool=split_pool, split_size=args.split_size,
+                                   # A pool would pickle the session with each file
+                                   session=RepairSession(rules) if jobs == 1 else None)
+        tasks = ((inpath, manifest and manifest.get(inpath)) for inpath in inpaths)
+        start = time.time()
+        if args.pipeline:
+            pool = None
+            results = (result + (None, None) for result in
+                       pipeline_paths(inpaths, args.pipeline, verbose=verbose, replace=force, rules=rules))
+        elif jobs == 1:
+            pool = None
+            results = (repair(task) for task in tasks)
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs or None)
+            results = pool.imap(repair, tasks)  # results come in input order
+
+        nfiles = nrepaired = nskipped = nbytes = 0
+        try:
+            for ok, size, messages, entry, record in results:
+                nfiles += 1
+                for message in messages:
+                    print(message, file=report)
+                if watch:
+                    latency = time.time() - watcher.arrived
+                    print("Latency {0:.2f}s from arrival, {1} files waiting to settle.".format(
+                            latency, watcher.queue_depth), file=report)
+                    if record is not None:
+                        record.update(latency=latency, queue_depth=watcher.queue_depth)
+                if record is not None:
+                    if profile:
+                        print(RepairMetrics.describe(record), file=report)
+                    if metrics_file is not None:
+                        metrics_file.write(json.dumps(record) + '\n')
+                if ok:
+                    nrepaired += 1
+                elif ok is None:
+                    nskipped += 1
+                nbytes += size
+                if entry is not None:
+                    manifest.update(entry)
+                if watch:
+                    # A watch runs until it is stopped, so keep what it has done
+                    if manifest is not None:
+                        manifest.save()
+                    if metrics_file is not None:
+                        metrics_file.flush()
+                    report.flush()
+        finally:
+            if manifest is not None:
+                manifest.save()
+            if metrics_file is not None:
+                metrics_file.close()
+            if split_pool is not None:
+                split_pool.close()
+                split_pool.join()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        elapsed = time.time() - start
+        if nskipped:
+            print("Skipped {0} files unchanged since their repair.".format(nskipped), file=report)
+        print("Repaired {0} of {1} files, {2} bytes, in {3:.2f}s ({4:.2f} MB/s).".format(
+                nrepaired, nfiles, nbytes, elapsed, nbytes / 1e6 / max(elapsed, 1e-6)), file=report)
+        return 0
+    
+    except KeyboardInterrupt:
+        ### handle keyboard interrupt ###
+        return 0
+    except Exception as e:
+        if DEBUG or TESTRUN:
+            raise(e)
+        indent = len(program_name) * " "
+        sys.stderr.write(program_name + ": " + repr(e) + "\n")
+        sys.stderr.write(indent + "  for help use --help\n")
+        return 2
+
+if __name__ == "__main__":
+    if DEBUG:
+#        sys.argv.append("-h")
+        sys.argv.append("-v")
+#        sys.argv.append("-r")
+    if TESTRUN:
+        import doctest
+        doctest.testmod()
         sys.exit(0)
     sys.exit(main())
\ No newline at end of file